@@ -0,0 +1,195 @@
+import math
+import asyncio
+from collections import deque
+from typing import Dict, Any, List, Optional
+from config import Config
+from metrics import ADMISSION_WAIT, ADMISSION_REJECTED_FULL, ADMISSION_REJECTED_TIMEOUT
+
+class AdmissionRejected(Exception):
+    """请求未被接纳，retry_after为建议的重试等待时间（秒）"""
+    
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class _Waiter:
+    __slots__ = ('key', 'tag', 'event')
+    
+    def __init__(self, key, tag: float):
+        self.key = key
+        self.tag = tag
+        self.event = asyncio.Event()
+
+class AdmissionController:
+    """
+    请求准入控制与加权公平排队
+    全局并发上限（MAX_CONCURRENT_REQUESTS）、API key并发上限和单token并发上限（由调度器按MAX_STREAMS_PER_TOKEN判断）
+    都满足时才放行，否则进入有界等待队列，队列已满或等待超时立即以429拒绝，避免过载时请求堆积到上游超时。
+    排队请求按API key的权重公平调度（虚拟时间戳：每个请求的标记为 max(当前虚拟时间, 该key上一个标记) + 1/权重，
+    总是放行标记最小且key未达并发上限的请求），同一key内部保持先来先服务
+    """
+    
+    EWMA_ALPHA = 0.1
+    RECHECK_INTERVAL = 0.5  # token冷却结束不会触发唤醒，排队请求定期重试
+    
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self._active = 0
+        self._queues: Dict[Any, deque] = {}  # key id -> 按到达顺序排列的_Waiter
+        self._queued = 0
+        self._virtual_time = 0.0
+        self._last_tag: Dict[Any, float] = {}
+        self._service_time = 0.0  # 单个请求占用时长的指数滑动平均（秒）
+        
+        # 统计指标
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+    
+    @property
+    def active(self) -> int:
+        return self._active
+    
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+    
+    @staticmethod
+    def _key_id(api_key):
+        return api_key.id if api_key is not None else None
+    
+    @staticmethod
+    def _key_full(api_key) -> bool:
+        return api_key is not None and bool(api_key.max_concurrency) and api_key.active >= api_key.max_concurrency
+    
+    def _try_acquire(self, tokens: List[str], cursor: Optional[int], api_key) -> Optional[str]:
+        if Config.MAX_CONCURRENT_REQUESTS and self._active >= Config.MAX_CONCURRENT_REQUESTS:
+            return None
+        if self._key_full(api_key):
+            return None
+        token = self.scheduler.acquire(tokens, cursor)
+        if token is not None:
+            self._active += 1
+            self.admitted += 1
+            if api_key is not None:
+                api_key.active += 1
+        return token
+    
+    def _next_waiter(self) -> Optional[_Waiter]:
+        """各key队首中标记最小、且key未达并发上限的请求"""
+        best = None
+        for queue in self._queues.values():
+            waiter = queue[0]
+            if self._key_full(waiter.key):
+                continue
+            if best is None or waiter.tag < best.tag:
+                best = waiter
+        return best
+    
+    def _retry_after(self) -> int:
+        """按平均占用时长和排队长度估算重试等待时间"""
+        service_time = self._service_time or 1.0
+        estimate = service_time * (self._queued + 1) / max(self._active, 1)
+        return min(max(math.ceil(estimate), 1), 60)
+    
+    def _wake(self):
+        waiter = self._next_waiter()
+        if waiter is not None:
+            waiter.event.set()
+    
+    def _remove(self, waiter: _Waiter):
+        key_id = self._key_id(waiter.key)
+        queue = self._queues[key_id]
+        queue.remove(waiter)
+        if not queue:
+            del self._queues[key_id]
+        self._queued -= 1
+    
+    def try_acquire(self, tokens: List[str], cursor: Optional[int] = None, api_key=None) -> Optional[str]:
+        """不排队地获取名额（对冲请求等可选的额外请求使用），有请求在排队或无空闲名额时返回None"""
+        if self._queued:
+            return None
+        return self._try_acquire(tokens, cursor, api_key)
+    
+    async def acquire(self, tokens: List[str], cursor: Optional[int] = None, api_key=None) -> str:
+        """获取一个refresh token的执行名额，无法接纳时抛出AdmissionRejected"""
+        if not self._queued:
+            token = self._try_acquire(tokens, cursor, api_key)
+            if token is not None:
+                return token
+        
+        if self._queued >= Config.ADMISSION_QUEUE_SIZE:
+            self.rejected_full += 1
+            ADMISSION_REJECTED_FULL.inc()
+            raise AdmissionRejected("Server is busy, request queue is full", self._retry_after())
+        
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + Config.ADMISSION_QUEUE_TIMEOUT
+        
+        key_id = self._key_id(api_key)
+        weight = api_key.weight if api_key is not None and api_key.weight > 0 else 1.0
+        tag = max(self._virtual_time, self._last_tag.get(key_id, 0.0)) + 1 / weight
+        self._last_tag[key_id] = tag
+        waiter = _Waiter(api_key, tag)
+        self._queues.setdefault(key_id, deque()).append(waiter)
+        self._queued += 1
+        self.queued += 1
+        try:
+            while True:
+                if self._next_waiter() is waiter:
+                    token = self._try_acquire(tokens, cursor, api_key)
+                    if token is not None:
+                        self._virtual_time = max(self._virtual_time, tag)
+                        return token
+                
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    self.rejected_timeout += 1
+                    ADMISSION_REJECTED_TIMEOUT.inc()
+                    raise AdmissionRejected("Timed out waiting for available capacity", self._retry_after())
+                
+                waiter.event.clear()
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), min(remaining, self.RECHECK_INTERVAL))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._remove(waiter)
+            if not self._queued:
+                # 队列清空后重置虚拟时间，避免标记无限增长
+                self._virtual_time = 0.0
+                self._last_tag.clear()
+            ADMISSION_WAIT.observe(loop.time() - started)
+            # 获取成功时可能还有空闲名额，失败或取消时让出队首
+            self._wake()
+    
+    def release(self, token: str, error: Optional[Exception] = None, held: Optional[float] = None, api_key=None):
+        """请求结束时释放名额并唤醒下一个排队请求"""
+        self.scheduler.release(token, error)
+        self._active = max(self._active - 1, 0)
+        if api_key is not None:
+            api_key.active = max(api_key.active - 1, 0)
+        if held is not None:
+            if self._service_time:
+                self._service_time += self.EWMA_ALPHA * (held - self._service_time)
+            else:
+                self._service_time = held
+        self._wake()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'active': self._active,
+            'max_concurrent_requests': Config.MAX_CONCURRENT_REQUESTS,
+            'max_streams_per_token': Config.MAX_STREAMS_PER_TOKEN,
+            'queue_depth': self._queued,
+            'queue_by_key': {str(key_id): len(queue) for key_id, queue in self._queues.items()},
+            'queue_size': Config.ADMISSION_QUEUE_SIZE,
+            'queue_timeout': Config.ADMISSION_QUEUE_TIMEOUT,
+            'service_time': round(self._service_time, 3),
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'rejected_full': self.rejected_full,
+            'rejected_timeout': self.rejected_timeout
+        }
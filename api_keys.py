@@ -0,0 +1,307 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import secrets
+import tempfile
+from typing import Dict, Any, List, Optional
+from config import Config
+
+def hash_key(raw_key: str) -> bytes:
+    return hashlib.sha256(raw_key.encode('utf-8')).digest()
+
+class ApiKey:
+    """
+    API key及其配额
+    weight为争用时的吞吐份额，max_concurrency为并发上限（0表示不限制），
+    rps/burst为令牌桶限速（rps为0表示不限速）
+    """
+    __slots__ = ('id', 'name', 'key_hash', 'prefix', 'weight', 'max_concurrency', 'rps', 'burst',
+                 'created_at', 'active', 'tokens', 'refilled_at', 'requests', 'rate_limited')
+    
+    # 可修改的配额及其默认值（不限制）
+    DEFAULTS = {'weight': 1.0, 'max_concurrency': 0, 'rps': 0.0, 'burst': None}
+    
+    def __init__(self, id: str, name: str, key_hash: Optional[bytes], prefix: str = '', weight: float = 1.0,
+                 max_concurrency: int = 0, rps: float = 0.0, burst: Optional[float] = None,
+                 created_at: Optional[float] = None):
+        self.id = id
+        self.name = name
+        self.key_hash = key_hash
+        self.prefix = prefix
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.rps = rps
+        self.burst = burst
+        self.created_at = created_at or time.time()
+        self.active = 0
+        self.tokens = self.capacity
+        self.refilled_at = time.monotonic()
+        self.requests = 0
+        self.rate_limited = 0
+    
+    @property
+    def capacity(self) -> float:
+        return max(self.burst or self.rps, 1.0)
+    
+    def consume(self) -> float:
+        """令牌桶取一个令牌，成功返回0并计入请求数，否则返回需要等待的秒数"""
+        if self.rps <= 0:
+            self.requests += 1
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.refilled_at) * self.rps)
+        self.refilled_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.requests += 1
+            return 0.0
+        self.rate_limited += 1
+        return (1 - self.tokens) / self.rps
+    
+    def update(self, settings: Dict[str, Any]):
+        """修改名称和配额，只修改settings中出现的字段，配额为None时恢复默认"""
+        if settings.get('name'):
+            self.name = settings['name']
+        for field, default in self.DEFAULTS.items():
+            if field in settings:
+                value = settings[field]
+                setattr(self, field, default if value is None else value)
+        self.tokens = self.capacity
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'prefix': self.prefix,
+            'weight': self.weight,
+            'max_concurrency': self.max_concurrency,
+            'rps': self.rps,
+            'burst': self.burst,
+            'created_at': int(self.created_at),
+            'active': self.active,
+            'requests': self.requests,
+            'rate_limited': self.rate_limited
+        }
+    
+    def to_record(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'key_hash': self.key_hash.hex() if self.key_hash else None,
+            'prefix': self.prefix,
+            'weight': self.weight,
+            'max_concurrency': self.max_concurrency,
+            'rps': self.rps,
+            'burst': self.burst,
+            'created_at': self.created_at
+        }
+
+class ApiKeyRegistry:
+    """
+    API key注册表
+    只保存key的SHA-256摘要，按摘要哈希查找（O(1)）；Config.AUTH_KEY始终作为id为default的key，
+    其配额同样可以修改；key和配额保存在API_KEYS_FILE中，多worker部署时由ApiKeyRegistrySync同步
+    """
+    
+    DEFAULT_ID = 'default'
+    
+    def __init__(self, state_file: Optional[str] = None):
+        self.state_file = state_file if state_file is not None else Config.API_KEYS_FILE
+        self._by_hash: Dict[bytes, ApiKey] = {}
+        self._by_id: Dict[str, ApiKey] = {}
+        self.default = ApiKey(self.DEFAULT_ID, 'default', None)
+        self._default_source: Optional[str] = None
+        self._load()
+    
+    def _default_hash(self) -> Optional[bytes]:
+        """AUTH_KEY可以在运行时修改，变化时重新计算摘要"""
+        if self._default_source != Config.AUTH_KEY:
+            self._default_source = Config.AUTH_KEY
+            self.default.key_hash = hash_key(Config.AUTH_KEY) if Config.AUTH_KEY else None
+            self.default.prefix = Config.AUTH_KEY[:6] if Config.AUTH_KEY else ''
+        return self.default.key_hash
+    
+    def authenticate(self, raw_key: str) -> Optional[ApiKey]:
+        digest = hash_key(raw_key)
+        api_key = self._by_hash.get(digest)
+        if api_key is None and digest == self._default_hash():
+            api_key = self.default
+        return api_key
+    
+    def get(self, key_id: str) -> Optional[ApiKey]:
+        if key_id == self.DEFAULT_ID:
+            return self.default
+        return self._by_id.get(key_id)
+    
+    def list(self) -> List[Dict[str, Any]]:
+        self._default_hash()
+        return [self.default.to_dict()] + [api_key.to_dict() for api_key in self._by_id.values()]
+    
+    def create(self, settings: Dict[str, Any], raw_key: Optional[str] = None) -> tuple:
+        """创建key，未指定时随机生成；返回(ApiKey, 原始key)，原始key只在创建时返回一次"""
+        raw_key = raw_key or f"sk-{secrets.token_urlsafe(32)}"
+        digest = hash_key(raw_key)
+        if digest in self._by_hash or digest == self._default_hash():
+            raise ValueError("API key already exists")
+        api_key = ApiKey(uuid.uuid4().hex[:8], settings.get('name') or 'unnamed', digest, raw_key[:6])
+        api_key.update(settings)
+        self._by_hash[digest] = api_key
+        self._by_id[api_key.id] = api_key
+        self._save()
+        return api_key, raw_key
+    
+    def update(self, key_id: str, settings: Dict[str, Any]) -> Optional[ApiKey]:
+        api_key = self.get(key_id)
+        if api_key is None:
+            return None
+        api_key.update(settings)
+        self._save()
+        return api_key
+    
+    def remove(self, key_id: str) -> Optional[ApiKey]:
+        api_key = self._by_id.pop(key_id, None)
+        if api_key is None:
+            return None
+        self._by_hash.pop(api_key.key_hash, None)
+        self._save()
+        return api_key
+    
+    def all(self) -> List[ApiKey]:
+        return [self.default] + list(self._by_id.values())
+    
+    def record(self, api_key: ApiKey) -> Dict[str, Any]:
+        """key的保存记录（默认key只保存配额）"""
+        if api_key is self.default:
+            return dict(api_key.to_record(), key_hash=None, prefix='')
+        return api_key.to_record()
+    
+    def records(self) -> List[Dict[str, Any]]:
+        return [self.record(api_key) for api_key in self.all()]
+    
+    @staticmethod
+    def _changed(api_key: ApiKey, record: Dict[str, Any]) -> bool:
+        return any(
+            record.get(field, getattr(api_key, field)) != getattr(api_key, field)
+            for field in ('name', *ApiKey.DEFAULTS)
+        )
+    
+    def load(self, records: List[Dict[str, Any]], replace: bool = False):
+        """
+        加载key记录，replace为True时移除记录中没有的key
+        已存在的key只在配额变化时原地更新，保留并发占用、令牌桶和计数
+        """
+        seen = set()
+        for record in records:
+            seen.add(record['id'])
+            if record['id'] == self.DEFAULT_ID:
+                api_key = self.default
+            else:
+                api_key = self._by_id.get(record['id'])
+                if api_key is None:
+                    api_key = ApiKey(
+                        record['id'], record['name'], bytes.fromhex(record['key_hash']), record.get('prefix', ''),
+                        created_at=record.get('created_at')
+                    )
+                    api_key.update(record)
+                    self._by_hash[api_key.key_hash] = api_key
+                    self._by_id[api_key.id] = api_key
+                    continue
+            if self._changed(api_key, record):
+                api_key.update(record)
+        if replace:
+            for key_id in [key_id for key_id in self._by_id if key_id not in seen]:
+                self._by_hash.pop(self._by_id.pop(key_id).key_hash, None)
+    
+    def _load(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except:
+            return
+        self.load(records)
+    
+    def _save(self):
+        """原子写入key和配额，每次写入使用独立的临时文件，多个worker同时写入时不会互相覆盖临时文件"""
+        if not self.state_file:
+            return
+        directory = os.path.dirname(os.path.abspath(self.state_file))
+        with tempfile.NamedTemporaryFile(
+            'w', encoding='utf-8', dir=directory, prefix='.api_keys.', suffix='.tmp', delete=False
+        ) as f:
+            json.dump(self.records(), f, ensure_ascii=False, indent=2)
+        os.replace(f.name, self.state_file)
+
+class ApiKeyRegistrySync:
+    """
+    通过共享状态后端在多个worker之间同步API key及其配额设置
+    与TokenRegistrySync相同：修改后递增版本号，其它worker定期检查版本并整体重新加载。
+    并发占用和令牌桶状态不共享，max_concurrency和rps/burst按每个worker分别生效
+    """
+    
+    KEYS_KEY = 'kimi2api:api_keys'
+    VERSION_KEY = 'kimi2api:api_keys:version'
+    
+    def __init__(self, registry: ApiKeyRegistry, backend, interval: float = 1.0):
+        self.registry = registry
+        self.backend = backend
+        self.interval = interval
+        self._version = None
+        self._task: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        """启动时以后端为准；后端为空时把本地key发布出去"""
+        if not self.backend.shared:
+            return
+        if not await self.pull():
+            await self.publish(self.registry.records(), [])
+        self._task = asyncio.create_task(self._sync_loop())
+    
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+    
+    async def publish(self, changed: List[Dict[str, Any]], removed: List[str]):
+        """发布本worker修改的key记录和删除的key id"""
+        if not self.backend.shared or not (changed or removed):
+            return
+        if changed:
+            await self.backend.hset(self.KEYS_KEY, {
+                record['id']: json.dumps(record, ensure_ascii=False) for record in changed
+            })
+        if removed:
+            await self.backend.hdel(self.KEYS_KEY, *removed)
+        previous = self._version
+        version = await self.backend.incr(self.VERSION_KEY)
+        if previous is not None and version == previous + 1:
+            self._version = version
+        else:
+            # 期间有其它worker发布过修改，下次同步时整体重新加载
+            self._version = None
+    
+    async def pull(self) -> bool:
+        """版本变化时从后端重新加载全部key，后端没有数据时返回False"""
+        version = await self.backend.get(self.VERSION_KEY)
+        if version is None:
+            return False
+        version = int(version)
+        if version != self._version:
+            values = await self.backend.hgetall(self.KEYS_KEY)
+            self.registry.load([json.loads(value) for value in values.values()], replace=True)
+            self._version = version
+        return True
+    
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.pull()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass
@@ -0,0 +1,95 @@
+"""
+非流式累积内存基准：并发运行N个长响应，对比内部事件/累积方式的峰值内存
+
+用法:
+    python benchmarks/bench_completion_memory.py
+    python benchmarks/bench_completion_memory.py --concurrency 1000 --deltas 2000
+
+每种模式在独立子进程中运行，分别报告 tracemalloc 峰值和进程峰值RSS
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import resource
+import subprocess
+import tracemalloc
+from typing import Optional, Dict, Any
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pydantic import BaseModel
+from models import KimiStreamEvent
+from response_processor import ResponseProcessor
+
+class LegacyKimiStreamEvent(BaseModel):
+    """旧的pydantic事件类型"""
+    event: str
+    text: Optional[str] = None
+    id: Optional[str] = None
+    msg: Optional[Dict[str, Any]] = None
+
+async def fake_stream(event_cls, deltas: int, text: str):
+    yield event_cls(event="req", id="conv")
+    for i in range(deltas):
+        # 每个增量都是新的字符串对象，与真实解析结果一致
+        yield event_cls(event="cmpl", text=text[:-1] + text[-1])
+        if i % 50 == 0:
+            await asyncio.sleep(0)
+    yield event_cls(event="all_done")
+
+async def legacy_completion(stream) -> str:
+    """旧实现的累积循环（配合pydantic事件使用）"""
+    content = ""
+    async for event in stream:
+        if event.event == 'cmpl' and event.text:
+            content += event.text
+        elif event.event == 'all_done':
+            break
+    return content
+
+async def current_completion(stream) -> str:
+    response = await ResponseProcessor("Kimi-K2", "conv").process_stream_to_completion(stream)
+    return response.choices[0].message.content
+
+async def run_mode(mode: str, concurrency: int, deltas: int, text: str):
+    if mode == 'legacy':
+        jobs = [legacy_completion(fake_stream(LegacyKimiStreamEvent, deltas, text)) for _ in range(concurrency)]
+    else:
+        jobs = [current_completion(fake_stream(KimiStreamEvent, deltas, text)) for _ in range(concurrency)]
+    return await asyncio.gather(*jobs)
+
+def child(mode: str, concurrency: int, deltas: int, text: str):
+    tracemalloc.start()
+    start = time.perf_counter()
+    results = asyncio.run(run_mode(mode, concurrency, deltas, text))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    assert all(len(result) == deltas * len(text) for result in results)
+    print(f"{mode:<8} traced peak {peak / 1e6:>8.1f} MB  max RSS {max_rss:>8.1f} MB  {elapsed:.2f} s")
+
+def main():
+    parser = argparse.ArgumentParser(description="completion accumulation memory benchmark")
+    parser.add_argument('--concurrency', type=int, default=1000)
+    parser.add_argument('--deltas', type=int, default=1000)
+    parser.add_argument('--text', default='你好，世界')
+    parser.add_argument('--mode', choices=['legacy', 'current'])
+    args = parser.parse_args()
+    
+    if args.mode:
+        child(args.mode, args.concurrency, args.deltas, args.text)
+        return
+    
+    for mode in ('current', 'legacy'):
+        subprocess.run([
+            sys.executable, __file__, '--mode', mode,
+            '--concurrency', str(args.concurrency),
+            '--deltas', str(args.deltas),
+            '--text', args.text
+        ], check=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+SSE序列化微基准：对比StreamChunkSerializer与逐chunk构建pydantic模型的吞吐（单核chunks/s）
+
+用法:
+    python benchmarks/bench_sse_serializer.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import ChatCompletionStreamResponse, StreamChoice
+from response_processor import StreamChunkSerializer
+
+CHUNK_ID = "chatcmpl-19283746"
+CREATED = 1700000000
+MODEL = "Kimi-K2"
+
+def pydantic_chunk(text: str) -> bytes:
+    """旧实现：每个delta构建一棵pydantic模型树"""
+    chunk = ChatCompletionStreamResponse(
+        id=CHUNK_ID,
+        object="chat.completion.chunk",
+        created=CREATED,
+        model=MODEL,
+        choices=[StreamChoice(index=0, delta={"content": text}, finish_reason=None)]
+    )
+    return f"data: {chunk.model_dump_json()}\n\n".encode('utf-8')
+
+def run(name: str, func, samples: list, repeat: int):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in samples:
+            func(text)
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<10} {len(samples) / best:>12,.0f} chunks/s")
+
+def main():
+    samples = ['你好', '，', 'Hello', ' "quoted"', '\n\n', '```python\n', 'back\\slash', '😀'] * 25000
+    serializer = StreamChunkSerializer(CHUNK_ID, CREATED, MODEL)
+    mismatches = sum(1 for text in set(samples) if serializer.content(text) != pydantic_chunk(text))
+    print(f"samples: {len(samples)}, golden mismatches: {mismatches}")
+    run('serializer', serializer.content, samples, 5)
+    run('pydantic', pydantic_chunk, samples, 5)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+流解析微基准：测量KimiStreamParser每秒可解析的帧数
+
+用法:
+    python benchmarks/bench_stream_parser.py
+    python benchmarks/bench_stream_parser.py --file recorded_stream.bin --chunk-size 1024
+
+--file 为抓包得到的 ChatService/Chat 原始响应体（Connect envelope 字节流）
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from connect_codec import encode_envelope, HEADER_SIZE, ENVELOPE_HEADER
+from kimi_stream_parser import KimiStreamParser
+
+def build_stream(frames: int, text_size: int) -> bytes:
+    """构造与Kimi响应形状一致的合成流"""
+    parts = []
+    for i in range(frames):
+        message = {
+            "op": "append",
+            "mask": "block.text.content",
+            "eventOffset": i,
+            "block": {"id": "0", "text": {"content": "字" * text_size}}
+        }
+        parts.append(encode_envelope(json.dumps(message, ensure_ascii=False).encode('utf-8')))
+    parts.append(encode_envelope(b'{"done":{}}'))
+    return b''.join(parts)
+
+def split_chunks(data: bytes, chunk_size: int) -> list:
+    return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+def naive_decode(chunks: list) -> int:
+    """旧实现的缓冲方式：每帧重新切片整个剩余缓冲区"""
+    buffer = b""
+    count = 0
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= HEADER_SIZE:
+            _, length = ENVELOPE_HEADER.unpack_from(buffer, 0)
+            if len(buffer) < HEADER_SIZE + length:
+                break
+            json.loads(buffer[HEADER_SIZE:HEADER_SIZE + length])
+            buffer = buffer[HEADER_SIZE + length:]
+            count += 1
+    return count
+
+def parser_decode(chunks: list) -> int:
+    parser = KimiStreamParser()
+    count = 0
+    for chunk in chunks:
+        for _ in parser.parse_stream_data(chunk):
+            count += 1
+    return count
+
+def run(name: str, func, chunks: list, total_bytes: int, repeat: int):
+    best = float('inf')
+    frames = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        frames = func(chunks)
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<10} {frames / best:>12,.0f} frames/s  {total_bytes / best / 1e6:>8.1f} MB/s  ({frames} frames, {best * 1000:.1f} ms)")
+
+def main():
+    parser = argparse.ArgumentParser(description="KimiStreamParser micro-benchmark")
+    parser.add_argument('--file', help='recorded raw Connect stream')
+    parser.add_argument('--frames', type=int, default=20000)
+    parser.add_argument('--text-size', type=int, default=2)
+    parser.add_argument('--chunk-size', type=int, default=65536)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    
+    if args.file:
+        with open(args.file, 'rb') as f:
+            data = f.read()
+    else:
+        data = build_stream(args.frames, args.text_size)
+    
+    chunks = split_chunks(data, args.chunk_size)
+    print(f"stream: {len(data):,} bytes in {len(chunks)} chunks of {args.chunk_size} bytes")
+    run('parser', parser_decode, chunks, len(data), args.repeat)
+    run('naive', naive_decode, chunks, len(data), args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+文本校验微基准：对比KimiStreamParser._is_valid_text与旧的逐字符实现
+
+用法:
+    python benchmarks/bench_text_validation.py
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kimi_stream_parser import KimiStreamParser
+
+def legacy_is_valid_text(text: str) -> bool:
+    """旧实现，用于对比和一致性校验"""
+    if not text:
+        return False
+    printable_count = sum(1 for char in text if char.isprintable() or char in '\n\r\t ')
+    if len(text) > 1 and printable_count / len(text) < 0.5:
+        return False
+    if not text.strip():
+        return False
+    if '�' in text:
+        return False
+    return True
+
+def build_samples(count: int) -> list:
+    """构造与Kimi增量相近的文本片段，包含少量异常样本"""
+    rng = random.Random(0)
+    pool = ['你好', '，', 'Hello', ' world', '\n\n', '```python\n', '数据', '。', '\t', ' ']
+    samples = [''.join(rng.choice(pool) for _ in range(rng.randint(1, 6))) for _ in range(count)]
+    samples += ['\x00\x01\x02', '�', '   ', 'ok\x07', '']
+    return samples
+
+def run(name: str, func, samples: list, repeat: int):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in samples:
+            func(text)
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<8} {best / len(samples) * 1e9:>8.1f} ns/chunk")
+
+def main():
+    samples = build_samples(200000)
+    parser = KimiStreamParser()
+    mismatches = [text for text in samples if parser._is_valid_text(text) != legacy_is_valid_text(text)]
+    print(f"samples: {len(samples)}, mismatches: {len(mismatches)}")
+    run('current', parser._is_valid_text, samples, 5)
+    run('legacy', legacy_is_valid_text, samples, 5)
+
+if __name__ == "__main__":
+    main()
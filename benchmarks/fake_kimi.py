@@ -0,0 +1,125 @@
+"""
+本地模拟Kimi上游，用于压测和CI（不访问真实Kimi）
+
+实现 /api/auth/token/refresh、/api/chat（创建/删除会话）和 Connect 协议的 ChatService/Chat 流式接口，
+可配置输出速率、每帧字符数、每次写入的帧数、抖动和错误注入。
+
+用法:
+    python benchmarks/fake_kimi.py --port 9000 --tokens 200 --token-rate 100 --error-rate 0.01
+    KIMI_BASE_URL=http://127.0.0.1:9000 python main.py
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jwt
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from connect_codec import encode_envelope, FLAG_END_STREAM
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Fake Kimi upstream")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--tokens', type=int, default=200, help="每个回复的增量帧数")
+    parser.add_argument('--token-rate', type=float, default=0, help="每秒输出的增量帧数，0表示不限速")
+    parser.add_argument('--frame-chars', type=int, default=4, help="每个增量帧的字符数")
+    parser.add_argument('--frames-per-write', type=int, default=1, help="每次写入合并的帧数")
+    parser.add_argument('--first-token-delay', type=float, default=0.0, help="首个增量前的延迟(秒)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="延迟随机抖动比例，如0.2表示±20%%")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Chat请求直接返回错误的概率")
+    parser.add_argument('--error-status', type=int, default=500, help="注入错误的HTTP状态码，如429/500")
+    parser.add_argument('--abort-rate', type=float, default=0.0, help="流中途断开（不发送结束帧）的概率")
+    parser.add_argument('--refresh-error-rate', type=float, default=0.0, help="刷新access token失败的概率")
+    parser.add_argument('--access-token-ttl', type=int, default=3600)
+    return parser.parse_args(argv)
+
+def create_app(settings: argparse.Namespace) -> FastAPI:
+    app = FastAPI(title="Fake Kimi")
+    stats = {'refresh': 0, 'created': 0, 'deleted': 0, 'chats': 0, 'errors': 0, 'aborted': 0}
+    
+    # 帧内容与请求无关，预先编码
+    delta_frame = encode_envelope(json.dumps({
+        'op': 'append',
+        'mask': 'block.text.content',
+        'block': {'text': {'content': ('token ' * settings.frame_chars)[:settings.frame_chars]}}
+    }).encode('utf-8'))
+    done_frame = encode_envelope(json.dumps({'done': {}}).encode('utf-8'))
+    end_frame = encode_envelope(b'{}', FLAG_END_STREAM)
+    frames_per_write = max(settings.frames_per_write, 1)
+    write_interval = frames_per_write / settings.token_rate if settings.token_rate > 0 else 0
+    
+    def jittered(delay: float) -> float:
+        if not settings.jitter:
+            return delay
+        return delay * random.uniform(1 - settings.jitter, 1 + settings.jitter)
+    
+    @app.get("/api/auth/token/refresh")
+    async def refresh():
+        stats['refresh'] += 1
+        if random.random() < settings.refresh_error_rate:
+            return JSONResponse(status_code=401, content={'error': 'injected'})
+        access_token = jwt.encode(
+            {'exp': int(time.time()) + settings.access_token_ttl, 'jti': uuid.uuid4().hex},
+            'fake-kimi', algorithm='HS256'
+        )
+        return {'access_token': access_token, 'refresh_token': ''}
+    
+    @app.post("/api/chat")
+    async def create_conversation():
+        stats['created'] += 1
+        return {'id': uuid.uuid4().hex}
+    
+    @app.delete("/api/chat/{conv_id}")
+    async def delete_conversation(conv_id: str):
+        stats['deleted'] += 1
+        return {}
+    
+    @app.post("/apiv2/kimi.chat.v1.ChatService/Chat")
+    async def chat(request: Request):
+        await request.body()
+        stats['chats'] += 1
+        if random.random() < settings.error_rate:
+            stats['errors'] += 1
+            return JSONResponse(status_code=settings.error_status, content={'error': 'injected'})
+        abort_at = random.randrange(settings.tokens) if random.random() < settings.abort_rate else None
+        
+        async def frames():
+            if settings.first_token_delay:
+                await asyncio.sleep(jittered(settings.first_token_delay))
+            sent = 0
+            while sent < settings.tokens:
+                count = min(frames_per_write, settings.tokens - sent)
+                if abort_at is not None and sent + count > abort_at:
+                    stats['aborted'] += 1
+                    yield delta_frame * (abort_at - sent)
+                    return
+                yield delta_frame * count
+                sent += count
+                if write_interval:
+                    await asyncio.sleep(jittered(write_interval))
+            yield done_frame + end_frame
+        
+        return StreamingResponse(frames(), media_type='application/connect+json')
+    
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+    
+    return app
+
+def main():
+    settings = parse_args()
+    uvicorn.run(create_app(settings), host=settings.host, port=settings.port, log_level='warning')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+"""
+/v1/chat/completions 压测：固定并发下测量RPS、TTFB/TTFT分位数和每个请求的服务端CPU时间，结果保存为JSON便于版本间对比
+
+默认自动启动本地模拟上游（fake_kimi.py）和kimi2api，也可以用 --target 压测已运行的服务
+（配合 --server-pid 统计CPU）。
+
+用法:
+    python benchmarks/load_test.py --mode stream --concurrency 64 --duration 20 --output results.json
+    python benchmarks/load_test.py --fake-args "--tokens 500 --token-rate 200 --jitter 0.2" --compare results.json
+    python benchmarks/load_test.py --target http://127.0.0.1:8000 --server-pid 12345
+"""
+import os
+import sys
+import json
+import time
+import shlex
+import socket
+import asyncio
+import argparse
+import platform
+import subprocess
+from typing import Dict, Any, List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONTENT_MARKER = b'{"content":'
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="kimi2api load test")
+    parser.add_argument('--mode', choices=('stream', 'completion', 'both'), default='both')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=15, help="每种模式的压测时长(秒)")
+    parser.add_argument('--warmup', type=float, default=2, help="预热时长(秒)，不计入结果")
+    parser.add_argument('--target', help="已运行的kimi2api地址，不指定时自动启动模拟上游和kimi2api")
+    parser.add_argument('--server-pid', type=int, help="--target模式下用于统计CPU的kimi2api进程id")
+    parser.add_argument('--auth-key', default=os.getenv('AUTH_KEY', 'kimi2api-auth-key-2024'))
+    parser.add_argument('--refresh-tokens', type=int, default=4, help="自动启动时配置的refresh token数量")
+    parser.add_argument('--fake-args', default='', help="传给fake_kimi.py的参数")
+    parser.add_argument('--server-env', action='append', default=[], help="传给kimi2api的环境变量，如 STREAM_COALESCE_MAX_DELAY_MS=20")
+    parser.add_argument('--output', help="结果JSON路径")
+    parser.add_argument('--compare', help="与之前保存的结果JSON对比")
+    return parser.parse_args()
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for(url: str, timeout: float = 20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Service did not start: {url}")
+
+def cpu_seconds(pid: Optional[int]) -> Optional[float]:
+    """读取进程累计CPU时间（Linux /proc），不可用时返回None"""
+    if pid is None:
+        return None
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, IndexError, ValueError):
+        return None
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(int(round(q / 100 * (len(values) - 1))), len(values) - 1)
+    return round(values[index] * 1000, 2)
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def fake_refresh_tokens(count: int) -> List[str]:
+    import jwt
+    exp = int(time.time()) + 30 * 24 * 3600
+    return [jwt.encode({'exp': exp, 'sub': f'load-test-{i}'}, 'load-test', algorithm='HS256') for i in range(count)]
+
+class Services:
+    """启动模拟上游和kimi2api子进程"""
+    
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.processes: List[subprocess.Popen] = []
+        self.workdir = os.path.join(ROOT, 'benchmarks', '.load_test')
+        self.target = None
+        self.server_pid = None
+    
+    def start(self):
+        os.makedirs(self.workdir, exist_ok=True)
+        fake_port = free_port()
+        self.processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'benchmarks', 'fake_kimi.py'), '--port', str(fake_port)]
+            + shlex.split(self.args.fake_args)
+        ))
+        wait_for(f'http://127.0.0.1:{fake_port}/stats')
+        
+        port = free_port()
+        env = dict(os.environ)
+        env.update({
+            'KIMI_BASE_URL': f'http://127.0.0.1:{fake_port}',
+            'REFRESH_TOKENS': ','.join(fake_refresh_tokens(self.args.refresh_tokens)),
+            'AUTH_KEY': self.args.auth_key,
+            'TOKEN_STORE_PATH': '',
+            'DELETE_QUEUE_FILE': os.path.join(self.workdir, 'pending_deletions.json'),
+        })
+        for item in self.args.server_env:
+            key, _, value = item.partition('=')
+            env[key] = value
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port),
+             '--log-level', 'warning', '--no-access-log'],
+            cwd=self.workdir, env=dict(env, PYTHONPATH=ROOT)
+        )
+        self.processes.append(server)
+        self.target = f'http://127.0.0.1:{port}'
+        self.server_pid = server.pid
+        wait_for(f'{self.target}/ping')
+    
+    def stop(self):
+        for process in reversed(self.processes):
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+async def one_request(client: httpx.AsyncClient, url: str, headers: Dict[str, str], stream: bool) -> Dict[str, Any]:
+    body = {
+        'model': 'Kimi-K2',
+        'stream': stream,
+        'messages': [{'role': 'user', 'content': 'load test'}]
+    }
+    started = time.perf_counter()
+    ttfb = ttft = None
+    size = 0
+    failed = False
+    last = b''
+    async with client.stream('POST', url, json=body, headers=headers) as response:
+        async for chunk in response.aiter_bytes():
+            now = time.perf_counter()
+            if ttfb is None:
+                ttfb = now - started
+            if ttft is None and stream and CONTENT_MARKER in chunk:
+                ttft = now - started
+            if stream and b'data: {"error"' in chunk:
+                failed = True
+            size += len(chunk)
+            last = chunk
+        # 流式响应必须以[DONE]正常结束
+        ok = response.status_code == 200 and not failed and (not stream or last.endswith(b'data: [DONE]\n\n'))
+    latency = time.perf_counter() - started
+    return {
+        'ok': ok, 'status': response.status_code, 'ttfb': ttfb,
+        'ttft': ttft if stream else latency, 'latency': latency, 'bytes': size
+    }
+
+async def run_mode(target: str, args: argparse.Namespace, stream: bool, server_pid: Optional[int]) -> Dict[str, Any]:
+    url = f'{target}/v1/chat/completions'
+    headers = {'Authorization': f'Bearer {args.auth_key}'}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results: List[Dict[str, Any]] = []
+    errors = 0
+    rejected = 0  # 准入控制返回的429
+    
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        async def worker(deadline: float, record: bool):
+            nonlocal errors, rejected
+            while time.perf_counter() < deadline:
+                try:
+                    result = await one_request(client, url, headers, stream)
+                except httpx.HTTPError:
+                    result = {'ok': False, 'status': None}
+                if not record:
+                    continue
+                if result['ok']:
+                    results.append(result)
+                elif result['status'] == 429:
+                    rejected += 1
+                else:
+                    errors += 1
+        
+        if args.warmup > 0:
+            deadline = time.perf_counter() + args.warmup
+            await asyncio.gather(*(worker(deadline, False) for _ in range(args.concurrency)))
+        
+        cpu_before = cpu_seconds(server_pid)
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(worker(deadline, True) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        cpu_after = cpu_seconds(server_pid)
+    
+    completed = len(results)
+    cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    ttfb = [r['ttfb'] for r in results if r['ttfb'] is not None]
+    ttft = [r['ttft'] for r in results if r['ttft'] is not None]
+    latency = [r['latency'] for r in results]
+    return {
+        'requests': completed,
+        'errors': errors,
+        'rejected': rejected,
+        'duration': round(elapsed, 3),
+        'rps': round(completed / elapsed, 2),
+        'ttfb_p50_ms': percentile(ttfb, 50),
+        'ttfb_p99_ms': percentile(ttfb, 99),
+        'ttft_p50_ms': percentile(ttft, 50),
+        'ttft_p99_ms': percentile(ttft, 99),
+        'latency_p50_ms': percentile(latency, 50),
+        'latency_p99_ms': percentile(latency, 99),
+        'bytes_per_request': round(sum(r['bytes'] for r in results) / completed) if completed else 0,
+        'server_cpu_seconds': round(cpu, 3) if cpu is not None else None,
+        'cpu_ms_per_request': round(cpu * 1000 / completed, 3) if cpu is not None and completed else None
+    }
+
+def print_results(results: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    for mode, metrics in results.items():
+        print(f"\n[{mode}]")
+        previous = (baseline or {}).get(mode, {})
+        for key, value in metrics.items():
+            line = f"  {key:<22} {value}"
+            old = previous.get(key)
+            if isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+                line += f"  ({(value - old) / old * 100:+.1f}% vs {old})"
+            print(line)
+
+async def main():
+    args = parse_args()
+    services = None
+    target = args.target
+    server_pid = args.server_pid
+    if target is None:
+        services = Services(args)
+        services.start()
+        target = services.target
+        server_pid = services.server_pid
+    
+    modes = ['stream', 'completion'] if args.mode == 'both' else [args.mode]
+    results = {}
+    try:
+        for mode in modes:
+            results[mode] = await run_mode(target, args, mode == 'stream', server_pid)
+    finally:
+        if services is not None:
+            services.stop()
+    
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get('results')
+    print_results(results, baseline)
+    
+    if args.output:
+        report = {
+            'timestamp': int(time.time()),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'config': {
+                'concurrency': args.concurrency,
+                'duration': args.duration,
+                'warmup': args.warmup,
+                'refresh_tokens': args.refresh_tokens,
+                'fake_args': args.fake_args,
+                'server_env': args.server_env,
+                'target': args.target
+            },
+            'results': results
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -22,12 +22,94 @@ class Config:
     MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('MAX_KEEPALIVE_CONNECTIONS', 500))
     KEEPALIVE_EXPIRY = int(os.getenv('KEEPALIVE_EXPIRY', 10))
     
+    # 上游HTTP客户端配置
+    KIMI_BASE_URL = os.getenv('KIMI_BASE_URL', 'https://www.kimi.com').rstrip('/')
+    HTTP2_ENABLED = os.getenv('HTTP2_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    CONNECT_TIMEOUT = float(os.getenv('CONNECT_TIMEOUT', 10))
+    REFRESH_TIMEOUT = float(os.getenv('REFRESH_TIMEOUT', 15))
+    CONVERSATION_TIMEOUT = float(os.getenv('CONVERSATION_TIMEOUT', 15))
+    CHAT_TIMEOUT = float(os.getenv('CHAT_TIMEOUT', 60))
+    
+    # Access Token缓存配置（秒）
+    ACCESS_TOKEN_EXPIRY_MARGIN = int(os.getenv('ACCESS_TOKEN_EXPIRY_MARGIN', 60))
+    ACCESS_TOKEN_RENEW_BEFORE = int(os.getenv('ACCESS_TOKEN_RENEW_BEFORE', 300))
+    ACCESS_TOKEN_RENEW_JITTER = int(os.getenv('ACCESS_TOKEN_RENEW_JITTER', 60))
+    ACCESS_TOKEN_IDLE_TTL = int(os.getenv('ACCESS_TOKEN_IDLE_TTL', 3600))
+    
+    # 预创建会话池配置
+    CONV_POOL_ENABLED = os.getenv('CONV_POOL_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    CONV_POOL_LOW_WATERMARK = int(os.getenv('CONV_POOL_LOW_WATERMARK', 1))
+    CONV_POOL_HIGH_WATERMARK = int(os.getenv('CONV_POOL_HIGH_WATERMARK', 2))
+    CONV_POOL_MAX_SIZE = int(os.getenv('CONV_POOL_MAX_SIZE', 16))
+    CONV_POOL_REFILL_WINDOW = float(os.getenv('CONV_POOL_REFILL_WINDOW', 10))
+    CONV_POOL_TTL = int(os.getenv('CONV_POOL_TTL', 600))
+    CONV_POOL_REAP_INTERVAL = int(os.getenv('CONV_POOL_REAP_INTERVAL', 60))
+    
+    # 多轮对话会话亲和：按消息前缀复用Kimi会话，记录按TTL(秒)过期，条数和估算内存(字节)不超过上限
+    SESSION_AFFINITY_ENABLED = os.getenv('SESSION_AFFINITY_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    SESSION_AFFINITY_TTL = int(os.getenv('SESSION_AFFINITY_TTL', 1800))
+    SESSION_AFFINITY_MAX_ENTRIES = int(os.getenv('SESSION_AFFINITY_MAX_ENTRIES', 10000))
+    SESSION_AFFINITY_MAX_BYTES = int(os.getenv('SESSION_AFFINITY_MAX_BYTES', 8 * 1024 * 1024))
+    
+    # 响应缓存（默认关闭）：相同模型、消息和采样参数的请求直接重放缓存的输出，相同的并发请求共享一次上游生成
+    RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 300))
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    
+    # 对冲请求（默认关闭）：主请求首token耗时超过最近首token耗时的分位数时在另一个token上发起备份请求，
+    # 延迟限制在最小/最大值之间（毫秒），额外的上游请求不超过HEDGE_BUDGET_RATIO
+    HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', 95))
+    HEDGE_MIN_DELAY_MS = float(os.getenv('HEDGE_MIN_DELAY_MS', 500))
+    HEDGE_MAX_DELAY_MS = float(os.getenv('HEDGE_MAX_DELAY_MS', 5000))
+    HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', 20))
+    HEDGE_BUDGET_RATIO = float(os.getenv('HEDGE_BUDGET_RATIO', 0.05))
+    
+    # 会话删除队列配置
+    DELETE_QUEUE_FILE = os.getenv('DELETE_QUEUE_FILE', 'pending_deletions.json')
+    DELETE_QUEUE_MAX_SIZE = int(os.getenv('DELETE_QUEUE_MAX_SIZE', 10000))
+    DELETE_QUEUE_FLUSH_INTERVAL = float(os.getenv('DELETE_QUEUE_FLUSH_INTERVAL', 1))
+    DELETE_WORKERS = int(os.getenv('DELETE_WORKERS', 2))
+    DELETE_RATE = float(os.getenv('DELETE_RATE', 10))
+    DELETE_MAX_RETRIES = int(os.getenv('DELETE_MAX_RETRIES', 5))
+    
+    # 流式增量合并配置（最大延迟为0时不合并）
+    STREAM_COALESCE_MAX_DELAY_MS = float(os.getenv('STREAM_COALESCE_MAX_DELAY_MS', 0))
+    STREAM_COALESCE_MAX_CHARS = int(os.getenv('STREAM_COALESCE_MAX_CHARS', 256))
+    
+    # Refresh Token调度配置（单token并发上限为0表示不限制）
+    MAX_STREAMS_PER_TOKEN = int(os.getenv('MAX_STREAMS_PER_TOKEN', 0))
+    TOKEN_SCHEDULER_SAMPLE = int(os.getenv('TOKEN_SCHEDULER_SAMPLE', 4))
+    TOKEN_FAILURE_THRESHOLD = int(os.getenv('TOKEN_FAILURE_THRESHOLD', 3))
+    TOKEN_COOLDOWN_BASE = float(os.getenv('TOKEN_COOLDOWN_BASE', 5))
+    TOKEN_COOLDOWN_MAX = float(os.getenv('TOKEN_COOLDOWN_MAX', 300))
+    
+    # 准入控制：全局并发上限（0表示不限制）、等待队列长度和最长排队时间（秒）
+    MAX_CONCURRENT_REQUESTS = int(os.getenv('MAX_CONCURRENT_REQUESTS', 0))
+    ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', 100))
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 10))
+    
+    # 多API key及其权重/配额的保存文件（AUTH_KEY始终可用，作为默认key）
+    API_KEYS_FILE = os.getenv('API_KEYS_FILE', 'api_keys.json')
+    
+    # Token持久化存储（SQLite），留空表示只保存在内存中
+    TOKEN_STORE_PATH = os.getenv('TOKEN_STORE_PATH', 'kimi2api.db')
+    
+    # Token批量导入：获取access token的并发数、每批写入数量、超过多少个token时转为后台任务
+    TOKEN_IMPORT_CONCURRENCY = int(os.getenv('TOKEN_IMPORT_CONCURRENCY', 8))
+    TOKEN_IMPORT_BATCH_SIZE = int(os.getenv('TOKEN_IMPORT_BATCH_SIZE', 100))
+    TOKEN_IMPORT_SYNC_LIMIT = int(os.getenv('TOKEN_IMPORT_SYNC_LIMIT', 50))
+    
+    # 共享状态后端（多worker/多节点）：memory | sqlite:///path/to/state.db | redis://host:port/db
+    STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+    STATE_SYNC_INTERVAL = float(os.getenv('STATE_SYNC_INTERVAL', 1))
+    
     # Refresh Token池
     _refresh_tokens = []
     _token_index = 0
     _token_lock = threading.Lock()
     
-    # 用于从main.py中的tokens_db获取tokens的回调函数
+    # 用于从main.py中的token注册表获取有效tokens的回调函数
     _get_tokens_callback = None
     
     @classmethod
@@ -41,7 +123,7 @@ class Config:
     
     @classmethod
     def set_tokens_callback(cls, callback):
-        """设置获取tokens的回调函数"""
+        """设置获取tokens的回调函数，回调返回有效refresh token字符串列表"""
         cls._get_tokens_callback = callback
     
     @classmethod
@@ -50,8 +132,7 @@ class Config:
         # 优先从回调函数获取tokens（前端管理的）
         if cls._get_tokens_callback:
             try:
-                db_tokens = cls._get_tokens_callback()
-                active_tokens = [t['token'] for t in db_tokens if not t.get('is_expired', False)]
+                active_tokens = cls._get_tokens_callback()
                 if active_tokens:
                     return active_tokens
             except:
@@ -62,6 +143,11 @@ class Config:
             cls._load_refresh_tokens()
         return cls._refresh_tokens
     
+    @classmethod
+    def get_active_refresh_tokens(cls) -> List[str]:
+        """获取当前可参与调度的refresh tokens"""
+        return cls._get_active_tokens()
+    
     @classmethod
     def get_next_refresh_token(cls) -> Optional[str]:
         """
@@ -100,6 +186,16 @@ class Config:
             'keepalive_expiry': cls.KEEPALIVE_EXPIRY
         }
     
+    @classmethod
+    def get_timeouts(cls) -> dict:
+        """获取各类上游请求的超时配置（秒）"""
+        return {
+            'connect': cls.CONNECT_TIMEOUT,
+            'refresh': cls.REFRESH_TIMEOUT,
+            'conversation': cls.CONVERSATION_TIMEOUT,
+            'chat': cls.CHAT_TIMEOUT
+        }
+    
     @classmethod
     def update_config_live(cls, config_dict: dict) -> dict:
         """实时更新配置（无需重启）"""
@@ -0,0 +1,109 @@
+import gzip
+import zlib
+import struct
+from typing import List, Tuple
+
+# Connect协议envelope：1字节flags + 4字节大端长度 + payload
+ENVELOPE_HEADER = struct.Struct('>BI')
+HEADER_SIZE = ENVELOPE_HEADER.size
+FLAG_COMPRESSED = 0x01
+FLAG_END_STREAM = 0x02
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+# end-stream帧中Connect错误码对应的HTTP状态码，其它错误码按上游网关错误（502）处理
+CONNECT_ERROR_STATUS = {
+    'resource_exhausted': 429,
+    'unauthenticated': 401,
+    'permission_denied': 403,
+}
+
+def error_status(code) -> int:
+    """Connect错误码转换为HTTP状态码"""
+    return CONNECT_ERROR_STATUS.get(code, 502)
+
+def encode_envelope(payload: bytes, flags: int = 0) -> bytes:
+    """编码一个Connect envelope，header和payload写入同一块预分配内存"""
+    length = len(payload)
+    frame = bytearray(HEADER_SIZE + length)
+    ENVELOPE_HEADER.pack_into(frame, 0, flags, length)
+    frame[HEADER_SIZE:] = payload
+    return bytes(frame)
+
+def decode_payload(flags: int, payload: memoryview) -> bytes:
+    """还原payload，压缩帧按gzip解压"""
+    if flags & FLAG_COMPRESSED:
+        return gzip.decompress(payload)
+    return bytes(payload)
+
+class ConnectEnvelopeDecoder:
+    """
+    增量Connect envelope解码器
+    数据可以在任意字节处被切分；缓冲区用读偏移推进、按需压缩，整体线性时间，
+    遇到非法帧头时用find直接跳到下一个可能的帧头重新同步
+    """
+    
+    COMPACT_THRESHOLD = 64 * 1024
+    
+    def __init__(self, max_message_size: int = MAX_MESSAGE_SIZE, resync_marker: bytes = b'{'):
+        self.buffer = bytearray()
+        self.offset = 0
+        self.max_message_size = max_message_size
+        self.resync_marker = resync_marker
+        self.skipped_bytes = 0
+    
+    def _is_valid_header(self, flags: int, length: int) -> bool:
+        return not (flags & ~(FLAG_COMPRESSED | FLAG_END_STREAM)) and length <= self.max_message_size
+    
+    def _resync(self) -> bool:
+        """跳到下一个合法帧头（帧头后紧跟resync_marker），找不到时丢弃可确定无效的数据"""
+        buffer = self.buffer
+        start = self.offset
+        position = buffer.find(self.resync_marker, start + HEADER_SIZE + 1)
+        while position != -1:
+            candidate = position - HEADER_SIZE
+            flags, length = ENVELOPE_HEADER.unpack_from(buffer, candidate)
+            if self._is_valid_header(flags, length) and length > 0:
+                self.skipped_bytes += candidate - start
+                self.offset = candidate
+                return True
+            position = buffer.find(self.resync_marker, position + 1)
+        
+        # 末尾不足一个帧头的数据可能是下一帧的开头，保留
+        keep_from = max(start + 1, len(buffer) - HEADER_SIZE)
+        self.skipped_bytes += keep_from - start
+        self.offset = keep_from
+        return False
+    
+    def _compact(self):
+        """读偏移超过一半缓冲区时才移动数据，保证均摊线性"""
+        if self.offset >= len(self.buffer):
+            self.buffer.clear()
+            self.offset = 0
+        elif self.offset > self.COMPACT_THRESHOLD and self.offset * 2 > len(self.buffer):
+            del self.buffer[:self.offset]
+            self.offset = 0
+    
+    def feed(self, data: bytes) -> List[Tuple[int, bytes]]:
+        """写入数据并返回完整的 (flags, payload) 列表"""
+        self.buffer += data
+        buffer = self.buffer
+        frames = []
+        with memoryview(buffer) as view:
+            size = len(buffer)
+            while size - self.offset >= HEADER_SIZE:
+                flags, length = ENVELOPE_HEADER.unpack_from(buffer, self.offset)
+                if not self._is_valid_header(flags, length):
+                    if not self._resync():
+                        break
+                    continue
+                end = self.offset + HEADER_SIZE + length
+                if end > size:
+                    break
+                try:
+                    frames.append((flags, decode_payload(flags, view[self.offset + HEADER_SIZE:end])))
+                except (OSError, EOFError, zlib.error):
+                    # 无法解压（损坏或被截断）的帧直接丢弃
+                    self.skipped_bytes += end - self.offset
+                self.offset = end
+        self._compact()
+        return frames
@@ -0,0 +1,185 @@
+import math
+import time
+import asyncio
+from collections import deque
+from typing import Dict, Any, Optional
+from config import Config
+
+class _TokenPool:
+    """单个refresh token的预创建会话池"""
+    
+    def __init__(self):
+        self.conversations = deque()  # (conv_id, created_at)
+        self.rate = 0.0  # 请求速率的指数滑动平均（次/秒）
+        self.last_request_at = 0.0
+        self.filling = False
+        self.hits = 0
+        self.misses = 0
+
+class ConversationPool:
+    """
+    预创建Kimi会话池
+    后台按水位线为每个refresh token预先创建会话，请求到来时直接取用，
+    池大小根据请求速率自适应调整，过期会话由后台任务回收删除
+    """
+    
+    def __init__(self, kimi_client, deletion_queue=None):
+        self.kimi_client = kimi_client
+        self.deletion_queue = deletion_queue
+        self._pools: Dict[str, _TokenPool] = {}
+        self._tasks: set = set()
+        self._reaper_task: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        """启动过期会话回收任务"""
+        if self._reaper_task is None:
+            self._reaper_task = asyncio.create_task(self._reap_loop())
+    
+    async def close(self):
+        """停止后台任务并删除池中剩余的会话"""
+        if self._reaper_task is not None:
+            self._reaper_task.cancel()
+            self._reaper_task = None
+        for task in list(self._tasks):
+            task.cancel()
+        
+        for refresh_token, pool in list(self._pools.items()):
+            while pool.conversations:
+                conv_id, _ = pool.conversations.popleft()
+                await self._delete(refresh_token, conv_id)
+        self._pools.clear()
+    
+    def _spawn(self, coro):
+        """创建后台任务并保持引用"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+    
+    def _record_request(self, pool: _TokenPool):
+        """更新请求速率估计"""
+        now = time.time()
+        if pool.last_request_at:
+            interval = max(now - pool.last_request_at, 1e-3)
+            # 按时间间隔衰减的滑动平均，约等于最近一个补充窗口内的速率
+            alpha = 1 - math.exp(-interval / Config.CONV_POOL_REFILL_WINDOW)
+            pool.rate = (1 - alpha) * pool.rate + alpha * (1 / interval)
+        pool.last_request_at = now
+    
+    def _watermarks(self, pool: _TokenPool) -> tuple:
+        """根据请求速率计算低/高水位线"""
+        desired = math.ceil(pool.rate * Config.CONV_POOL_REFILL_WINDOW)
+        high = min(max(desired, Config.CONV_POOL_HIGH_WATERMARK), Config.CONV_POOL_MAX_SIZE)
+        low = min(max(high // 2, Config.CONV_POOL_LOW_WATERMARK), high)
+        return low, high
+    
+    def _is_stale(self, created_at: float, now: float) -> bool:
+        return now - created_at > Config.CONV_POOL_TTL
+    
+    async def acquire(self, refresh_token: str, access_token: str) -> str:
+        """获取一个可用会话，池为空时直接创建"""
+        if not Config.CONV_POOL_ENABLED:
+            return await self.kimi_client.create_conversation(access_token)
+        
+        pool = self._pools.setdefault(refresh_token, _TokenPool())
+        self._record_request(pool)
+        
+        conv_id = None
+        now = time.time()
+        while pool.conversations:
+            candidate, created_at = pool.conversations.popleft()
+            if self._is_stale(created_at, now):
+                self._spawn(self._delete(refresh_token, candidate))
+                continue
+            conv_id = candidate
+            break
+        
+        low, _ = self._watermarks(pool)
+        if len(pool.conversations) < low and not pool.filling:
+            pool.filling = True
+            self._spawn(self._fill(refresh_token, pool))
+        
+        if conv_id:
+            pool.hits += 1
+            return conv_id
+        
+        pool.misses += 1
+        return await self.kimi_client.create_conversation(access_token)
+    
+    async def _fill(self, refresh_token: str, pool: _TokenPool):
+        """后台补充会话到高水位线"""
+        try:
+            while True:
+                _, high = self._watermarks(pool)
+                if len(pool.conversations) >= high:
+                    break
+                token_info = await self.kimi_client.refresh_access_token(refresh_token)
+                conv_id = await self.kimi_client.create_conversation(token_info['access_token'])
+                if not conv_id:
+                    break
+                pool.conversations.append((conv_id, time.time()))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            pass
+        finally:
+            pool.filling = False
+    
+    async def _delete(self, refresh_token: str, conv_id: str):
+        """删除会话，优先交给删除队列处理"""
+        if self.deletion_queue is not None and self.deletion_queue.enqueue(refresh_token, conv_id):
+            return
+        try:
+            token_info = await self.kimi_client.refresh_access_token(refresh_token)
+            await self.kimi_client.delete_conversation(token_info['access_token'], conv_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            pass
+    
+    def discard(self, refresh_token: str):
+        """移除某个refresh token的会话池（token被删除时调用）"""
+        pool = self._pools.pop(refresh_token, None)
+        if pool is None:
+            return
+        while pool.conversations:
+            conv_id, _ = pool.conversations.popleft()
+            self._spawn(self._delete(refresh_token, conv_id))
+    
+    async def _reap_loop(self):
+        """定期回收过期会话，长时间无请求的token不再保留会话"""
+        while True:
+            await asyncio.sleep(Config.CONV_POOL_REAP_INTERVAL)
+            now = time.time()
+            for refresh_token, pool in list(self._pools.items()):
+                idle = now - pool.last_request_at > Config.CONV_POOL_TTL
+                kept = deque()
+                while pool.conversations:
+                    conv_id, created_at = pool.conversations.popleft()
+                    if idle or self._is_stale(created_at, now):
+                        self._spawn(self._delete(refresh_token, conv_id))
+                    else:
+                        kept.append((conv_id, created_at))
+                pool.conversations = kept
+                if idle:
+                    del self._pools[refresh_token]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取会话池统计信息"""
+        pools = []
+        for refresh_token, pool in self._pools.items():
+            low, high = self._watermarks(pool)
+            pools.append({
+                'refresh_token': refresh_token[:15] + '...',
+                'size': len(pool.conversations),
+                'low_watermark': low,
+                'high_watermark': high,
+                'request_rate': round(pool.rate, 3),
+                'hits': pool.hits,
+                'misses': pool.misses
+            })
+        return {
+            'enabled': Config.CONV_POOL_ENABLED,
+            'total_conversations': sum(p['size'] for p in pools),
+            'pools': pools
+        }
@@ -0,0 +1,215 @@
+import os
+import re
+import glob
+import json
+import time
+import random
+import asyncio
+import tempfile
+from typing import Dict, Any, Optional
+from config import Config
+
+class ConversationDeletionQueue:
+    """
+    异步会话删除队列
+    会话删除不再阻塞请求，由后台worker限速批量执行，失败自动重试，
+    待删除会话定期持久化到磁盘，重启后继续删除，避免账号下残留会话。
+    多worker部署时每个进程写入自己的文件（文件名带pid），启动时接管遗留的全部队列文件
+    """
+    
+    def __init__(self, kimi_client, state_file: Optional[str] = None):
+        self.kimi_client = kimi_client
+        self.state_file = state_file or Config.DELETE_QUEUE_FILE
+        self._pending: Dict[str, str] = {}  # conv_id -> refresh_token
+        self._attempts: Dict[str, int] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: list = []
+        self._tasks: set = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._dirty = False
+        self._next_slot = 0.0
+        
+        # 统计指标
+        self.deleted = 0
+        self.retries = 0
+        self.failed = 0
+        self.rejected = 0
+    
+    async def start(self):
+        """加载持久化的待删除会话并启动worker"""
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue()
+        for conv_id, refresh_token in self._load().items():
+            self._pending[conv_id] = refresh_token
+            self._queue.put_nowait(conv_id)
+        
+        for _ in range(max(Config.DELETE_WORKERS, 1)):
+            self._workers.append(asyncio.create_task(self._worker()))
+        self._flush_task = asyncio.create_task(self._flush_loop())
+    
+    async def close(self, timeout: float = 5.0):
+        """在超时时间内尽量删完队列，剩余的写入磁盘等待下次启动处理"""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        
+        for task in self._workers + list(self._tasks):
+            task.cancel()
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        self._workers = []
+        self._flush_task = None
+        self._queue = None
+        await asyncio.to_thread(self._save, dict(self._pending))
+    
+    def enqueue(self, refresh_token: str, conv_id: str) -> bool:
+        """加入删除队列，队列已满或未启动时返回False由调用方自行删除"""
+        if not conv_id:
+            return True
+        if self._queue is None or len(self._pending) >= Config.DELETE_QUEUE_MAX_SIZE:
+            self.rejected += 1
+            return False
+        if conv_id not in self._pending:
+            self._pending[conv_id] = refresh_token
+            self._queue.put_nowait(conv_id)
+            self._dirty = True
+        return True
+    
+    async def _rate_limit(self):
+        """全局限速，所有worker共享DELETE_RATE（次/秒）"""
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + 1 / max(Config.DELETE_RATE, 0.1)
+        if slot > now:
+            await asyncio.sleep(slot - now)
+    
+    async def _worker(self):
+        """从队列中取出会话并删除"""
+        queue = self._queue  # close()会清空self._queue，取消时仍需标记当前任务完成
+        while True:
+            conv_id = await queue.get()
+            try:
+                refresh_token = self._pending.get(conv_id)
+                if refresh_token is not None:
+                    await self._rate_limit()
+                    await self._delete(refresh_token, conv_id)
+            finally:
+                queue.task_done()
+    
+    async def _delete(self, refresh_token: str, conv_id: str):
+        """删除单个会话，失败时按指数退避重新入队"""
+        try:
+            token_info = await self.kimi_client.refresh_access_token(refresh_token)
+            await self.kimi_client.delete_conversation(token_info['access_token'], conv_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            attempts = self._attempts.get(conv_id, 0) + 1
+            if attempts > Config.DELETE_MAX_RETRIES:
+                self.failed += 1
+                self._forget(conv_id)
+                return
+            self._attempts[conv_id] = attempts
+            self.retries += 1
+            delay = min(2 ** attempts, 60) + random.uniform(0, 1)
+            task = asyncio.create_task(self._requeue(conv_id, delay))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            return
+        
+        self.deleted += 1
+        self._forget(conv_id)
+    
+    async def _requeue(self, conv_id: str, delay: float):
+        await asyncio.sleep(delay)
+        if self._queue is not None and conv_id in self._pending:
+            self._queue.put_nowait(conv_id)
+    
+    def _forget(self, conv_id: str):
+        self._pending.pop(conv_id, None)
+        self._attempts.pop(conv_id, None)
+        self._dirty = True
+    
+    async def _flush_loop(self):
+        """定期把待删除会话批量写入磁盘"""
+        while True:
+            await asyncio.sleep(Config.DELETE_QUEUE_FLUSH_INTERVAL)
+            if self._dirty:
+                self._dirty = False
+                await asyncio.to_thread(self._save, dict(self._pending))
+    
+    def _worker_file(self) -> str:
+        """本进程的队列文件，如 pending_deletions.1234.json"""
+        root, ext = os.path.splitext(self.state_file)
+        return f"{root}.{os.getpid()}{ext}"
+    
+    def _queue_files(self) -> list:
+        """原始队列文件及所有worker的队列文件"""
+        root, ext = os.path.splitext(self.state_file)
+        pattern = re.compile(re.escape(os.path.basename(root)) + r'\.\d+' + re.escape(ext) + '$')
+        files = [self.state_file]
+        for path in glob.glob(f"{glob.escape(root)}.*{ext}"):
+            if pattern.match(os.path.basename(path)):
+                files.append(path)
+        return files
+    
+    def _load(self) -> Dict[str, str]:
+        """
+        从磁盘加载待删除会话，接管遗留的全部队列文件（包括其它worker的）
+        文件先原子地重命名再读取，同时启动的多个worker中只有一个会接管同一个文件；
+        合并结果立即写入本进程的文件后再删除被接管的文件，中途退出也不会丢失
+        """
+        if not self.state_file:
+            return {}
+        pending = {}
+        claimed = []
+        for path in self._queue_files():
+            claim = f"{path}.{os.getpid()}.claim"
+            try:
+                os.rename(path, claim)
+            except OSError:
+                continue
+            claimed.append(claim)
+            try:
+                with open(claim, 'r', encoding='utf-8') as f:
+                    pending.update(json.load(f))
+            except:
+                pass
+        if claimed:
+            self._save(pending)
+            for claim in claimed:
+                os.remove(claim)
+        return pending
+    
+    def _save(self, pending: Dict[str, str]):
+        """原子写入本进程的待删除会话，临时文件名唯一，多个worker同时写入时互不覆盖"""
+        if not self.state_file:
+            return
+        worker_file = self._worker_file()
+        if not pending:
+            if os.path.exists(worker_file):
+                os.remove(worker_file)
+            return
+        directory = os.path.dirname(os.path.abspath(worker_file))
+        with tempfile.NamedTemporaryFile(
+            'w', encoding='utf-8', dir=directory, prefix=os.path.basename(worker_file) + '.', suffix='.tmp', delete=False
+        ) as f:
+            json.dump(pending, f)
+        os.replace(f.name, worker_file)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取删除队列统计信息"""
+        return {
+            'depth': len(self._pending),
+            'max_size': Config.DELETE_QUEUE_MAX_SIZE,
+            'retrying': len(self._attempts),
+            'workers': len(self._workers),
+            'deleted': self.deleted,
+            'retries': self.retries,
+            'failed': self.failed,
+            'rejected': self.rejected
+        }
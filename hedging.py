@@ -0,0 +1,210 @@
+import math
+import time
+import asyncio
+from collections import deque
+from typing import AsyncGenerator, Awaitable, Callable, Dict, Any, List, Optional, Tuple
+from models import KimiStreamEvent
+from config import Config
+import metrics
+
+# 首个内容增量之前的事件（req等）先缓存，收到内容或结束事件才算首个token
+_FIRST_TOKEN_EVENTS = ('cmpl', 'all_done', 'error', 'length')
+
+class HedgePolicy:
+    """
+    对冲请求的触发延迟和全局预算
+    延迟取最近首token耗时的分位数（限制在最小/最大延迟之间），样本不足时使用最大延迟；
+    每个请求按HEDGE_BUDGET_RATIO积累额度，发起一次对冲消耗1，额外的上游请求不超过该比例
+    """
+    
+    WINDOW = 512
+    RECOMPUTE_EVERY = 16
+    BUDGET_BURST = 10.0
+    
+    def __init__(self):
+        self._samples = deque(maxlen=self.WINDOW)
+        self._delay: Optional[float] = None
+        self._pending = 0
+        self._credit = 1.0
+        
+        # 统计指标
+        self.requests = 0
+        self.hedged = 0
+        self.won = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return Config.HEDGE_ENABLED
+    
+    def record(self, ttft: float):
+        """记录主请求的首token耗时"""
+        self._samples.append(ttft)
+        self._pending += 1
+        if self._pending >= self.RECOMPUTE_EVERY:
+            self._delay = None
+    
+    def delay(self) -> float:
+        """当前的对冲触发延迟（秒）"""
+        low = Config.HEDGE_MIN_DELAY_MS / 1000
+        high = Config.HEDGE_MAX_DELAY_MS / 1000
+        if len(self._samples) < Config.HEDGE_MIN_SAMPLES:
+            return high
+        if self._delay is None:
+            ordered = sorted(self._samples)
+            index = min(math.ceil(len(ordered) * Config.HEDGE_PERCENTILE / 100) - 1, len(ordered) - 1)
+            self._delay = ordered[max(index, 0)]
+            self._pending = 0
+        return min(max(self._delay, low), high)
+    
+    def admit(self):
+        """每个可对冲的请求积累额度"""
+        self.requests += 1
+        self._credit = min(self._credit + Config.HEDGE_BUDGET_RATIO, self.BUDGET_BURST)
+    
+    def refund(self):
+        """对冲未能发起时退回额度"""
+        self._credit = min(self._credit + 1, self.BUDGET_BURST)
+        self.hedged -= 1
+    
+    def try_spend(self) -> bool:
+        """消耗一次对冲额度"""
+        if self._credit < 1:
+            return False
+        self._credit -= 1
+        self.hedged += 1
+        return True
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取对冲请求统计信息"""
+        return {
+            'enabled': Config.HEDGE_ENABLED,
+            'delay_ms': round(self.delay() * 1000, 1),
+            'samples': len(self._samples),
+            'requests': self.requests,
+            'hedged': self.hedged,
+            'hedge_won': self.won,
+            'hedge_rate': round(self.hedged / self.requests, 4) if self.requests else 0,
+            'budget_credit': round(self._credit, 3)
+        }
+
+async def _read_head(stream: AsyncGenerator[KimiStreamEvent, None]) -> List[KimiStreamEvent]:
+    """读取到首个内容或结束事件为止，返回已读取的事件"""
+    head = []
+    async for event in stream:
+        head.append(event)
+        if event.event in _FIRST_TOKEN_EVENTS:
+            break
+    return head
+
+# start_backup返回的备份请求：事件流和释放其token、会话的回调（幂等）
+Backup = Tuple[AsyncGenerator[KimiStreamEvent, None], Callable[[], Awaitable[None]]]
+
+async def _run_backup(
+    start_backup: Callable[[], Awaitable[Optional[Backup]]]
+) -> Optional[Tuple[AsyncGenerator[KimiStreamEvent, None], Callable[[], Awaitable[None]], List[KimiStreamEvent]]]:
+    """发起备份请求并读取到首个token，失败或被取消时关闭事件流并释放"""
+    backup = await start_backup()
+    if backup is None:
+        return None
+    stream, release = backup
+    try:
+        return stream, release, await _read_head(stream)
+    except BaseException:
+        await stream.aclose()
+        await release()
+        raise
+
+def _backup_result(task: asyncio.Task):
+    if task.cancelled() or task.exception() is not None:
+        return None
+    return task.result()
+
+async def _cancel(task: Optional[asyncio.Task]):
+    if task is None:
+        return
+    if not task.done():
+        task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+async def _discard_backup(task: Optional[asyncio.Task]):
+    """取消备份请求，关闭其事件流并释放token、清理会话"""
+    if task is None:
+        return
+    await _cancel(task)
+    backup = _backup_result(task)
+    if backup is not None:
+        stream, release, _ = backup
+        await stream.aclose()
+        await release()
+
+async def hedged_stream(
+    primary: AsyncGenerator[KimiStreamEvent, None],
+    start_backup: Callable[[], Awaitable[Optional[Backup]]],
+    policy: HedgePolicy
+) -> AsyncGenerator[KimiStreamEvent, None]:
+    """
+    对冲的事件流
+    主请求在延迟阈值内没有产生首个token时，通过start_backup在另一个token和会话上发起备份请求
+    （返回事件流和释放回调，没有可用token时返回None），先产生首个token的一方胜出，另一方被取消并关闭；
+    主请求的释放由调用方负责（本生成器未开始迭代时不会关闭主请求）
+    """
+    policy.admit()
+    started = time.monotonic()
+    primary_head = asyncio.ensure_future(_read_head(primary))
+    backup_task: Optional[asyncio.Task] = None
+    try:
+        done, pending = await asyncio.wait((primary_head,), timeout=policy.delay())
+        if not done:
+            if policy.try_spend():
+                backup_task = asyncio.ensure_future(_run_backup(start_backup))
+                pending.add(backup_task)
+            else:
+                metrics.HEDGE_SKIPPED_BUDGET.inc()
+        
+        backup = None
+        outcome = None
+        while True:
+            if primary_head.done() and primary_head.exception() is None:
+                # 同时产生首个token时优先使用主请求
+                stream, head = primary, primary_head.result()
+                break
+            if backup is not None:
+                stream, _, head = backup
+                break
+            if primary_head.done() and not pending:
+                # 主请求失败且没有可用的备份请求
+                primary_head.result()
+            
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if backup_task is not None and backup_task in done:
+                backup = _backup_result(backup_task)
+                if backup is None:
+                    if not backup_task.cancelled() and backup_task.exception() is None:
+                        # 没有空闲的token，退回对冲额度
+                        policy.refund()
+                        outcome = 'no_token'
+                        metrics.HEDGE_SKIPPED_NO_TOKEN.inc()
+                    else:
+                        outcome = 'failed'
+                        metrics.HEDGE_FAILED.inc()
+        
+        # 备份胜出时，被取消的主请求首token耗时至少为已等待的时间
+        policy.record(time.monotonic() - started)
+        if stream is primary:
+            if backup_task is not None and outcome is None:
+                metrics.HEDGE_LOST.inc()
+            await _discard_backup(backup_task)
+        else:
+            policy.won += 1
+            metrics.HEDGE_WON.inc()
+            await _cancel(primary_head)
+            await primary.aclose()
+        
+        for event in head:
+            yield event
+        async for event in stream:
+            yield event
+    finally:
+        await _cancel(primary_head)
+        await primary.aclose()
+        await _discard_backup(backup_task)
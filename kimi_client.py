@@ -4,26 +4,205 @@ import random
 import asyncio
 from typing import Dict, Any, Optional, AsyncGenerator
 import httpx
+import jwt
 from models import Message, KimiStreamEvent
 from kimi_stream_parser import KimiStreamParser
+from connect_codec import encode_envelope, error_status
 from config import Config
+from metrics import (
+    UPSTREAM_REFRESH, UPSTREAM_CREATE_CONVERSATION, UPSTREAM_DELETE_CONVERSATION, UPSTREAM_CHAT_FIRST_BYTE,
+    UPSTREAM_BYTES, UPSTREAM_BYTES_SAVED, UPSTREAM_STREAMS_CANCELLED
+)
+
+class KimiAPIError(Exception):
+    """Kimi上游请求失败，status_code为上游HTTP状态码"""
+    
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
 
 class KimiClient:
     def __init__(self):
-        self.base_url = "https://www.kimi.com"
+        self.base_url = Config.KIMI_BASE_URL
         self.device_id = str(random.randint(7000000000000000000, 9999999999999999999))
         self.session_id = str(random.randint(1700000000000000000, 1999999999999999999))
         self.access_token_map = {}
         self.access_token_expires = 300
         
-        # 获取连接池配置
+        # 同一refresh token的并发刷新合并为一次上游请求
+        self._refreshing: Dict[str, asyncio.Future] = {}
+        self._renew_task: Optional[asyncio.Task] = None
+        self._renewals: set = set()
+        
+        # 可选的持久化存储（TokenStore），重启后复用仍然有效的access token
+        self.token_store = None
+        
+        # 可选的共享状态后端，多worker/多节点之间共享access token
+        self.state_backend = None
+        
+        # 应用级共享的上游HTTP客户端（在FastAPI lifespan中创建/关闭）
+        self.client: Optional[httpx.AsyncClient] = None
+        self.http2 = False
+        self._active_requests = 0
+        self._total_requests = 0
+        self._stream_bytes = 0.0  # 完整对话流字节数的指数滑动平均，用于估算提前取消节省的流量
+        
+        # 连接池热更新：新请求使用当前代的客户端，旧客户端在请求结束后关闭
+        self._generation = 0
+        self._client_settings: Optional[tuple] = None
+        self._inflight: Dict[httpx.AsyncClient, int] = {}
+        self._draining: Dict[httpx.AsyncClient, int] = {}
+        self._last_reconfigured_at: Optional[float] = None
+    
+    def _build_limits(self) -> httpx.Limits:
+        """根据当前配置构建连接池限制"""
         limits = Config.get_connection_limits()
-        self.limits = httpx.Limits(
+        return httpx.Limits(
             max_connections=limits['max_connections'],
             max_keepalive_connections=limits['max_keepalive_connections'],
             keepalive_expiry=limits['keepalive_expiry']
         )
+    
+    def _timeout(self, operation: str) -> httpx.Timeout:
+        """获取指定操作的超时配置"""
+        timeouts = Config.get_timeouts()
+        return httpx.Timeout(timeouts[operation], connect=timeouts['connect'])
+    
+    def _current_settings(self) -> tuple:
+        """当前配置下连接池相关参数的快照"""
+        limits = Config.get_connection_limits()
+        return (
+            limits['max_connections'],
+            limits['max_keepalive_connections'],
+            limits['keepalive_expiry'],
+            Config.HTTP2_ENABLED
+        )
+    
+    def _build_client(self) -> httpx.AsyncClient:
+        """创建共享的AsyncClient，HTTP/2需要安装h2依赖"""
+        http2 = Config.HTTP2_ENABLED
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                http2 = False
+        self.http2 = http2
+        self._client_settings = self._current_settings()
+        self._generation += 1
+        return httpx.AsyncClient(
+            limits=self._build_limits(),
+            timeout=self._timeout('chat'),
+            http2=http2
+        )
+    
+    async def start(self):
+        """启动共享客户端和access token后台续期任务"""
+        if self.client is None:
+            self.client = self._build_client()
+        if self._renew_task is None:
+            self._renew_task = asyncio.create_task(self._renew_loop())
+    
+    async def close(self):
+        """关闭共享客户端及所有待回收的旧客户端"""
+        if self._renew_task is not None:
+            self._renew_task.cancel()
+            self._renew_task = None
+        for task in list(self._renewals):
+            task.cancel()
         
+        clients = list(self._draining)
+        self._draining.clear()
+        if self.client is not None:
+            clients.append(self.client)
+            self.client = None
+        for client in clients:
+            await client.aclose()
+    
+    async def reconfigure(self) -> bool:
+        """
+        按最新配置重建连接池（无需重启）
+        新请求立即使用新连接池，旧连接池上的流式请求结束后再关闭
+        """
+        if self.client is None or self._client_settings == self._current_settings():
+            return False
+        
+        old_client = self.client
+        old_generation = self._generation
+        self.client = self._build_client()
+        self._last_reconfigured_at = time.time()
+        
+        if self._inflight.get(old_client, 0) > 0:
+            self._draining[old_client] = old_generation
+        else:
+            await old_client.aclose()
+        return True
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """获取共享客户端，未启动时懒加载创建"""
+        if self.client is None:
+            self.client = self._build_client()
+        return self.client
+    
+    def _acquire_client(self) -> httpx.AsyncClient:
+        """获取当前客户端并登记一个进行中的请求"""
+        client = self._get_client()
+        self._inflight[client] = self._inflight.get(client, 0) + 1
+        self._active_requests += 1
+        self._total_requests += 1
+        return client
+    
+    async def _release_client(self, client: httpx.AsyncClient):
+        """释放请求登记，旧客户端的最后一个请求结束时将其关闭"""
+        self._active_requests -= 1
+        remaining = self._inflight.get(client, 1) - 1
+        if remaining > 0:
+            self._inflight[client] = remaining
+            return
+        self._inflight.pop(client, None)
+        if self._draining.pop(client, None) is not None:
+            await client.aclose()
+    
+    def _describe_pool(self, client: httpx.AsyncClient) -> Dict[str, int]:
+        """读取某个客户端底层连接池的状态"""
+        pool = getattr(client._transport, '_pool', None)
+        connections = list(getattr(pool, 'connections', []) or [])
+        return {
+            'active_requests': self._inflight.get(client, 0),
+            'connections': len(connections),
+            'idle_connections': sum(1 for conn in connections if conn.is_idle()),
+            'queued_requests': len(getattr(pool, '_requests', []) or [])
+        }
+    
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """获取连接池统计信息"""
+        limits = Config.get_connection_limits()
+        stats = {
+            'started': self.client is not None,
+            'http2': self.http2,
+            'generation': self._generation,
+            'last_reconfigured_at': self._last_reconfigured_at,
+            'max_connections': limits['max_connections'],
+            'max_keepalive_connections': limits['max_keepalive_connections'],
+            'keepalive_expiry': limits['keepalive_expiry'],
+            'active_requests': self._active_requests,
+            'total_requests': self._total_requests,
+            'connections': 0,
+            'idle_connections': 0,
+            'queued_requests': 0,
+            'draining': [
+                dict(generation=generation, **self._describe_pool(client))
+                for client, generation in self._draining.items()
+            ]
+        }
+        if self.client is None:
+            return stats
+        
+        current = self._describe_pool(self.client)
+        stats['connections'] = current['connections']
+        stats['idle_connections'] = current['idle_connections']
+        stats['queued_requests'] = current['queued_requests']
+        return stats
+    
     def _get_headers(self, access_token: Optional[str] = None) -> Dict[str, str]:
         """获取请求头"""
         headers = {
@@ -42,44 +221,224 @@ class KimiClient:
         
         if access_token:
             headers['authorization'] = f'Bearer {access_token}'
-            
+        
         return headers
     
-    async def refresh_access_token(self, refresh_token: str) -> Dict[str, Any]:
-        """刷新访问令牌"""
-        if refresh_token in self.access_token_map:
-            token_info = self.access_token_map[refresh_token]
-            expires_at = token_info.get('expires_at', 0)
-            # 如果token还有超过1小时才过期，直接返回缓存的token
-            if time.time() + 3600 < expires_at:
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """通过共享客户端发送请求并记录统计"""
+        client = self._acquire_client()
+        try:
+            return await client.request(method, url, **kwargs)
+        finally:
+            await self._release_client(client)
+    
+    def _get_access_token_expiry(self, data: Dict[str, Any], access_token: str) -> float:
+        """获取access token的真实过期时间：优先JWT的exp，其次expires_in"""
+        try:
+            exp = jwt.decode(access_token, options={"verify_signature": False}).get('exp')
+            if exp:
+                return float(exp)
+        except Exception:
+            pass
+        
+        expires_in = data.get('expires_in')
+        if expires_in:
+            return time.time() + float(expires_in)
+        return time.time() + self.access_token_expires
+    
+    def _get_renew_at(self, expires_at: float) -> float:
+        """计算后台续期时间，加入随机抖动避免集中续期"""
+        now = time.time()
+        lifetime = max(expires_at - now, 0)
+        renew_before = min(Config.ACCESS_TOKEN_RENEW_BEFORE, lifetime / 2)
+        jitter = random.uniform(0, min(Config.ACCESS_TOKEN_RENEW_JITTER, lifetime / 4))
+        return expires_at - renew_before - jitter
+    
+    def get_cached_access_token(self, refresh_token: str) -> Optional[Dict[str, Any]]:
+        """获取仍然有效的缓存access token"""
+        token_info = self.access_token_map.get(refresh_token)
+        if not token_info:
+            return None
+        if time.time() + Config.ACCESS_TOKEN_EXPIRY_MARGIN >= token_info.get('expires_at', 0):
+            return None
+        return token_info
+    
+    async def refresh_access_token(self, refresh_token: str, force: bool = False) -> Dict[str, Any]:
+        """
+        获取access token
+        优先返回缓存，同一refresh token的并发刷新只发起一次上游请求
+        """
+        if not force:
+            token_info = self.get_cached_access_token(refresh_token) or self._load_stored_access_token(refresh_token)
+            if token_info is None:
+                token_info = await self._load_shared_access_token(refresh_token)
+            if token_info:
+                token_info['last_used'] = time.time()
                 return token_info
         
+        pending = self._refreshing.get(refresh_token)
+        if pending is None:
+            pending = asyncio.ensure_future(self._fetch_access_token(refresh_token))
+            self._refreshing[refresh_token] = pending
+            
+            def _done(future, refresh_token=refresh_token):
+                if self._refreshing.get(refresh_token) is future:
+                    del self._refreshing[refresh_token]
+                if not future.cancelled():
+                    future.exception()
+            
+            pending.add_done_callback(_done)
+        
+        token_info = await asyncio.shield(pending)
+        token_info['last_used'] = time.time()
+        return token_info
+    
+    async def _fetch_access_token(self, refresh_token: str) -> Dict[str, Any]:
+        """向上游刷新访问令牌"""
         headers = self._get_headers()
         headers['authorization'] = f'Bearer {refresh_token}'
         
-        async with httpx.AsyncClient(limits=self.limits) as client:
-            response = await client.get(
-                f"{self.base_url}/api/auth/token/refresh",
-                headers=headers,
-                timeout=15.0
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"Failed to refresh token: {response.status_code}")
-            
-            data = response.json()
-            access_token = data.get('access_token')
-            
-            if not access_token:
-                raise Exception("No access token in response")
-            
-            token_info = {
-                'access_token': access_token,
-                'expires_at': time.time() + self.access_token_expires
-            }
+        started = time.monotonic()
+        response = await self._request(
+            'GET',
+            f"{self.base_url}/api/auth/token/refresh",
+            headers=headers,
+            timeout=self._timeout('refresh')
+        )
+        UPSTREAM_REFRESH.observe(time.monotonic() - started)
+        
+        if response.status_code != 200:
+            raise KimiAPIError(f"Failed to refresh token: {response.status_code}", response.status_code)
+        
+        data = response.json()
+        access_token = data.get('access_token')
+        
+        if not access_token:
+            raise KimiAPIError("No access token in response")
+        
+        expires_at = self._get_access_token_expiry(data, access_token)
+        previous = self.access_token_map.get(refresh_token, {})
+        token_info = {
+            'access_token': access_token,
+            'expires_at': expires_at,
+            'renew_at': self._get_renew_at(expires_at),
+            'last_used': previous.get('last_used', time.time())
+        }
+        
+        self.access_token_map[refresh_token] = token_info
+        if self.token_store is not None:
+            self.token_store.save_access_token(refresh_token, access_token, expires_at)
+        if self.state_backend is not None and self.state_backend.shared:
+            try:
+                await self.state_backend.set(
+                    f"kimi2api:access_token:{refresh_token}",
+                    json.dumps({'access_token': access_token, 'expires_at': expires_at}),
+                    ttl=expires_at - time.time()
+                )
+            except Exception:
+                pass
+        return token_info
+    
+    def _load_stored_access_token(self, refresh_token: str) -> Optional[Dict[str, Any]]:
+        """内存缓存未命中时从持久化存储加载（重启后的首次使用）"""
+        if self.token_store is None:
+            return None
+        stored = self.token_store.get_access_token(refresh_token)
+        if not stored or time.time() + Config.ACCESS_TOKEN_EXPIRY_MARGIN >= stored['expires_at']:
+            return None
+        token_info = {
+            'access_token': stored['access_token'],
+            'expires_at': stored['expires_at'],
+            'renew_at': self._get_renew_at(stored['expires_at']),
+            'last_used': time.time()
+        }
+        self.access_token_map[refresh_token] = token_info
+        return token_info
+    
+    async def _load_shared_access_token(self, refresh_token: str) -> Optional[Dict[str, Any]]:
+        """从共享状态后端加载其它worker刷新得到的access token"""
+        if self.state_backend is None or not self.state_backend.shared:
+            return None
+        try:
+            value = await self.state_backend.get(f"kimi2api:access_token:{refresh_token}")
+        except Exception:
+            return None
+        if not value:
+            return None
+        stored = json.loads(value)
+        if time.time() + Config.ACCESS_TOKEN_EXPIRY_MARGIN >= stored['expires_at']:
+            return None
+        previous = self.access_token_map.get(refresh_token, {})
+        token_info = {
+            'access_token': stored['access_token'],
+            'expires_at': stored['expires_at'],
+            'renew_at': self._get_renew_at(stored['expires_at']),
+            'last_used': previous.get('last_used', time.time())
+        }
+        self.access_token_map[refresh_token] = token_info
+        return token_info
+    
+    async def _delete_shared_access_token(self, refresh_token: str):
+        try:
+            await self.state_backend.delete(f"kimi2api:access_token:{refresh_token}")
+        except Exception:
+            pass
+    
+    def forget_access_token(self, refresh_token: str):
+        """移除某个refresh token的缓存access token"""
+        self.access_token_map.pop(refresh_token, None)
+        if self.token_store is not None:
+            self.token_store.remove_access_token(refresh_token)
+        if self.state_backend is not None and self.state_backend.shared:
+            try:
+                task = asyncio.get_running_loop().create_task(self._delete_shared_access_token(refresh_token))
+            except RuntimeError:
+                return
+            self._renewals.add(task)
+            task.add_done_callback(self._renewals.discard)
+    
+    async def _renew_access_token(self, refresh_token: str):
+        """
+        后台续期单个access token，失败时稍后重试
+        使用共享状态后端时先检查其它worker是否已经续期，已续期则直接采用，避免每个worker各自刷新
+        """
+        try:
+            current = self.access_token_map.get(refresh_token)
+            shared = await self._load_shared_access_token(refresh_token)
+            if shared is not None and current is not None and shared['access_token'] != current['access_token']:
+                return
+            await self.refresh_access_token(refresh_token, force=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            token_info = self.access_token_map.get(refresh_token)
+            if token_info:
+                token_info['renew_at'] = time.time() + 30 + random.uniform(0, 30)
+    
+    async def _renew_loop(self):
+        """在access token过期前主动续期，长期未使用的token不续期"""
+        while True:
+            now = time.time()
+            for refresh_token, token_info in list(self.access_token_map.items()):
+                if token_info.get('renew_at', 0) > now or refresh_token in self._refreshing:
+                    continue
+                
+                if now - token_info.get('last_used', 0) > Config.ACCESS_TOKEN_IDLE_TTL:
+                    if token_info.get('expires_at', 0) <= now:
+                        self.access_token_map.pop(refresh_token, None)
+                    else:
+                        token_info['renew_at'] = token_info['expires_at']
+                    continue
+                
+                task = asyncio.create_task(self._renew_access_token(refresh_token))
+                self._renewals.add(task)
+                task.add_done_callback(self._renewals.discard)
             
-            self.access_token_map[refresh_token] = token_info
-            return token_info
+            next_renew_at = min(
+                (info.get('renew_at', now) for info in self.access_token_map.values()),
+                default=now + 30
+            )
+            await asyncio.sleep(min(max(next_renew_at - time.time(), 1), 30))
     
     async def create_conversation(self, access_token: str, name: str = "未命名会话") -> str:
         """创建会话"""
@@ -93,30 +452,38 @@ class KimiClient:
             "name": name
         }
         
-        async with httpx.AsyncClient(limits=self.limits) as client:
-            response = await client.post(
-                f"{self.base_url}/api/chat",
-                headers=headers,
-                json=data,
-                timeout=15.0
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"Failed to create conversation: {response.status_code}")
-            
-            result = response.json()
-            return result.get('id')
+        started = time.monotonic()
+        response = await self._request(
+            'POST',
+            f"{self.base_url}/api/chat",
+            headers=headers,
+            json=data,
+            timeout=self._timeout('conversation')
+        )
+        UPSTREAM_CREATE_CONVERSATION.observe(time.monotonic() - started)
+        
+        if response.status_code != 200:
+            raise KimiAPIError(f"Failed to create conversation: {response.status_code}", response.status_code)
+        
+        result = response.json()
+        return result.get('id')
     
     async def delete_conversation(self, access_token: str, conv_id: str):
         """删除会话"""
         headers = self._get_headers(access_token)
         
-        async with httpx.AsyncClient(limits=self.limits) as client:
-            await client.delete(
-                f"{self.base_url}/api/chat/{conv_id}",
-                headers=headers,
-                timeout=15.0
-            )
+        started = time.monotonic()
+        response = await self._request(
+            'DELETE',
+            f"{self.base_url}/api/chat/{conv_id}",
+            headers=headers,
+            timeout=self._timeout('conversation')
+        )
+        UPSTREAM_DELETE_CONVERSATION.observe(time.monotonic() - started)
+        
+        # 404表示会话已不存在，视为删除成功
+        if response.status_code >= 400 and response.status_code != 404:
+            raise KimiAPIError(f"Failed to delete conversation: {response.status_code}", response.status_code)
     
     async def chat_completion_stream(
         self, 
@@ -150,32 +517,24 @@ class KimiClient:
             }
         }
         
-        # Calculate the correct length prefix based on the capture
-        payload_json = json.dumps(payload)
-        payload_bytes = payload_json.encode('utf-8')
-        length = len(payload_bytes)
-        
-        # The capture shows: \x00\x00\x00\x00\x86 which suggests a 5-byte header
-        # Handle large payloads by limiting length to 255 or using different protocol
-        if length > 255:
-            # For large payloads, we might need a different approach
-            # For now, truncate the payload to fit in single byte length
-            max_payload_size = 255
-            payload_bytes = payload_bytes[:max_payload_size]
-            length = len(payload_bytes)
+        # Connect协议envelope：1字节flags + 4字节大端长度
+        data = encode_envelope(json.dumps(payload).encode('utf-8'))
         
-        # Let's try the exact format from capture
-        data = b'\x00\x00\x00\x00' + bytes([length]) + payload_bytes
-        
-        async with httpx.AsyncClient(limits=self.limits, timeout=60.0) as client:
+        client = self._acquire_client()
+        started = time.monotonic()
+        received = 0
+        completed = False
+        try:
             async with client.stream(
                 'POST',
                 f"{self.base_url}/apiv2/kimi.chat.v1.ChatService/Chat",
                 headers=headers,
-                content=data
+                content=data,
+                timeout=self._timeout('chat')
             ) as response:
+                UPSTREAM_CHAT_FIRST_BYTE.observe(time.monotonic() - started)
                 if response.status_code != 200:
-                    raise Exception(f"Chat API failed: {response.status_code}")
+                    raise KimiAPIError(f"Chat API failed: {response.status_code}", response.status_code)
                 
                 # 使用专门的解析器处理Kimi流响应
                 parser = KimiStreamParser()
@@ -185,6 +544,7 @@ class KimiClient:
                 
                 # 处理流式响应
                 async for chunk in response.aiter_bytes():
+                    received += len(chunk)
                     # 解析二进制数据中的JSON消息
                     for message in parser.parse_stream_data(chunk):
                         # 提取文本内容
@@ -192,10 +552,31 @@ class KimiClient:
                         if content:
                             yield KimiStreamEvent(event="cmpl", text=content)
                         
+                        # end-stream帧携带错误（如限流）时生成被中断，不能当作正常结束
+                        error = parser.get_stream_error(message)
+                        if error is not None:
+                            code = error.get('code')
+                            raise KimiAPIError(
+                                f"Chat stream failed: {code or 'unknown'}: {error.get('message', '')}",
+                                error_status(code)
+                            )
+                        
                         # 检查是否完成
                         if parser.is_stream_complete(message):
+                            completed = True
                             yield KimiStreamEvent(event="all_done")
                             return
+        except (GeneratorExit, asyncio.CancelledError):
+            # 下游（客户端断开）提前结束，退出async with时即关闭上游连接，不再继续读取
+            if not completed:
+                UPSTREAM_STREAMS_CANCELLED.inc()
+                UPSTREAM_BYTES_SAVED.inc(max(self._stream_bytes - received, 0))
+            raise
+        finally:
+            UPSTREAM_BYTES.inc(received)
+            if completed:
+                self._stream_bytes += 0.1 * (received - self._stream_bytes) if self._stream_bytes else received
+            await self._release_client(client)
     
     async def chat_completion(
         self, 
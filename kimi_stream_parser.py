@@ -1,45 +1,29 @@
 import json
 import re
 from typing import Generator, Dict, Any, Optional
+from connect_codec import ConnectEnvelopeDecoder, FLAG_END_STREAM
 
 class KimiStreamParser:
     """Kimi流响应解析器，基于实际的API响应格式"""
     
     def __init__(self):
         self.content = ""
-        self.buffer = b""
-        
+        self.decoder = ConnectEnvelopeDecoder()
+    
     def parse_stream_data(self, data: bytes) -> Generator[Dict[str, Any], None, None]:
-        """解析Kimi流数据"""
-        self.buffer += data
-        
-        while len(self.buffer) >= 4:
-            # 查找长度前缀 (4字节的null字节 + 1字节长度)
-            if self.buffer.startswith(b'\x00\x00\x00\x00'):
-                if len(self.buffer) < 5:
-                    break
-                    
-                # 获取消息长度
-                length = self.buffer[4]
-                total_length = 5 + length
-                
-                if len(self.buffer) < total_length:
-                    break
-                
-                # 提取JSON消息
-                json_data = self.buffer[5:total_length]
-                self.buffer = self.buffer[total_length:]
-                
-                try:
-                    # 解析JSON
-                    json_str = json_data.decode('utf-8', errors='ignore')
-                    message = json.loads(json_str)
-                    yield message
-                except (json.JSONDecodeError, UnicodeDecodeError):
-                    continue
+        """解析Kimi流数据（Connect envelope帧）"""
+        for flags, payload in self.decoder.feed(data):
+            try:
+                # 解析JSON
+                message = json.loads(payload.decode('utf-8', errors='ignore'))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+            
+            if flags & FLAG_END_STREAM:
+                # 流结束帧，可能携带error信息
+                yield {'end_stream': message}
             else:
-                # 跳过无法识别的字节
-                self.buffer = self.buffer[1:]
+                yield message
     
     def extract_content_from_message(self, message: Dict[str, Any]) -> Optional[str]:
         """从消息中提取文本内容"""
@@ -75,48 +59,40 @@ class KimiStreamParser:
                     return ''.join(content_parts)
             
             return None
-            
+        
         except (KeyError, TypeError, AttributeError):
             return None
     
     def _is_valid_text(self, text: str) -> bool:
         """检查文本是否有效（非控制字符）"""
-        if not text:
+        # 空文本、纯空白或包含编码错误字符（\ufffd）均视为无效
+        if not text or '\ufffd' in text or text.isspace():
             return False
         
-        # 检查是否只包含无效字符（如控制字符、编码错误字符等）
-        # 如果字符串包含大量不可打印字符，可能是编码错误
-        printable_count = sum(1 for char in text if char.isprintable() or char in '\n\r\t ')
-        
-        # 如果可打印字符太少，认为是无效文本
-        if len(text) > 1 and printable_count / len(text) < 0.5:
-            return False
-        
-        # 过滤特定的无效模式
-        # 如果文本只包含特殊符号或控制字符的组合，认为无效
-        stripped = text.strip()
-        if not stripped:
-            return False
-            
-        # 检查是否包含常见的编码错误字符
-        invalid_chars = ['��', '�', '\ufffd']
-        if any(invalid in text for invalid in invalid_chars):
-            # 如果包含编码错误字符，但还有其他有效内容，则尝试清理
-            cleaned = text
-            for invalid in invalid_chars:
-                cleaned = cleaned.replace(invalid, '')
-            if cleaned.strip():
-                return False  # 暂时拒绝包含编码错误的内容
-            return False
+        # 快速路径：整体可打印（忽略换行/制表符）时无需逐字符统计，均为C层面的调用
+        if text.isprintable() or text.replace('\n', '').replace('\r', '').replace('\t', '').isprintable():
+            return True
         
-        return True
+        # 少见情况：包含控制字符，如果可打印字符太少，可能是编码错误
+        printable_count = sum(1 for char in text if char.isprintable() or char in '\n\r\t ')
+        return len(text) == 1 or printable_count / len(text) >= 0.5
+    
+    def get_stream_error(self, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """携带error的end-stream帧返回error（code、message），否则返回None"""
+        end_stream = message.get('end_stream')
+        if not isinstance(end_stream, dict) or not end_stream.get('error'):
+            return None
+        error = end_stream['error']
+        return error if isinstance(error, dict) else {'message': str(error)}
     
     def is_stream_complete(self, message: Dict[str, Any]) -> bool:
-        """判断流是否完成"""
+        """判断流是否正常完成（携带error的end-stream帧不算，需先用get_stream_error检查）"""
         try:
             # 检查是否有done事件（更准确的完成标志）
             if 'done' in message:
                 return True
+            if 'end_stream' in message:
+                return self.get_stream_error(message) is None
             
             # 备用检查：消息状态完成
             return (message.get('op') == 'set' and 
@@ -1,14 +1,16 @@
 from fastapi import FastAPI, HTTPException, Header
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from typing import List, Optional, Dict, Any, Union
 import asyncio
+import functools
 import time
 import jwt
 import json
 import os
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone, timedelta
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from models import (
     ChatCompletionRequest,
@@ -16,8 +18,23 @@ from models import (
     Message
 )
 from kimi_client import KimiClient
+from conversation_pool import ConversationPool
+from session_affinity import SessionAffinity, fingerprint, render_history
+from response_cache import ResponseCache, cache_key
+from hedging import HedgePolicy, hedged_stream
+from deletion_queue import ConversationDeletionQueue
 from response_processor import ResponseProcessor
+from stream_coalescer import coalesce_events
+from streaming import DisconnectAwareStreamingResponse
+from token_scheduler import TokenScheduler
+from admission import AdmissionController, AdmissionRejected
+from api_keys import ApiKey, ApiKeyRegistry, ApiKeyRegistrySync
+from token_registry import TokenRegistry, TokenRegistrySync
+from token_store import TokenStore
+from token_import import TokenImportJob, TokenImportJobs
+from state_backend import create_state_backend
 from config import Config
+import metrics
 
 # 数据模型
 class TokenBatchRequest(BaseModel):
@@ -33,20 +50,73 @@ class TokenInfo(BaseModel):
     access_token_exp_time: Optional[int] = None
     access_token_exp_time_beijing: Optional[str] = None
 
+class ApiKeyRequest(BaseModel):
+    """未传的字段保持不变，显式传null时恢复默认（权重1、不限制并发和速率）"""
+    name: Optional[str] = None
+    key: Optional[str] = None  # 创建时可指定key，不指定则随机生成
+    weight: Optional[float] = Field(None, gt=0)
+    max_concurrency: Optional[int] = Field(None, ge=0)
+    rps: Optional[float] = Field(None, ge=0)
+    burst: Optional[float] = Field(None, ge=0)
+
 class EnvironmentVariable(BaseModel):
     key: str
     value: str
 
-# 创建 FastAPI 应用和客户端实例
-app = FastAPI(title="Kimi2API", version="1.0.0")
+# 创建客户端实例和 FastAPI 应用
 kimi_client = KimiClient()
+token_scheduler = TokenScheduler()
+admission = AdmissionController(token_scheduler)
+api_keys = ApiKeyRegistry()
+deletion_queue = ConversationDeletionQueue(kimi_client)
+conversation_pool = ConversationPool(kimi_client, deletion_queue)
+session_affinity = SessionAffinity(kimi_client, deletion_queue)
+response_cache = ResponseCache()
+hedge_policy = HedgePolicy()
+import_jobs = TokenImportJobs()
 
-# 设置Config的回调函数以获取tokens_db中的tokens
-def get_tokens_from_db():
-    """供Config使用的回调函数，返回tokens_db中的有效tokens"""
-    return tokens_db
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时创建共享上游客户端，关闭时释放连接池"""
+    global token_store, state_backend, registry_sync, api_key_sync
+    if Config.TOKEN_STORE_PATH:
+        # 从持久化存储恢复token，access token在首次使用时按需加载
+        token_store = TokenStore(Config.TOKEN_STORE_PATH)
+        token_store.purge_expired_access_tokens()
+        token_registry.load(token_store.load_tokens(), token_store.get_next_id())
+        kimi_client.token_store = token_store
+    
+    # 多worker部署时通过共享状态后端同步token列表和access token
+    state_backend = create_state_backend(Config.STATE_BACKEND)
+    kimi_client.state_backend = state_backend
+    registry_sync = TokenRegistrySync(token_registry, state_backend, Config.STATE_SYNC_INTERVAL)
+    await registry_sync.start()
+    api_key_sync = ApiKeyRegistrySync(api_keys, state_backend, Config.STATE_SYNC_INTERVAL)
+    await api_key_sync.start()
+    
+    await kimi_client.start()
+    await deletion_queue.start()
+    await conversation_pool.start()
+    await session_affinity.start()
+    cleanup_task = asyncio.create_task(periodic_cleanup())
+    try:
+        yield
+    finally:
+        cleanup_task.cancel()
+        await import_jobs.close()
+        await conversation_pool.close()
+        await session_affinity.close()
+        await deletion_queue.close()
+        await kimi_client.close()
+        await registry_sync.close()
+        await api_key_sync.close()
+        kimi_client.state_backend = None
+        await state_backend.close()
+        if token_store is not None:
+            kimi_client.token_store = None
+            token_store.close()
 
-Config.set_tokens_callback(get_tokens_from_db)
+app = FastAPI(title="Kimi2API", version="1.0.0", lifespan=lifespan)
 
 # 挂载静态文件
 import os
@@ -55,9 +125,63 @@ if os.path.exists(static_dir):
     app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
 # 全局变量存储token和环境变量
-tokens_db = []
+token_registry = TokenRegistry()
+token_store: Optional[TokenStore] = None
+state_backend = create_state_backend('memory')
+registry_sync = TokenRegistrySync(token_registry, state_backend)
+api_key_sync = ApiKeyRegistrySync(api_keys, state_backend)
 env_vars_file = "env_config.json"
 
+# 设置Config的回调函数以获取token注册表中的有效tokens
+Config.set_tokens_callback(token_registry.active_tokens)
+
+# 导出时从调度器、连接池等组件读取的指标
+def token_label(refresh_token: str) -> str:
+    """指标中的token标签：注册表id，环境变量配置的token使用末尾几位"""
+    token_info = token_registry.get(refresh_token)
+    return str(token_info["id"]) if token_info else refresh_token[-8:]
+
+def token_counter(index: int):
+    return lambda: [((token_label(counters[0]),), counters[index]) for counters in token_scheduler.get_counters()]
+
+def pool_utilization() -> float:
+    stats = kimi_client.get_pool_stats()
+    if not stats["max_connections"]:
+        return 0
+    return (stats["connections"] - stats["idle_connections"]) / stats["max_connections"]
+
+metrics.registry.callback("kimi2api_token_requests_total", "Requests per refresh token", "counter", token_counter(1), ("token",))
+metrics.registry.callback("kimi2api_token_errors_total", "Errors per refresh token", "counter", token_counter(2), ("token",))
+metrics.registry.callback("kimi2api_token_rate_limited_total", "Upstream 429 responses per refresh token", "counter", token_counter(3), ("token",))
+metrics.registry.callback(
+    "kimi2api_active_streams", "Chat completions in progress", "gauge",
+    lambda: sum(counters[4] for counters in token_scheduler.get_counters())
+)
+metrics.registry.callback("kimi2api_admission_active", "Requests holding an admission slot", "gauge", lambda: admission.active)
+metrics.registry.callback("kimi2api_admission_queue_depth", "Requests waiting for admission", "gauge", lambda: admission.queue_depth)
+metrics.registry.callback(
+    "kimi2api_api_key_requests_total", "Requests per API key", "counter",
+    lambda: [((api_key.name,), api_key.requests) for api_key in api_keys.all()], ("key",)
+)
+metrics.registry.callback(
+    "kimi2api_api_key_rate_limited_total", "Requests rejected by the API key rate quota", "counter",
+    lambda: [((api_key.name,), api_key.rate_limited) for api_key in api_keys.all()], ("key",)
+)
+metrics.registry.callback(
+    "kimi2api_api_key_active", "Requests in progress per API key", "gauge",
+    lambda: [((api_key.name,), api_key.active) for api_key in api_keys.all()], ("key",)
+)
+metrics.registry.callback("kimi2api_pool_connections", "Upstream connections", "gauge", lambda: kimi_client.get_pool_stats()["connections"])
+metrics.registry.callback("kimi2api_pool_idle_connections", "Idle upstream connections", "gauge", lambda: kimi_client.get_pool_stats()["idle_connections"])
+metrics.registry.callback("kimi2api_pool_queued_requests", "Requests waiting for an upstream connection", "gauge", lambda: kimi_client.get_pool_stats()["queued_requests"])
+metrics.registry.callback("kimi2api_pool_utilization", "Busy upstream connections / max connections", "gauge", pool_utilization)
+metrics.registry.callback("kimi2api_conversation_pool_size", "Pre-created conversations", "gauge", lambda: conversation_pool.get_stats()["total_conversations"])
+metrics.registry.callback("kimi2api_session_affinity_entries", "Conversations kept for follow-up turns", "gauge", lambda: session_affinity.get_stats()["entries"])
+metrics.registry.callback("kimi2api_response_cache_bytes", "Response cache size", "gauge", lambda: response_cache.get_stats()["size_bytes"])
+metrics.registry.callback("kimi2api_response_cache_hits_total", "Responses replayed from cache", "counter", lambda: response_cache.hits)
+metrics.registry.callback("kimi2api_response_cache_coalesced_total", "Requests that shared an in-flight upstream generation", "counter", lambda: response_cache.coalesced)
+metrics.registry.callback("kimi2api_deletion_queue_depth", "Conversations waiting to be deleted", "gauge", lambda: deletion_queue.get_stats()["depth"])
+
 # 辅助函数
 def parse_jwt_token(token: str) -> Dict[str, Any]:
     """解析JWT token获取过期时间等信息"""
@@ -80,10 +204,16 @@ def is_token_expired(exp_timestamp: int, hours_threshold: int = 24) -> bool:
     time_diff = exp_timestamp - current_time
     return time_diff < (hours_threshold * 3600)
 
-def cleanup_expired_tokens():
-    """清理即将过期的token（24小时内）"""
-    global tokens_db
-    tokens_db = [token for token in tokens_db if not is_token_expired(token["exp_time"])]
+async def cleanup_expired_tokens() -> int:
+    """清理即将过期的token（24小时内），返回清理数量"""
+    removed = token_registry.cleanup_expired()
+    await registry_sync.publish([], removed)
+    if token_store is not None:
+        token_store.remove_tokens(token_info["token"] for token_info in removed)
+    for token_info in removed:
+        kimi_client.forget_access_token(token_info["token"])
+        token_scheduler.discard(token_info["token"])
+    return len(removed)
 
 def load_env_vars() -> Dict[str, str]:
     """从文件加载环境变量"""
@@ -100,79 +230,141 @@ def save_env_vars(env_vars: Dict[str, str]):
     with open(env_vars_file, 'w', encoding='utf-8') as f:
         json.dump(env_vars, f, ensure_ascii=False, indent=2)
 
-# 定时清理任务
-import threading
-def periodic_cleanup():
+# 定时清理任务（在lifespan中启动）
+async def periodic_cleanup():
     """定期清理过期token"""
     while True:
-        time.sleep(24 * 3600)  # 24小时
-        cleanup_expired_tokens()
-
-# 启动后台清理任务
-cleanup_thread = threading.Thread(target=periodic_cleanup, daemon=True)
-cleanup_thread.start()
+        await asyncio.sleep(24 * 3600)  # 24小时
+        try:
+            await cleanup_expired_tokens()
+        except Exception:
+            pass
 
 # Token管理API端点
-@app.post("/api/tokens/batch")
-async def add_tokens_batch(request: TokenBatchRequest):
-    """批量添加tokens"""
-    global tokens_db
-    added_tokens = []
-    
-    for token_str in request.tokens:
+def build_token_info(token_str: str, exp_time: int, access_token_response: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """构造token记录，access token获取失败时相关字段为空"""
+    access_token_info = None
+    if access_token_response:
+        expires_at = int(access_token_response.get('expires_at', 0))
+        access_token_info = {
+            "access_token": access_token_response.get('access_token'),
+            "access_token_exp_time": expires_at,
+            "access_token_exp_time_beijing": timestamp_to_beijing_time(expires_at)
+        }
+    return {
+        "id": None,  # 添加时分配
+        "token": token_str,
+        "exp_time": exp_time,
+        "exp_time_beijing": timestamp_to_beijing_time(exp_time),
+        "is_expired": is_token_expired(exp_time),
+        "access_token": access_token_info.get('access_token') if access_token_info else None,
+        "access_token_exp_time": access_token_info.get('access_token_exp_time') if access_token_info else None,
+        "access_token_exp_time_beijing": access_token_info.get('access_token_exp_time_beijing') if access_token_info else None
+    }
+
+async def import_tokens(token_strs: List[str], job: TokenImportJob) -> List[Dict[str, Any]]:
+    """
+    导入token
+    先批量解析JWT并去重，再以有限并发获取access token，按批次写入注册表，
+    每批完成后即可参与调度，进度记录在job中
+    """
+    # 批量校验：去掉空行、重复和已存在的token，跳过无法解析的JWT
+    candidates = []
+    seen = set()
+    for token_str in token_strs:
         token_str = token_str.strip()
-        if not token_str:
+        if not token_str or token_str in seen or token_str in token_registry:
+            job.skipped += 1
+            job.processed += 1
             continue
-            
+        seen.add(token_str)
         try:
             payload = parse_jwt_token(token_str)
-            exp_time = payload.get('exp', 0)
-            
-            # 检查是否已存在
-            if any(t['token'] == token_str for t in tokens_db):
-                continue
-                
-            # 尝试获取access token
-            access_token_info = None
+        except ValueError:
+            job.invalid += 1
+            job.processed += 1
+            continue
+        candidates.append((token_str, payload.get('exp', 0)))
+    
+    semaphore = asyncio.Semaphore(max(Config.TOKEN_IMPORT_CONCURRENCY, 1))
+    
+    async def prepare(token_str: str, exp_time: int) -> Dict[str, Any]:
+        access_token_response = None
+        async with semaphore:
             try:
                 access_token_response = await kimi_client.refresh_access_token(token_str)
-                access_token_info = {
-                    "access_token": access_token_response.get('access_token'),
-                    "access_token_exp_time": int(access_token_response.get('expires_at', 0)),
-                    "access_token_exp_time_beijing": timestamp_to_beijing_time(int(access_token_response.get('expires_at', 0)))
-                }
             except Exception:
                 # 如果获取access token失败，仍然添加refresh token
-                pass
-            
-            token_info = {
-                "id": len(tokens_db) + 1,
-                "token": token_str,
-                "exp_time": exp_time,
-                "exp_time_beijing": timestamp_to_beijing_time(exp_time),
-                "is_expired": is_token_expired(exp_time),
-                "access_token": access_token_info.get('access_token') if access_token_info else None,
-                "access_token_exp_time": access_token_info.get('access_token_exp_time') if access_token_info else None,
-                "access_token_exp_time_beijing": access_token_info.get('access_token_exp_time_beijing') if access_token_info else None
-            }
-            
-            tokens_db.append(token_info)
-            added_tokens.append(token_info)
-            
-        except Exception as e:
-            continue  # 跳过无效token
+                job.refresh_failed += 1
+        return build_token_info(token_str, exp_time, access_token_response)
     
-    return {"message": f"Added {len(added_tokens)} tokens", "tokens": added_tokens}
+    added_tokens = []
+    batch_size = max(Config.TOKEN_IMPORT_BATCH_SIZE, 1)
+    for start in range(0, len(candidates), batch_size):
+        batch = await asyncio.gather(*(prepare(*item) for item in candidates[start:start + batch_size]))
+        
+        added = []
+        for token_info in batch:
+            token_info["id"] = await registry_sync.allocate_id()  # 共享后端分配全局id，否则由注册表分配
+            if token_registry.add(token_info):
+                added.append(token_info)
+            else:
+                job.skipped += 1
+        await registry_sync.publish(added, [])
+        if token_store is not None and added:
+            token_store.save_tokens(added, token_registry.next_id)
+        
+        added_tokens.extend(added)
+        job.added += len(added)
+        job.processed += len(batch)
+    
+    return added_tokens
+
+@app.post("/api/tokens/batch")
+async def add_tokens_batch(request: TokenBatchRequest, background: Optional[bool] = None):
+    """
+    批量添加tokens
+    数量不超过TOKEN_IMPORT_SYNC_LIMIT时直接返回结果，否则作为后台任务执行并返回任务id
+    """
+    job = import_jobs.create(len(request.tokens))
+    if background is None:
+        background = len(request.tokens) > Config.TOKEN_IMPORT_SYNC_LIMIT
+    
+    if background:
+        import_jobs.run(job, import_tokens(request.tokens, job))
+        return JSONResponse(
+            status_code=202,
+            content={"message": f"Importing {job.total} tokens", "job_id": job.id, "job": job.to_dict()}
+        )
+    
+    job.status = 'running'
+    try:
+        added_tokens = await import_tokens(request.tokens, job)
+        job.status = 'done'
+    finally:
+        job.finished_at = time.time()
+    return {"message": f"Added {len(added_tokens)} tokens", "tokens": added_tokens, "job": job.to_dict()}
+
+@app.get("/api/tokens/import")
+async def list_import_jobs():
+    """获取最近的token导入任务"""
+    return {"jobs": import_jobs.list()}
+
+@app.get("/api/tokens/import/{job_id}")
+async def get_import_job(job_id: str):
+    """获取token导入任务进度"""
+    job = import_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job.to_dict()
 
 @app.get("/api/tokens")
 async def get_tokens(page: int = 1, per_page: int = 15):
     """获取token列表（分页）"""
-    cleanup_expired_tokens()  # 获取前先清理
+    await cleanup_expired_tokens()  # 获取前先清理
     
-    total = len(tokens_db)
-    start = (page - 1) * per_page
-    end = start + per_page
-    tokens_page = tokens_db[start:end]
+    total = len(token_registry)
+    tokens_page = token_registry.page(page, per_page)
     
     return {
         "tokens": tokens_page,
@@ -185,19 +377,231 @@ async def get_tokens(page: int = 1, per_page: int = 15):
 @app.delete("/api/tokens/{token_id}")
 async def delete_token(token_id: int):
     """删除指定token"""
-    global tokens_db
-    tokens_db = [t for t in tokens_db if t["id"] != token_id]
+    token_info = token_registry.remove(token_id)
+    if token_info:
+        await registry_sync.publish([], [token_info])
+        if token_store is not None:
+            token_store.remove_tokens([token_info["token"]])
+        kimi_client.forget_access_token(token_info["token"])
+        conversation_pool.discard(token_info["token"])
+        session_affinity.discard(token_info["token"])
+        token_scheduler.discard(token_info["token"])
     return {"message": "Token deleted"}
 
 @app.delete("/api/tokens/cleanup")
 async def cleanup_tokens():
     """手动清理过期token"""
-    global tokens_db
-    original_count = len(tokens_db)
-    cleanup_expired_tokens()
-    removed_count = original_count - len(tokens_db)
+    removed_count = await cleanup_expired_tokens()
     return {"message": f"Removed {removed_count} expired tokens"}
 
+async def release_conversation(refresh_token: str, access_token: str, conv_id: str):
+    """会话用完后交给删除队列，队列已满时直接删除"""
+    if deletion_queue.enqueue(refresh_token, conv_id):
+        return
+    try:
+        await kimi_client.delete_conversation(access_token, conv_id)
+    except:
+        pass
+
+async def finish_conversation(
+    refresh_token: str,
+    access_token: str,
+    conv_id: str,
+    messages: List[Message],
+    prefix: Optional[bytes],
+    reply: Optional[str]
+):
+    """回复完整结束时按包含本轮回复的消息指纹保留会话，下一轮命中后只需发送新消息；否则清理会话"""
+    if prefix is not None and reply is not None:
+        key = fingerprint([messages[-1], Message(role="assistant", content=reply)], prefix)
+        session_affinity.put(key, refresh_token, conv_id)
+        return
+    await release_conversation(refresh_token, access_token, conv_id)
+
+async def next_token_cursor() -> Optional[int]:
+    """多worker部署时使用共享的轮询位置，后端不可用时退回本地轮询"""
+    if not state_backend.shared:
+        return None
+    try:
+        return await state_backend.incr('kimi2api:token_cursor')
+    except Exception:
+        return None
+
+def release_token(refresh_token: str, api_key: Optional[ApiKey], started: float, error: Optional[Exception] = None):
+    """释放token和API key的并发占用并反馈请求结果，401时丢弃缓存的access token"""
+    admission.release(refresh_token, error, time.monotonic() - started, api_key)
+    if getattr(error, 'status_code', None) == 401:
+        kimi_client.forget_access_token(refresh_token)
+
+class UpstreamLease:
+    """
+    一次上游请求占用的token（及API key并发）和会话
+    release只生效一次：事件流结束时由upstream_events调用；事件流未开始读取就被关闭时
+    生成器的finally不会执行，由持有事件流的一方（响应、对冲、共享生成）兜底调用
+    """
+    
+    def __init__(
+        self,
+        refresh_token: str,
+        api_key: Optional[ApiKey],
+        access_token: str,
+        conv_id: str,
+        messages: List[Message],
+        prefix: Optional[bytes],
+        started: float
+    ):
+        self.refresh_token = refresh_token
+        self.api_key = api_key
+        self.access_token = access_token
+        self.conv_id = conv_id
+        self.messages = messages
+        self.prefix = prefix
+        self.started = started
+        self.released = False
+    
+    async def release(self, error: Optional[Exception] = None, reply: Optional[str] = None):
+        """释放token并保留或清理会话，重复调用无效"""
+        if self.released:
+            return
+        self.released = True
+        release_token(self.refresh_token, self.api_key, self.started, error)
+        await finish_conversation(
+            self.refresh_token, self.access_token, self.conv_id, self.messages, self.prefix, reply
+        )
+
+async def track_stream(stream, refresh_token: str, started: float):
+    """记录首个内容增量的延迟供token调度参考，并统计增量间隔"""
+    last = None
+    gap = metrics.STREAM_TOKEN_GAP
+    try:
+        async for event in stream:
+            if event.event == 'cmpl':
+                now = time.monotonic()
+                if last is None:
+                    token_scheduler.record_latency(refresh_token, now - started)
+                else:
+                    gap.observe(now - last)
+                last = now
+            yield event
+    finally:
+        await stream.aclose()
+
+async def upstream_events(lease: UpstreamLease, upstream_messages: List[Message]):
+    """
+    上游事件流，结束或被关闭时通过lease释放token并保留或清理会话
+    上游完整结束（all_done）时本轮回复交给会话亲和，提前关闭（客户端断开、max_tokens/stop）时清理会话
+    """
+    error = None
+    reply = None
+    parts = [] if lease.prefix is not None else None
+    stream = kimi_client.chat_completion_stream(lease.access_token, lease.conv_id, upstream_messages)
+    try:
+        stream = track_stream(stream, lease.refresh_token, lease.started)
+        async for event in stream:
+            if parts is not None:
+                if event.event == 'cmpl' and event.text:
+                    parts.append(event.text)
+                elif event.event == 'all_done':
+                    reply = ''.join(parts)
+            yield event
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        await stream.aclose()
+        await lease.release(error, reply)
+
+async def start_backup_attempt(
+    request: ChatCompletionRequest,
+    primary_token: str,
+    upstream_messages: List[Message],
+    prefix: Optional[bytes]
+):
+    """
+    对冲的备份请求：不排队地获取另一个token和会话，返回事件流和释放回调；
+    没有空闲token时返回None（不占用API key并发）
+    """
+    tokens = [token for token in Config.get_active_refresh_tokens() if token != primary_token]
+    refresh_token = admission.try_acquire(tokens, await next_token_cursor())
+    if refresh_token is None:
+        return None
+    started = time.monotonic()
+    try:
+        token_info = await kimi_client.refresh_access_token(refresh_token)
+        access_token = token_info['access_token']
+        conv_id = await conversation_pool.acquire(refresh_token, access_token)
+    except BaseException as e:
+        release_token(refresh_token, None, started, e if isinstance(e, Exception) else None)
+        raise
+    lease = UpstreamLease(refresh_token, None, access_token, conv_id, request.messages, prefix, started)
+    return upstream_events(lease, upstream_messages), lease.release
+
+async def build_response(
+    request: ChatCompletionRequest,
+    processor: ResponseProcessor,
+    events,
+    started: float,
+    key: Optional[str] = None,
+    cache_status: Optional[str] = None,
+    release=None
+):
+    """
+    把事件流转换为流式或非流式响应，正常结束的输出写入响应缓存
+    release为释放事件流所占资源的回调（需幂等），响应结束时总会调用，与事件流是否开始读取无关
+    """
+    headers = {"X-Cache": cache_status} if cache_status else {}
+    if request.stream:
+        # 流式响应
+        async def generate_stream():
+            stream = events
+            try:
+                # 合并细碎增量，减少SSE事件数和写入次数
+                coalesce_ms = request.stream_coalesce_ms
+                if coalesce_ms is None:
+                    coalesce_ms = Config.STREAM_COALESCE_MAX_DELAY_MS
+                coalesce_chars = request.stream_coalesce_chars or Config.STREAM_COALESCE_MAX_CHARS
+                stream = coalesce_events(stream, coalesce_chars, coalesce_ms / 1000)
+                
+                sse_bytes = metrics.SSE_BYTES
+                async for chunk in processor.process_stream_to_chunks(stream):
+                    sse_bytes.inc(len(chunk))
+                    yield chunk
+                if key is not None and processor.output is not None:
+                    response_cache.put(key, processor.conv_id, *processor.output)
+            except Exception as e:
+                yield f"data: {{\"error\": \"{str(e)}\"}}\n\n"
+                yield "data: [DONE]\n\n"
+            finally:
+                # 客户端断开或达到max_tokens/stop时提前结束，上层生成器不会级联关闭，
+                # 显式关闭最外层事件流（逐层取消进行中的读取并关闭上游流）；
+                # 合并层未开始迭代时不会关闭内层，因此再直接关闭原始事件流
+                await stream.aclose()
+                await events.aclose()
+                if release is not None:
+                    await release()
+                metrics.STREAM_DURATION.observe(time.monotonic() - started)
+        
+        # 客户端断开时立即取消生成器，上游流随之关闭；生成器未开始迭代时由on_close释放
+        return DisconnectAwareStreamingResponse(
+            generate_stream(),
+            media_type="text/plain",
+            headers={"Cache-Control": "no-cache", "Connection": "keep-alive", **headers},
+            on_close=release
+        )
+    
+    # 非流式响应
+    try:
+        response = await processor.process_stream_to_completion(events)
+    finally:
+        # 达到max_tokens/stop时立即关闭上游流
+        await events.aclose()
+        if release is not None:
+            await release()
+        metrics.COMPLETION_DURATION.observe(time.monotonic() - started)
+    if key is not None and processor.output is not None:
+        response_cache.put(key, processor.conv_id, *processor.output)
+    return JSONResponse(content=response.model_dump(mode="json"), headers=headers)
+
 # 环境变量管理API端点
 @app.get("/api/env")
 async def get_env_vars():
@@ -240,14 +644,107 @@ async def apply_env_vars_live(env_vars: Dict[str, str]):
     try:
         # 实时更新配置
         updated = Config.update_config_live(filtered_env_vars)
+        
+        # 连接池参数变化时热重建连接池，进行中的流在旧连接池上继续完成
+        pool_keys = {"MAX_CONNECTIONS", "MAX_KEEPALIVE_CONNECTIONS", "KEEPALIVE_EXPIRY"}
+        pool_reconfigured = False
+        if pool_keys & updated.keys():
+            pool_reconfigured = await kimi_client.reconfigure()
+        
         return {
             "message": f"Successfully applied {len(updated)} configuration changes",
             "updated": updated,
+            "pool_reconfigured": pool_reconfigured,
+            "pool": kimi_client.get_pool_stats(),
             "note": "Changes applied immediately without restart"
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to apply configuration: {str(e)}")
 
+@app.get("/api/pool/stats")
+async def get_pool_stats():
+    """获取上游连接池状态"""
+    return kimi_client.get_pool_stats()
+
+@app.get("/api/scheduler/stats")
+async def get_scheduler_stats():
+    """获取refresh token调度状态"""
+    return token_scheduler.get_stats()
+
+# API key管理端点
+@app.get("/api/keys")
+async def list_api_keys():
+    """获取API key及配额（不包含key原文）"""
+    return {"keys": api_keys.list()}
+
+@app.post("/api/keys")
+async def create_api_key(request: ApiKeyRequest):
+    """创建API key，key原文只在创建时返回一次"""
+    try:
+        api_key, raw_key = api_keys.create(request.model_dump(exclude={"key"}, exclude_unset=True), request.key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await api_key_sync.publish([api_keys.record(api_key)], [])
+    return {"key": raw_key, "api_key": api_key.to_dict()}
+
+@app.put("/api/keys/{key_id}")
+async def update_api_key(key_id: str, request: ApiKeyRequest):
+    """修改API key的权重和配额"""
+    api_key = api_keys.update(key_id, request.model_dump(exclude={"key"}, exclude_unset=True))
+    if api_key is None:
+        raise HTTPException(status_code=404, detail="API key not found")
+    await api_key_sync.publish([api_keys.record(api_key)], [])
+    return api_key.to_dict()
+
+@app.delete("/api/keys/{key_id}")
+async def delete_api_key(key_id: str):
+    """删除API key（默认key即AUTH_KEY不能删除）"""
+    if api_keys.remove(key_id) is None:
+        raise HTTPException(status_code=404, detail="API key not found")
+    await api_key_sync.publish([], [key_id])
+    return {"message": "API key deleted"}
+
+@app.get("/api/admission/stats")
+async def get_admission_stats():
+    """获取准入控制状态"""
+    return admission.get_stats()
+
+@app.get("/api/conversations/stats")
+async def get_conversation_pool_stats():
+    """获取预创建会话池状态"""
+    return conversation_pool.get_stats()
+
+@app.get("/api/conversations/affinity")
+async def get_session_affinity_stats():
+    """获取多轮对话会话亲和状态"""
+    return session_affinity.get_stats()
+
+@app.get("/api/cache/stats")
+async def get_response_cache_stats():
+    """获取响应缓存状态"""
+    return response_cache.get_stats()
+
+@app.delete("/api/cache")
+async def clear_response_cache():
+    """清空响应缓存"""
+    response_cache.clear()
+    return {"message": "Response cache cleared"}
+
+@app.get("/api/hedging/stats")
+async def get_hedging_stats():
+    """获取对冲请求状态"""
+    return hedge_policy.get_stats()
+
+@app.get("/api/conversations/deletions")
+async def get_deletion_queue_stats():
+    """获取会话删除队列状态"""
+    return deletion_queue.get_stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus格式的指标（每个worker进程分别统计）"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/admin")
 async def admin_page():
     """管理页面"""
@@ -275,9 +772,10 @@ async def list_models():
 @app.post("/v1/chat/completions")
 async def create_chat_completion(
     request: ChatCompletionRequest,
-    authorization: str = Header(None)
+    authorization: str = Header(None),
+    cache_control: Optional[str] = Header(None)
 ):
-    """创建聊天完成"""
+    """创建聊天完成，请求头Cache-Control: no-cache/no-store可跳过响应缓存"""
     if not authorization:
         raise HTTPException(status_code=401, detail="Authorization header required")
     
@@ -288,65 +786,170 @@ async def create_chat_completion(
     auth_key = authorization[7:]  # 移除 "Bearer " 前缀
     
     # 验证鉴权key是否正确
-    if auth_key != Config.AUTH_KEY:
+    api_key = api_keys.authenticate(auth_key)
+    if api_key is None:
         raise HTTPException(status_code=401, detail="Invalid authentication key")
     
-    # 获取轮询的refresh token
-    refresh_token = Config.get_next_refresh_token()
-    if not refresh_token:
-        raise HTTPException(status_code=500, detail="No refresh tokens available")
+    # API key的请求速率配额（令牌桶）
+    retry_after = api_key.consume()
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Rate limit exceeded for this API key",
+            headers={"Retry-After": str(max(int(retry_after + 0.999), 1))}
+        )
     
     # 验证模型名称
     if request.model != "Kimi-K2":
         raise HTTPException(status_code=400, detail="Only Kimi-K2 model is supported")
     
+    # 响应缓存：命中时直接重放，相同请求进行中时共享其上游生成
+    flight = None
+    key = None
+    if response_cache.enabled:
+        cache_control = (cache_control or "").lower()
+        if "no-store" not in cache_control:
+            key = cache_key(request)
+            if "no-cache" not in cache_control:
+                entry = response_cache.get(key)
+                if entry is not None:
+                    processor = ResponseProcessor(request.model, entry.conv_id)
+                    return await build_response(request, processor, response_cache.replay(entry), time.monotonic(), cache_status="HIT")
+                while (shared := response_cache.join(key)) is not None:
+                    try:
+                        await shared.wait_started()
+                    except ConnectionAbortedError:
+                        # 发起方在上游开始前被取消，重新查找或由本请求发起
+                        continue
+                    except HTTPException:
+                        raise
+                    except Exception as e:
+                        raise HTTPException(status_code=500, detail=f"Failed to process request: {str(e)}")
+                    processor = ResponseProcessor(request.model, shared.conv_id, request.max_tokens, request.stop, record=True)
+                    events = shared.subscribe()
+                    try:
+                        return await build_response(
+                            request, processor, events, time.monotonic(), key, "COALESCED",
+                            functools.partial(shared.unsubscribe, events)
+                        )
+                    except Exception as e:
+                        raise HTTPException(status_code=500, detail=f"Failed to process request: {str(e)}")
+            flight = response_cache.lead(key)
+    
+    try:
+        return await start_chat_completion(request, api_key, key, flight)
+    except asyncio.CancelledError:
+        if flight is not None:
+            flight.abort(ConnectionAbortedError("Request cancelled before upstream started"))
+        raise
+    except Exception as e:
+        # 发起方在上游开始前失败，等待共享的请求收到同样的错误
+        if flight is not None:
+            flight.abort(e)
+        raise
+
+async def start_chat_completion(
+    request: ChatCompletionRequest,
+    api_key: ApiKey,
+    key: Optional[str] = None,
+    flight=None
+):
+    """选择token和会话并请求上游，flight不为空时上游事件在后台读取并与相同请求共享"""
+    # 按负载和健康状态选择refresh token
+    active_tokens = Config.get_active_refresh_tokens()
+    if not active_tokens:
+        raise HTTPException(status_code=500, detail="No refresh tokens available")
+    
+    # 多轮对话：按之前消息的指纹查找上一轮使用的会话，命中时在同一token的同一会话上只发送新消息
+    prefix = None
+    affinity = None
+    if session_affinity.enabled:
+        prefix = fingerprint(request.messages[:-1])
+    if prefix is not None and len(request.messages) > 1:
+        affinity = session_affinity.take(prefix)
+        if affinity is not None and (
+            affinity[0] not in active_tokens or token_scheduler.is_cooling_down(affinity[0])
+        ):
+            # token已删除或处于冷却中，放弃该会话按未命中处理
+            session_affinity.drop(*affinity)
+            affinity = None
+    refresh_token = None
+    busy = None
+    if affinity is not None:
+        # 会话固定在一个token上，只能不排队地获取：排在队首等待繁忙的token会阻塞其它token的请求，
+        # 该token繁忙时放弃会话，按未命中在任意token上发送完整历史
+        refresh_token = admission.try_acquire([affinity[0]], None, api_key)
+        if refresh_token is None:
+            busy, affinity = affinity, None
+    if refresh_token is None:
+        try:
+            # 全局、API key和单token并发已满时按key权重公平排队，队列已满或排队超时返回429
+            refresh_token = await admission.acquire(active_tokens, await next_token_cursor(), api_key)
+        except (AdmissionRejected, asyncio.CancelledError) as e:
+            # 未能执行时把会话放回，下次重试仍可命中
+            if busy is not None:
+                session_affinity.put(prefix, *busy)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+        if busy is not None:
+            session_affinity.drop(*busy)
+    started = time.monotonic()
+    release = None
+    
     try:
         # 获取 access token
         token_info = await kimi_client.refresh_access_token(refresh_token)
         access_token = token_info['access_token']
+        stage_started = time.monotonic()
+        metrics.STAGE_ACCESS_TOKEN.observe(stage_started - started)
         
-        # 创建会话
-        conv_id = await kimi_client.create_conversation(access_token)
-        
-        # 创建响应处理器
-        processor = ResponseProcessor(request.model, conv_id)
+        if affinity is not None:
+            # 命中上一轮的会话，只发送新消息
+            conv_id = affinity[1]
+            upstream_messages = request.messages[-1:]
+        else:
+            # 从预创建会话池获取会话，多轮对话把完整历史渲染为一条消息发送
+            conv_id = await conversation_pool.acquire(refresh_token, access_token)
+            upstream_messages = request.messages
+            if len(request.messages) > 1:
+                upstream_messages = [Message(role="user", content=render_history(request.messages))]
+        metrics.STAGE_CONVERSATION.observe(time.monotonic() - stage_started)
         
-        if request.stream:
-            # 流式响应
-            async def generate_stream():
-                try:
-                    stream = kimi_client.chat_completion_stream(access_token, conv_id, request.messages)
-                    async for chunk in processor.process_stream_to_chunks(stream):
-                        yield chunk
-                except Exception as e:
-                    yield f"data: {{\"error\": \"{str(e)}\"}}\n\n"
-                    yield "data: [DONE]\n\n"
-                finally:
-                    # 清理会话
-                    try:
-                        await kimi_client.delete_conversation(access_token, conv_id)
-                    except:
-                        pass
-            
-            return StreamingResponse(
-                generate_stream(),
-                media_type="text/plain",
-                headers={"Cache-Control": "no-cache", "Connection": "keep-alive"}
+        # 上游事件流结束或被关闭时释放token、保留或清理会话，未开始读取时由响应兜底释放
+        lease = UpstreamLease(refresh_token, api_key, access_token, conv_id, request.messages, prefix, started)
+        release = lease.release
+        events = upstream_events(lease, upstream_messages)
+        if hedge_policy.enabled and affinity is None:
+            # 首token过慢时在另一个token和会话上发起备份请求，先出token的一方胜出
+            events = hedged_stream(
+                events,
+                lambda: start_backup_attempt(request, refresh_token, upstream_messages, prefix),
+                hedge_policy
             )
+        cache_status = None
+        if flight is not None:
+            # 后台读取上游，本请求和之后相同的请求都作为订阅者
+            flight.start(conv_id, events, lease.release)
+            events = flight.subscribe()
+            release = functools.partial(flight.unsubscribe, events)
+            cache_status = "MISS"
+        
+        # 创建响应处理器
+        processor = ResponseProcessor(request.model, conv_id, request.max_tokens, request.stop, record=key is not None)
+        return await build_response(request, processor, events, started, key, cache_status, release)
+    
+    except BaseException as e:
+        error = e if isinstance(e, Exception) else None
+        if release is not None:
+            # 上游事件流已创建，已释放时不会重复释放
+            await release()
         else:
-            # 非流式响应
-            try:
-                stream = kimi_client.chat_completion_stream(access_token, conv_id, request.messages)
-                response = await processor.process_stream_to_completion(stream)
-                return response
-            finally:
-                # 清理会话
-                try:
-                    await kimi_client.delete_conversation(access_token, conv_id)
-                except:
-                    pass
-            
-    except Exception as e:
+            release_token(refresh_token, api_key, started, error)
+            if affinity is not None:
+                session_affinity.drop(*affinity)
+        if error is None:
+            raise
         raise HTTPException(status_code=500, detail=f"Failed to process request: {str(e)}")
 
 @app.get("/")
@@ -0,0 +1,220 @@
+import math
+from bisect import bisect_left
+from typing import Dict, List, Tuple, Callable, Iterable, Union
+
+# 默认直方图桶（秒），覆盖从缓存命中到分钟级长流
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# 流式增量间隔较短，使用更细的桶
+GAP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class _HistogramChild:
+    """单组标签的直方图，只记录各桶计数和总和，导出时再累加"""
+    __slots__ = ('buckets', 'counts', 'sum')
+    
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个为+Inf桶
+        self.sum = 0.0
+    
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+class _CounterChild:
+    __slots__ = ('value',)
+    
+    def __init__(self):
+        self.value = 0
+    
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+class Histogram:
+    """预聚合直方图"""
+    
+    type = 'histogram'
+    
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._children: Dict[tuple, _HistogramChild] = {}
+        if not self.label_names:
+            self._default = self.labels()
+    
+    def labels(self, *values: str) -> _HistogramChild:
+        """获取指定标签的子直方图，热路径上应缓存返回值"""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = _HistogramChild(self.buckets)
+        return child
+    
+    def observe(self, value: float):
+        self._default.observe(value)
+    
+    def collect(self) -> Iterable[str]:
+        for values, child in list(self._children.items()):
+            total = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                total += count
+                labels = _format_labels(self.label_names, values, f'le="{_format_value(bound)}"')
+                yield f'{self.name}_bucket{labels} {total}'
+            labels = _format_labels(self.label_names, values)
+            yield f'{self.name}_sum{labels} {_format_value(child.sum)}'
+            yield f'{self.name}_count{labels} {total}'
+
+class Counter:
+    """单调递增计数器"""
+    
+    type = 'counter'
+    
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._children: Dict[tuple, _CounterChild] = {}
+        if not self.label_names:
+            self._default = self.labels()
+    
+    def labels(self, *values: str) -> _CounterChild:
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = _CounterChild()
+        return child
+    
+    def inc(self, amount: float = 1):
+        self._default.value += amount
+    
+    def collect(self) -> Iterable[str]:
+        for values, child in list(self._children.items()):
+            yield f'{self.name}{_format_labels(self.label_names, values)} {_format_value(child.value)}'
+
+class CallbackMetric:
+    """
+    导出时才读取的指标，用于已有组件内部维护的状态（调度器、连接池等），请求路径上没有额外开销
+    回调返回单个数值，或(标签值元组, 数值)的列表
+    """
+    
+    def __init__(self, name: str, documentation: str, type: str, label_names: Tuple[str, ...],
+                 callback: Callable[[], Union[float, Iterable[Tuple[tuple, float]]]]):
+        self.name = name
+        self.documentation = documentation
+        self.type = type
+        self.label_names = tuple(label_names)
+        self.callback = callback
+    
+    def collect(self) -> Iterable[str]:
+        result = self.callback()
+        if not self.label_names:
+            yield f'{self.name} {_format_value(result)}'
+            return
+        for values, value in result:
+            yield f'{self.name}{_format_labels(self.label_names, values)} {_format_value(value)}'
+
+class MetricsRegistry:
+    """
+    Prometheus文本格式的指标注册表
+    指标在各worker进程内预聚合，记录时只做一次计数/桶定位，不加锁（所有记录都在事件循环线程内进行）；
+    多worker部署时每个worker分别导出
+    """
+    
+    def __init__(self):
+        self._metrics: List = []
+    
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+    
+    def histogram(self, name: str, documentation: str, label_names: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, label_names, buckets))
+    
+    def counter(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, label_names))
+    
+    def callback(self, name: str, documentation: str, type: str, callback: Callable,
+                 label_names: Tuple[str, ...] = ()) -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, type, label_names, callback))
+    
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            try:
+                lines.extend(metric.collect())
+            except Exception:
+                # 单个指标读取失败不影响其它指标导出
+                continue
+        lines.append('')
+        return '\n'.join(lines)
+
+registry = MetricsRegistry()
+
+# 上游请求耗时（chat_first_byte为对话请求收到响应头的时间）
+UPSTREAM_SECONDS = registry.histogram(
+    'kimi2api_upstream_request_seconds', 'Upstream request latency by operation', ('operation',)
+)
+UPSTREAM_REFRESH = UPSTREAM_SECONDS.labels('refresh')
+UPSTREAM_CREATE_CONVERSATION = UPSTREAM_SECONDS.labels('create_conversation')
+UPSTREAM_DELETE_CONVERSATION = UPSTREAM_SECONDS.labels('delete_conversation')
+UPSTREAM_CHAT_FIRST_BYTE = UPSTREAM_SECONDS.labels('chat_first_byte')
+
+# 请求各阶段耗时（包含缓存/会话池命中）
+STAGE_SECONDS = registry.histogram(
+    'kimi2api_request_stage_seconds', 'Chat completion stage latency', ('stage',)
+)
+STAGE_ACCESS_TOKEN = STAGE_SECONDS.labels('access_token')
+STAGE_CONVERSATION = STAGE_SECONDS.labels('conversation')
+
+STREAM_TOKEN_GAP = registry.histogram(
+    'kimi2api_stream_token_gap_seconds', 'Gap between consecutive upstream content deltas', buckets=GAP_BUCKETS
+)
+STREAM_DURATION_SECONDS = registry.histogram(
+    'kimi2api_stream_duration_seconds', 'Total chat completion duration', ('stream',)
+)
+STREAM_DURATION = STREAM_DURATION_SECONDS.labels('true')
+COMPLETION_DURATION = STREAM_DURATION_SECONDS.labels('false')
+
+SSE_BYTES = registry.counter('kimi2api_sse_bytes_written_total', 'SSE bytes written to clients')
+
+# 准入控制：排队等待时间和拒绝次数
+ADMISSION_WAIT = registry.histogram('kimi2api_admission_wait_seconds', 'Time requests spent in the admission queue')
+ADMISSION_REJECTED = registry.counter('kimi2api_admission_rejected_total', 'Requests rejected with 429', ('reason',))
+ADMISSION_REJECTED_FULL = ADMISSION_REJECTED.labels('queue_full')
+ADMISSION_REJECTED_TIMEOUT = ADMISSION_REJECTED.labels('timeout')
+
+# 客户端断开：提前取消的上游流，以及按完整流平均大小估算的少读取的上游字节数
+CLIENT_DISCONNECTS = registry.counter('kimi2api_client_disconnects_total', 'Streaming clients that disconnected before completion')
+UPSTREAM_STREAMS_CANCELLED = registry.counter('kimi2api_upstream_streams_cancelled_total', 'Upstream chat streams closed before completion')
+UPSTREAM_BYTES = registry.counter('kimi2api_upstream_bytes_received_total', 'Upstream chat stream bytes received')
+UPSTREAM_BYTES_SAVED = registry.counter(
+    'kimi2api_upstream_bytes_saved_total', 'Estimated upstream bytes not transferred because streams were cancelled early'
+)
+
+# 对冲请求：主请求首个内容增量超过延迟阈值时在另一个token上发起备份请求
+HEDGED_REQUESTS = registry.counter('kimi2api_hedged_requests_total', 'Backup attempts started by outcome', ('outcome',))
+HEDGE_WON = HEDGED_REQUESTS.labels('won')
+HEDGE_LOST = HEDGED_REQUESTS.labels('lost')
+HEDGE_FAILED = HEDGED_REQUESTS.labels('failed')
+HEDGE_SKIPPED = registry.counter('kimi2api_hedge_skipped_total', 'Hedges not started because of the budget or no free token', ('reason',))
+HEDGE_SKIPPED_BUDGET = HEDGE_SKIPPED.labels('budget')
+HEDGE_SKIPPED_NO_TOKEN = HEDGE_SKIPPED.labels('no_token')
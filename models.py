@@ -17,6 +17,10 @@ class ChatCompletionRequest(BaseModel):
     stream: Optional[bool] = False
     temperature: Optional[float] = 0.7
     max_tokens: Optional[int] = None
+    stop: Optional[Union[str, List[str]]] = None
+    # 流式增量合并（非OpenAI标准参数，未设置时使用服务端配置）
+    stream_coalesce_ms: Optional[float] = None
+    stream_coalesce_chars: Optional[int] = None
 
 class Choice(BaseModel):
     index: int
@@ -48,8 +52,26 @@ class ChatCompletionStreamResponse(BaseModel):
     model: str
     choices: List[StreamChoice]
 
-class KimiStreamEvent(BaseModel):
-    event: str
-    text: Optional[str] = None
-    id: Optional[str] = None
-    msg: Optional[Dict[str, Any]] = None
\ No newline at end of file
+class KimiStreamEvent:
+    """Kimi流内部事件，只在服务内部传递，使用__slots__且不做pydantic校验"""
+    __slots__ = ('event', 'text', 'id', 'msg')
+    
+    def __init__(
+        self,
+        event: str,
+        text: Optional[str] = None,
+        id: Optional[str] = None,
+        msg: Optional[Dict[str, Any]] = None
+    ):
+        self.event = event
+        self.text = text
+        self.id = id
+        self.msg = msg
+    
+    def __repr__(self) -> str:
+        return f"KimiStreamEvent(event={self.event!r}, text={self.text!r}, id={self.id!r})"
+    
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, KimiStreamEvent):
+            return NotImplemented
+        return (self.event, self.text, self.id, self.msg) == (other.event, other.text, other.id, other.msg)
@@ -0,0 +1,132 @@
+import re
+from typing import List, Optional, Union
+
+# 中日韩文字和全角符号大致每个字符一个token，其它文本按约4个字符一个token估算
+_WIDE_CHARS = re.compile('[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+CHARS_PER_TOKEN = 4
+
+def _tokens(wide: int, other: int) -> int:
+    return wide + -(-other // CHARS_PER_TOKEN)
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的token数"""
+    wide = len(_WIDE_CHARS.findall(text))
+    return _tokens(wide, len(text) - wide)
+
+class StopSequenceDetector:
+    """
+    增量停止序列检测
+    每个增量与上次保留的尾部拼接后查找所有停止序列，取起始位置最早的一个；窗口末尾
+    “可能是某个停止序列前缀”的部分（至多最长序列长度-1个字符）先保留到下一个增量再判断，
+    因此跨增量边界被切开的停止序列也能识别，且停止序列本身不会被输出
+    """
+    
+    def __init__(self, stop: List[str]):
+        self.stop = [s for s in dict.fromkeys(stop) if s]
+        self._max_hold = max((len(s) for s in self.stop), default=1) - 1
+        self._held = ''
+        self.stopped = False
+    
+    def _find(self, window: str) -> int:
+        index = -1
+        for sequence in self.stop:
+            found = window.find(sequence)
+            if found != -1 and (index == -1 or found < index):
+                index = found
+        return index
+    
+    def feed(self, text: str) -> str:
+        """输入增量，返回可以安全输出的文本；命中停止序列后stopped为True"""
+        if self.stopped:
+            return ''
+        window = self._held + text
+        index = self._find(window)
+        end = index if index != -1 else len(window)
+        # 比已命中位置更早开始、但还没有接收完整的停止序列，需要等待后续增量
+        for start in range(max(len(window) - self._max_hold, 0), end):
+            tail = window[start:]
+            if any(sequence.startswith(tail) for sequence in self.stop):
+                self._held = tail
+                return window[:start]
+        self._held = ''
+        if index != -1:
+            self.stopped = True
+        return window[:end]
+    
+    def flush(self) -> str:
+        """流正常结束时输出保留的尾部（其中可能已包含完整的停止序列）"""
+        window, self._held = self._held, ''
+        index = self._find(window)
+        if index != -1:
+            self.stopped = True
+            return window[:index]
+        return window
+
+class OutputLimiter:
+    """
+    输出限制：stop停止序列和max_tokens（按estimate_tokens累计估算）
+    任一限制触发后finish_reason分别为stop或length，调用方应结束响应并关闭上游流
+    """
+    
+    def __init__(self, max_tokens: Optional[int] = None, stop: Union[str, List[str], None] = None):
+        if isinstance(stop, str):
+            stop = [stop]
+        self.detector = StopSequenceDetector(stop) if stop else None
+        if self.detector is not None and not self.detector.stop:
+            self.detector = None
+        self.max_tokens = max_tokens
+        # 累计字符数而不是逐个增量估算后相加，避免细碎增量被重复向上取整
+        self._wide = 0
+        self._other = 0
+        self.finish_reason: Optional[str] = None
+    
+    @property
+    def tokens(self) -> int:
+        return _tokens(self._wide, self._other)
+    
+    @property
+    def enabled(self) -> bool:
+        return self.detector is not None or self.max_tokens is not None
+    
+    def _limit(self, text: str) -> str:
+        if self.max_tokens is None or not text:
+            return text
+        wide = len(_WIDE_CHARS.findall(text))
+        other = len(text) - wide
+        if _tokens(self._wide + wide, self._other + other) < self.max_tokens:
+            self._wide += wide
+            self._other += other
+            return text
+        # 达到上限：逐字符截断到恰好用完额度的位置
+        end = 0
+        for char in text:
+            if _WIDE_CHARS.match(char):
+                wide, other = self._wide + 1, self._other
+            else:
+                wide, other = self._wide, self._other + 1
+            if _tokens(wide, other) > self.max_tokens:
+                break
+            self._wide, self._other = wide, other
+            end += 1
+        self.finish_reason = 'length'
+        return text[:end]
+    
+    def feed(self, text: str) -> str:
+        """输入增量，返回应输出的文本"""
+        if self.finish_reason is not None:
+            return ''
+        if self.detector is not None:
+            text = self.detector.feed(text)
+        text = self._limit(text)
+        if self.finish_reason is None and self.detector is not None and self.detector.stopped:
+            self.finish_reason = 'stop'
+        return text
+    
+    def flush(self) -> str:
+        """上游正常结束时输出停止序列检测保留的尾部"""
+        if self.finish_reason is not None or self.detector is None:
+            return ''
+        text = self._limit(self.detector.flush())
+        if self.finish_reason is None and self.detector.stopped:
+            self.finish_reason = 'stop'
+        return text
@@ -0,0 +1,264 @@
+import sys
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import AsyncGenerator, Awaitable, Callable, Dict, Any, List, Optional, Tuple
+from models import ChatCompletionRequest, KimiStreamEvent
+from config import Config
+
+# 每条缓存除文本外的大致开销（OrderedDict槽位、元组、列表）
+_ENTRY_OVERHEAD = 300
+
+def cache_key(request: ChatCompletionRequest) -> str:
+    """模型、消息和采样参数的规范化哈希，与是否流式无关"""
+    stop = request.stop
+    if isinstance(stop, str):
+        stop = [stop]
+    canonical = json.dumps(
+        {
+            "model": request.model,
+            "messages": [[getattr(m.role, 'value', m.role), m.content] for m in request.messages],
+            "temperature": request.temperature,
+            "max_tokens": request.max_tokens,
+            "stop": stop or None
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(',', ':')
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+class _CacheEntry:
+    __slots__ = ('conv_id', 'parts', 'finish_reason', 'size', 'stored_at')
+    
+    def __init__(self, conv_id: str, parts: Tuple[str, ...], finish_reason: str, size: int):
+        self.conv_id = conv_id
+        self.parts = parts
+        self.finish_reason = finish_reason
+        self.size = size
+        self.stored_at = time.time()
+
+class InFlight:
+    """
+    一次进行中的上游生成，相同请求共享
+    后台任务读取上游事件并追加到事件列表，每个订阅者从头重放并等待新事件；
+    所有订阅者都退订（客户端断开、达到max_tokens/stop）时取消后台任务，上游流随之关闭。
+    上游占用的token和会话由release释放，与事件流是否开始读取无关
+    """
+    
+    def __init__(self, cache: "ResponseCache", key: str):
+        self._cache = cache
+        self.key = key
+        self.conv_id: Optional[str] = None
+        self.events: List[KimiStreamEvent] = []
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self._readers: set = set()
+        self._events: Optional[AsyncGenerator[KimiStreamEvent, None]] = None
+        self._release: Optional[Callable[[], Awaitable[None]]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._started = asyncio.Event()
+        self._changed = asyncio.Event()
+    
+    @property
+    def subscribers(self) -> int:
+        return len(self._readers)
+    
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+    
+    def _finish(self, error: Optional[BaseException] = None):
+        if self.done:
+            return
+        self.error = error
+        self.done = True
+        self._started.set()
+        self._notify()
+        self._cache._forget(self)
+    
+    def start(
+        self,
+        conv_id: str,
+        events: AsyncGenerator[KimiStreamEvent, None],
+        release: Callable[[], Awaitable[None]]
+    ):
+        """由发起请求的一方调用，开始在后台读取上游事件，上游结束或被停止时调用release（需幂等）"""
+        self.conv_id = conv_id
+        self._events = events
+        self._release = release
+        self._task = asyncio.create_task(self._produce(events))
+        self._started.set()
+    
+    def abort(self, error: BaseException):
+        """发起方在开始读取上游之前失败，等待中的订阅者收到同样的错误"""
+        if self._task is None:
+            self._finish(error)
+    
+    async def wait_started(self):
+        """等待上游开始，发起方在此之前失败时抛出其错误"""
+        await self._started.wait()
+        if self._task is None and self.error is not None:
+            raise self.error
+    
+    async def _produce(self, events: AsyncGenerator[KimiStreamEvent, None]):
+        error = None
+        try:
+            async for event in events:
+                self.events.append(event)
+                self._notify()
+        except asyncio.CancelledError:
+            error = ConnectionAbortedError("Upstream generation cancelled")
+            raise
+        except Exception as e:
+            error = e
+        finally:
+            await events.aclose()
+            await self._release()
+            self._finish(error)
+    
+    async def _stop(self):
+        """停止上游生成，后台任务未开始运行就被取消时其finally不会执行，在这里关闭事件流并释放"""
+        self._cache._forget(self)
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        await self._events.aclose()
+        await self._release()
+        self._finish(ConnectionAbortedError("Upstream generation cancelled"))
+    
+    def subscribe(self) -> AsyncGenerator[KimiStreamEvent, None]:
+        """订阅事件流，已产生的事件会先重放，结束后需调用unsubscribe"""
+        reader = self._read()
+        self._readers.add(reader)
+        return reader
+    
+    async def unsubscribe(self, reader: AsyncGenerator[KimiStreamEvent, None]):
+        """退订（订阅的事件流未开始读取时同样需要调用），没有订阅者时立即停止上游生成"""
+        if reader not in self._readers:
+            return
+        self._readers.discard(reader)
+        await reader.aclose()
+        if not self._readers and self._task is not None and not self.done:
+            await self._stop()
+    
+    async def _read(self) -> AsyncGenerator[KimiStreamEvent, None]:
+        index = 0
+        while True:
+            if index < len(self.events):
+                event = self.events[index]
+                index += 1
+                yield event
+                continue
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+class ResponseCache:
+    """
+    /v1/chat/completions的精确匹配响应缓存和进行中请求合并
+    缓存处理后的输出增量和finish_reason，命中时按原增量重放为流式或非流式响应；
+    按TTL过期，总大小超过上限时淘汰最久未使用的记录。相同的并发请求共享同一次上游生成
+    """
+    
+    def __init__(self):
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._flights: Dict[str, InFlight] = {}
+        self._bytes = 0
+        
+        # 统计指标
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evicted = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return Config.RESPONSE_CACHE_ENABLED
+    
+    def _pop(self, key: str) -> Optional[_CacheEntry]:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+        return entry
+    
+    def get(self, key: str) -> Optional[_CacheEntry]:
+        """查找未过期的缓存"""
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry.stored_at > Config.RESPONSE_CACHE_TTL:
+            self._pop(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+    
+    def put(self, key: str, conv_id: str, parts: List[str], finish_reason: str):
+        """写入一次完整的输出，超过总大小上限时按LRU淘汰"""
+        if key in self._entries:
+            return
+        size = sum(sys.getsizeof(part) for part in parts) + _ENTRY_OVERHEAD
+        if size > Config.RESPONSE_CACHE_MAX_BYTES:
+            return
+        self._entries[key] = _CacheEntry(conv_id, tuple(parts), finish_reason, size)
+        self._bytes += size
+        
+        now = time.time()
+        while self._entries:
+            oldest_key, oldest = next(iter(self._entries.items()))
+            expired = now - oldest.stored_at > Config.RESPONSE_CACHE_TTL
+            if not expired and self._bytes <= Config.RESPONSE_CACHE_MAX_BYTES:
+                break
+            self._pop(oldest_key)
+            if not expired:
+                self.evicted += 1
+    
+    @staticmethod
+    async def replay(entry: _CacheEntry) -> AsyncGenerator[KimiStreamEvent, None]:
+        """把缓存的输出还原为事件流"""
+        for part in entry.parts:
+            yield KimiStreamEvent(event="cmpl", text=part)
+        yield KimiStreamEvent(event="length" if entry.finish_reason == "length" else "all_done")
+    
+    def join(self, key: str) -> Optional[InFlight]:
+        """加入相同请求进行中的上游生成"""
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+        return flight
+    
+    def lead(self, key: str) -> InFlight:
+        """登记一次新的上游生成，后续相同请求在其开始后共享事件流"""
+        flight = InFlight(self, key)
+        self._flights[key] = flight
+        return flight
+    
+    def _forget(self, flight: InFlight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+    
+    def clear(self):
+        """清空缓存"""
+        self._entries.clear()
+        self._bytes = 0
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取响应缓存统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            'enabled': Config.RESPONSE_CACHE_ENABLED,
+            'entries': len(self._entries),
+            'size_bytes': self._bytes,
+            'max_bytes': Config.RESPONSE_CACHE_MAX_BYTES,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._flights),
+            'evicted': self.evicted
+        }
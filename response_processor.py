@@ -1,24 +1,78 @@
 import json
 import time
-from typing import AsyncGenerator, Dict, Any
+from json.encoder import encode_basestring
+from typing import AsyncGenerator, Dict, Any, List, Optional, Tuple, Union
 from models import (
     ChatCompletionResponse, 
-    ChatCompletionStreamResponse, 
     Choice, 
-    StreamChoice, 
     Message, 
     Usage,
     KimiStreamEvent
 )
+from output_limiter import OutputLimiter
+
+SSE_DONE = b"data: [DONE]\n\n"
+
+class StreamChunkSerializer:
+    """
+    SSE chunk序列化器
+    每个流只序列化一次固定的前缀/后缀（id、created、model），
+    内容chunk只需对delta文本做JSON转义，输出与ChatCompletionStreamResponse.model_dump_json()一致
+    """
+    
+    def __init__(self, chunk_id: str, created: int, model: str):
+        head = json.dumps(
+            {"id": chunk_id, "object": "chat.completion.chunk", "created": created, "model": model},
+            ensure_ascii=False,
+            separators=(',', ':')
+        )
+        self._prefix = b'data: ' + head[:-1].encode('utf-8') + b',"choices":[{"index":0,"delta":'
+        self._content_prefix = self._prefix + b'{"content":'
+        self._content_suffix = b'},"finish_reason":null}]}\n\n'
+    
+    def content(self, text: str) -> bytes:
+        """序列化只包含content的delta chunk"""
+        return b''.join((
+            self._content_prefix,
+            encode_basestring(text).encode('utf-8', errors='replace'),
+            self._content_suffix
+        ))
+    
+    def chunk(self, delta: Dict[str, Any], finish_reason: Optional[str] = None) -> bytes:
+        """序列化任意delta chunk（开始/结束等低频chunk）"""
+        return b''.join((
+            self._prefix,
+            json.dumps(delta, ensure_ascii=False, separators=(',', ':')).encode('utf-8', errors='replace'),
+            b',"finish_reason":',
+            json.dumps(finish_reason).encode('utf-8'),
+            b'}]}\n\n'
+        ))
 
 class ResponseProcessor:
-    """响应处理器，基于原项目的流处理逻辑"""
+    """
+    响应处理器，基于原项目的流处理逻辑
+    设置了max_tokens或stop时，达到限制即结束响应并停止读取输入流，调用方负责关闭上游流
+    设置record时，响应正常结束（非错误）后output为输出的增量列表和finish_reason，用于缓存重放
+    """
     
-    def __init__(self, model: str, conv_id: str):
+    def __init__(self, model: str, conv_id: str, max_tokens: Optional[int] = None,
+                 stop: Union[str, List[str], None] = None, record: bool = False):
         self.model = model
         self.conv_id = conv_id
         self.created = int(time.time())
-        
+        self.max_tokens = max_tokens
+        self.stop = stop
+        self.record = record
+        self.output: Optional[Tuple[List[str], str]] = None
+    
+    def _limiter(self) -> Optional[OutputLimiter]:
+        limiter = OutputLimiter(self.max_tokens, self.stop)
+        return limiter if limiter.enabled else None
+    
+    def _record(self, parts: Optional[List[str]], finish_reason: str):
+        if self.record and parts is not None:
+            self.output = (parts, finish_reason)
+    
     async def process_stream_to_completion(
         self, 
         stream: AsyncGenerator[KimiStreamEvent, None]
@@ -27,20 +81,44 @@ class ResponseProcessor:
         content = ""
         segment_id = ""
         finish_reason = "stop"
+        limiter = self._limiter()
         
         async for event in stream:
             if event.event == 'cmpl' and event.text:
-                content += event.text
-            elif event.event == 'req' and event.id:
+                if limiter is None:
+                    content += event.text
+                    continue
+                content += limiter.feed(event.text)
+                if limiter.finish_reason:
+                    finish_reason = limiter.finish_reason
+                    self._record([content], finish_reason)
+                    break
+                continue
+            
+            if limiter is not None and event.event in ('all_done', 'error', 'length'):
+                # 上游结束前先输出停止序列检测保留的尾部
+                content += limiter.flush()
+                if limiter.finish_reason:
+                    finish_reason = limiter.finish_reason
+                    self._record([content], finish_reason)
+                    break
+            
+            if event.event == 'req' and event.id:
                 segment_id = event.id
             elif event.event == 'length':
                 finish_reason = "length"
             elif event.event == 'all_done':
+                self._record([content], finish_reason)
                 break
             elif event.event == 'error':
                 content += '\n[内容由于不合规被停止生成，我们换个话题吧]'
                 finish_reason = "stop"
                 break
+        else:
+            if limiter is not None:
+                # 上游未发送结束事件直接结束
+                content += limiter.flush()
+                finish_reason = limiter.finish_reason or finish_reason
         
         # 计算token使用量（简化版本）
         prompt_tokens = 1  # 简化计算
@@ -66,85 +144,66 @@ class ResponseProcessor:
     async def process_stream_to_chunks(
         self, 
         stream: AsyncGenerator[KimiStreamEvent, None]
-    ) -> AsyncGenerator[str, None]:
+    ) -> AsyncGenerator[bytes, None]:
         """处理流响应为SSE格式的chunk"""
+        serializer = StreamChunkSerializer(f"chatcmpl-{self.conv_id}", self.created, self.model)
+        
         # 发送开始chunk
-        start_chunk = ChatCompletionStreamResponse(
-            id=f"chatcmpl-{self.conv_id}",
-            object="chat.completion.chunk",
-            created=self.created,
-            model=self.model,
-            choices=[StreamChoice(
-                index=0,
-                delta={"role": "assistant", "content": ""},
-                finish_reason=None
-            )]
-        )
-        yield f"data: {start_chunk.model_dump_json()}\n\n"
+        yield serializer.chunk({"role": "assistant", "content": ""})
+        
+        limiter = self._limiter()
+        parts = [] if self.record else None
         
         # 处理内容chunk
         async for event in stream:
             if event.event == 'cmpl' and event.text:
-                content_chunk = ChatCompletionStreamResponse(
-                    id=f"chatcmpl-{self.conv_id}",
-                    object="chat.completion.chunk",
-                    created=self.created,
-                    model=self.model,
-                    choices=[StreamChoice(
-                        index=0,
-                        delta={"content": event.text},
-                        finish_reason=None
-                    )]
-                )
-                yield f"data: {content_chunk.model_dump_json()}\n\n"
-                
-            elif event.event == 'all_done':
+                if limiter is None:
+                    if parts is not None:
+                        parts.append(event.text)
+                    yield serializer.content(event.text)
+                    continue
+                text = limiter.feed(event.text)
+                if text:
+                    if parts is not None:
+                        parts.append(text)
+                    yield serializer.content(text)
+                if limiter.finish_reason:
+                    # 达到max_tokens或命中停止序列，不再等待上游
+                    self._record(parts, limiter.finish_reason)
+                    yield serializer.chunk({}, limiter.finish_reason)
+                    yield SSE_DONE
+                    break
+                continue
+            
+            if limiter is not None and event.event in ('all_done', 'error', 'length'):
+                # 上游结束前先输出停止序列检测保留的尾部
+                text = limiter.flush()
+                if text:
+                    if parts is not None:
+                        parts.append(text)
+                    yield serializer.content(text)
+                if limiter.finish_reason:
+                    self._record(parts, limiter.finish_reason)
+                    yield serializer.chunk({}, limiter.finish_reason)
+                    yield SSE_DONE
+                    break
+            
+            if event.event == 'all_done':
+                self._record(parts, "stop")
                 # 发送结束chunk
-                end_chunk = ChatCompletionStreamResponse(
-                    id=f"chatcmpl-{self.conv_id}",
-                    object="chat.completion.chunk",
-                    created=self.created,
-                    model=self.model,
-                    choices=[StreamChoice(
-                        index=0,
-                        delta={},
-                        finish_reason="stop"
-                    )]
-                )
-                yield f"data: {end_chunk.model_dump_json()}\n\n"
-                yield "data: [DONE]\n\n"
+                yield serializer.chunk({}, "stop")
+                yield SSE_DONE
                 break
-                
+            
             elif event.event == 'error':
                 # 错误情况下的结束chunk
-                error_chunk = ChatCompletionStreamResponse(
-                    id=f"chatcmpl-{self.conv_id}",
-                    object="chat.completion.chunk", 
-                    created=self.created,
-                    model=self.model,
-                    choices=[StreamChoice(
-                        index=0,
-                        delta={"content": "\n[内容由于不合规被停止生成，我们换个话题吧]"},
-                        finish_reason="stop"
-                    )]
-                )
-                yield f"data: {error_chunk.model_dump_json()}\n\n"
-                yield "data: [DONE]\n\n"
+                yield serializer.chunk({"content": "\n[内容由于不合规被停止生成，我们换个话题吧]"}, "stop")
+                yield SSE_DONE
                 break
-                
+            
             elif event.event == 'length':
+                self._record(parts, "length")
                 # 长度超限的结束chunk
-                length_chunk = ChatCompletionStreamResponse(
-                    id=f"chatcmpl-{self.conv_id}",
-                    object="chat.completion.chunk",
-                    created=self.created,
-                    model=self.model,
-                    choices=[StreamChoice(
-                        index=0,
-                        delta={},
-                        finish_reason="length"
-                    )]
-                )
-                yield f"data: {length_chunk.model_dump_json()}\n\n"
-                yield "data: [DONE]\n\n"
-                break
\ No newline at end of file
+                yield serializer.chunk({}, "length")
+                yield SSE_DONE
+                break
@@ -0,0 +1,167 @@
+import sys
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+from config import Config
+
+# 每条记录除字符串本身外的大致开销（OrderedDict槽位、元组、浮点数）
+_ENTRY_OVERHEAD = 200
+
+def _role(message) -> str:
+    return getattr(message.role, 'value', message.role)
+
+def fingerprint(messages: list, digest: bytes = b'') -> bytes:
+    """消息前缀的滚动哈希，digest为之前消息的哈希，可在其基础上继续追加"""
+    for message in messages:
+        hasher = hashlib.blake2b(digest, digest_size=16)
+        hasher.update(_role(message).encode('utf-8'))
+        hasher.update(b'\0')
+        hasher.update(message.content.encode('utf-8'))
+        digest = hasher.digest()
+    return digest
+
+def render_history(messages: list) -> str:
+    """未命中会话时把完整历史渲染为一条消息，只在会话的第一轮发送一次"""
+    lines = []
+    for message in messages[:-1]:
+        lines.append(f"{_role(message)}: {message.content}")
+    history = "\n\n".join(lines)
+    return f"以下是之前的对话记录：\n\n{history}\n\n请基于以上对话回复：\n\n{messages[-1].content}"
+
+class SessionAffinity:
+    """
+    多轮对话的会话亲和
+    按消息前缀指纹记录仍在使用的Kimi会话（refresh token + conv_id），后续轮次命中时在同一会话上只发送新消息；
+    记录被取出后即从表中移除，同一前缀的并发请求不会写入同一个会话。按LRU/TTL淘汰，
+    条数和估算内存不超过上限，被淘汰的会话交给删除队列
+    """
+    
+    def __init__(self, kimi_client, deletion_queue=None):
+        self.kimi_client = kimi_client
+        self.deletion_queue = deletion_queue
+        self._entries: "OrderedDict[bytes, Tuple[str, str, float]]" = OrderedDict()
+        self._bytes = 0
+        self._tasks: set = set()
+        self._reaper_task: Optional[asyncio.Task] = None
+        
+        # 统计指标
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return Config.SESSION_AFFINITY_ENABLED
+    
+    async def start(self):
+        """启动过期会话回收任务"""
+        if self._reaper_task is None:
+            self._reaper_task = asyncio.create_task(self._reap_loop())
+    
+    async def close(self):
+        """停止回收任务，剩余会话交给删除队列"""
+        if self._reaper_task is not None:
+            self._reaper_task.cancel()
+            self._reaper_task = None
+        for task in list(self._tasks):
+            task.cancel()
+        while self._entries:
+            _, (refresh_token, conv_id, _) = self._entries.popitem(last=False)
+            await self._delete(refresh_token, conv_id)
+        self._bytes = 0
+    
+    @staticmethod
+    def _size(key: bytes, refresh_token: str, conv_id: str) -> int:
+        return sys.getsizeof(key) + sys.getsizeof(refresh_token) + sys.getsizeof(conv_id) + _ENTRY_OVERHEAD
+    
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+    
+    def _pop(self, key: bytes) -> Optional[Tuple[str, str, float]]:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= self._size(key, entry[0], entry[1])
+        return entry
+    
+    def _evict(self, key: bytes):
+        refresh_token, conv_id, _ = self._pop(key)
+        self.evicted += 1
+        self._spawn(self._delete(refresh_token, conv_id))
+    
+    def _expire(self, now: float):
+        """记录只在写入时加入表尾，表头即最早写入的记录"""
+        while self._entries:
+            key, (_, _, stored_at) = next(iter(self._entries.items()))
+            if now - stored_at <= Config.SESSION_AFFINITY_TTL:
+                break
+            self._evict(key)
+    
+    def take(self, key: bytes) -> Optional[Tuple[str, str]]:
+        """取出前缀对应的会话 (refresh_token, conv_id)，未命中或已过期时返回None"""
+        self._expire(time.time())
+        entry = self._pop(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0], entry[1]
+    
+    def put(self, key: bytes, refresh_token: str, conv_id: str):
+        """记录一轮对话结束后的会话，超出条数或内存上限时淘汰最久未使用的记录"""
+        old = self._pop(key)
+        if old is not None and old[1] != conv_id:
+            self._spawn(self._delete(old[0], old[1]))
+        self._entries[key] = (refresh_token, conv_id, time.time())
+        self._bytes += self._size(key, refresh_token, conv_id)
+        
+        self._expire(time.time())
+        while self._entries and (
+            len(self._entries) > Config.SESSION_AFFINITY_MAX_ENTRIES
+            or self._bytes > Config.SESSION_AFFINITY_MAX_BYTES
+        ):
+            self._evict(next(iter(self._entries)))
+    
+    def drop(self, refresh_token: str, conv_id: str):
+        """放弃一个已取出的会话并删除"""
+        self._spawn(self._delete(refresh_token, conv_id))
+    
+    def discard(self, refresh_token: str):
+        """移除某个refresh token的全部记录（token被删除时调用）"""
+        for key in [key for key, entry in self._entries.items() if entry[0] == refresh_token]:
+            self._evict(key)
+    
+    async def _delete(self, refresh_token: str, conv_id: str):
+        """删除会话，优先交给删除队列处理"""
+        if self.deletion_queue is not None and self.deletion_queue.enqueue(refresh_token, conv_id):
+            return
+        try:
+            token_info = await self.kimi_client.refresh_access_token(refresh_token)
+            await self.kimi_client.delete_conversation(token_info['access_token'], conv_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            pass
+    
+    async def _reap_loop(self):
+        """定期回收过期会话，没有新请求时也不会长期占用会话"""
+        while True:
+            await asyncio.sleep(Config.CONV_POOL_REAP_INTERVAL)
+            self._expire(time.time())
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取会话亲和统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            'enabled': Config.SESSION_AFFINITY_ENABLED,
+            'entries': len(self._entries),
+            'memory_bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0,
+            'evicted': self.evicted
+        }
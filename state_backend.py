@@ -0,0 +1,278 @@
+import time
+import asyncio
+import sqlite3
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlparse, unquote
+
+class MemoryStateBackend:
+    """进程内状态后端（默认，单worker）"""
+    
+    shared = False
+    
+    def __init__(self):
+        self._values: Dict[str, tuple] = {}  # key -> (value, expires_at)
+        self._hashes: Dict[str, Dict[str, str]] = {}
+    
+    async def close(self):
+        pass
+    
+    async def get(self, key: str) -> Optional[str]:
+        item = self._values.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at and expires_at <= time.time():
+            del self._values[key]
+            return None
+        return value
+    
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self._values[key] = (value, time.time() + ttl if ttl else None)
+    
+    async def delete(self, key: str):
+        self._values.pop(key, None)
+    
+    async def incr(self, key: str, amount: int = 1) -> int:
+        value = int(await self.get(key) or 0) + amount
+        self._values[key] = (str(value), None)
+        return value
+    
+    async def hset(self, name: str, mapping: Dict[str, str]):
+        self._hashes.setdefault(name, {}).update(mapping)
+    
+    async def hdel(self, name: str, *fields: str):
+        values = self._hashes.get(name, {})
+        for field in fields:
+            values.pop(field, None)
+    
+    async def hgetall(self, name: str) -> Dict[str, str]:
+        return dict(self._hashes.get(name, {}))
+
+class SQLiteStateBackend:
+    """
+    共享SQLite状态后端（WAL模式），用于同一主机上的多个worker进程
+    每个操作都是一次很短的本地事务，在线程池中执行，等待写锁或磁盘时不阻塞事件循环
+    """
+    
+    shared = True
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS kv (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS hashes (
+                name TEXT NOT NULL,
+                field TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (name, field)
+            );
+        """)
+    
+    def _close(self):
+        with self._lock:
+            self._conn.close()
+    
+    async def close(self):
+        await asyncio.to_thread(self._close)
+    
+    def _execute_sync(self, sql: str, params: tuple = ()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+    
+    async def _execute(self, sql: str, params: tuple = ()):
+        return await asyncio.to_thread(self._execute_sync, sql, params)
+    
+    async def get(self, key: str) -> Optional[str]:
+        rows = await self._execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        )
+        return rows[0][0] if rows else None
+    
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        await self._execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, time.time() + ttl if ttl else None)
+        )
+    
+    async def delete(self, key: str):
+        await self._execute("DELETE FROM kv WHERE key = ?", (key,))
+    
+    async def incr(self, key: str, amount: int = 1) -> int:
+        rows = await self._execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, NULL) "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + ? RETURNING value",
+            (key, str(amount), amount)
+        )
+        return int(rows[0][0])
+    
+    def _hset(self, name: str, mapping: Dict[str, str]):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO hashes (name, field, value) VALUES (?, ?, ?)",
+                    [(name, field, value) for field, value in mapping.items()]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+    
+    async def hset(self, name: str, mapping: Dict[str, str]):
+        await asyncio.to_thread(self._hset, name, mapping)
+    
+    def _hdel(self, name: str, fields: tuple):
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM hashes WHERE name = ? AND field = ?",
+                [(name, field) for field in fields]
+            )
+    
+    async def hdel(self, name: str, *fields: str):
+        await asyncio.to_thread(self._hdel, name, fields)
+    
+    async def hgetall(self, name: str) -> Dict[str, str]:
+        rows = await self._execute("SELECT field, value FROM hashes WHERE name = ?", (name,))
+        return dict(rows)
+
+class RedisError(Exception):
+    """Redis返回的错误"""
+
+class RedisStateBackend:
+    """
+    Redis协议（RESP）状态后端，用于多主机部署
+    内置精简的异步RESP客户端，无需额外依赖，兼容任何实现了GET/SET/DEL/INCRBY/HSET/HDEL/HGETALL的服务
+    """
+    
+    shared = True
+    
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+    
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+    
+    @staticmethod
+    def _encode(args: tuple) -> bytes:
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+    
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        prefix, body = line[:1], line[1:-2]
+        if prefix == b'+':
+            return body.decode('utf-8')
+        if prefix == b'-':
+            raise RedisError(body.decode('utf-8'))
+        if prefix == b':':
+            return int(body)
+        if prefix == b'$':
+            length = int(body)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2].decode('utf-8')
+        if prefix == b'*':
+            length = int(body)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise RedisError(f"Unknown RESP reply: {line!r}")
+    
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._send('AUTH', self.password)
+        if self.db:
+            await self._send('SELECT', self.db)
+    
+    async def _send(self, *args):
+        self._writer.write(self._encode(args))
+        await self._writer.drain()
+        return await self._read_reply()
+    
+    async def _command(self, *args):
+        """发送命令，连接断开时重连一次，其它异常关闭连接后抛出"""
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._writer is None:
+                        await self._connect()
+                    return await self._send(*args)
+                except (ConnectionError, asyncio.IncompleteReadError, OSError):
+                    await self.close()
+                    if attempt:
+                        raise
+                except BaseException:
+                    # 被取消或回复解析失败时连接上可能残留未读的回复，关闭连接，下次调用时重连
+                    await self.close()
+                    raise
+    
+    async def get(self, key: str) -> Optional[str]:
+        return await self._command('GET', key)
+    
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        if ttl:
+            await self._command('SET', key, value, 'PX', max(int(ttl * 1000), 1))
+        else:
+            await self._command('SET', key, value)
+    
+    async def delete(self, key: str):
+        await self._command('DEL', key)
+    
+    async def incr(self, key: str, amount: int = 1) -> int:
+        return await self._command('INCRBY', key, amount)
+    
+    async def hset(self, name: str, mapping: Dict[str, str]):
+        if not mapping:
+            return
+        args = []
+        for field, value in mapping.items():
+            args.extend((field, value))
+        await self._command('HSET', name, *args)
+    
+    async def hdel(self, name: str, *fields: str):
+        if fields:
+            await self._command('HDEL', name, *fields)
+    
+    async def hgetall(self, name: str) -> Dict[str, str]:
+        reply = await self._command('HGETALL', name) or []
+        return dict(zip(reply[::2], reply[1::2]))
+
+def create_state_backend(url: str):
+    """
+    根据配置创建状态后端
+    memory（默认）| sqlite:///path/to/state.db | redis://[:password@]host:port/db
+    """
+    if not url or url == 'memory':
+        return MemoryStateBackend()
+    if url.startswith('sqlite:///'):
+        return SQLiteStateBackend(url[len('sqlite:///'):])
+    if url.startswith('redis://'):
+        return RedisStateBackend(url)
+    raise ValueError(f"Unsupported state backend: {url}")
@@ -62,7 +62,12 @@ async function addTokens() {
 
         const result = await response.json();
         
-        if (response.ok) {
+        if (response.status === 202) {
+            // 大批量导入在后台执行，轮询进度
+            tokenInput.value = '';
+            showAlert(`正在后台导入 ${result.job.total} 个 Token`, 'info');
+            pollImportJob(result.job_id);
+        } else if (response.ok) {
             showAlert(`成功添加 ${result.tokens.length} 个 Token`, 'success');
             tokenInput.value = '';
             loadTokens();
@@ -74,6 +79,46 @@ async function addTokens() {
     }
 }
 
+async function pollImportJob(jobId) {
+    const progress = document.getElementById('import-progress');
+    const progressBar = document.getElementById('import-progress-bar');
+    const progressText = document.getElementById('import-progress-text');
+    progress.style.display = 'block';
+    
+    while (true) {
+        let job;
+        try {
+            const response = await fetch(`/api/tokens/import/${jobId}`);
+            job = await response.json();
+            if (!response.ok) {
+                showAlert('获取导入进度失败: ' + job.detail, 'danger');
+                break;
+            }
+        } catch (error) {
+            showAlert('网络错误: ' + error.message, 'danger');
+            break;
+        }
+        
+        const percent = Math.round(job.progress * 100);
+        progressBar.style.width = `${percent}%`;
+        progressBar.textContent = `${percent}%`;
+        progressText.textContent = `已处理 ${job.processed}/${job.total}，添加 ${job.added}，跳过 ${job.skipped}，无效 ${job.invalid}`;
+        
+        if (job.status === 'done') {
+            showAlert(`成功添加 ${job.added} 个 Token`, 'success');
+            break;
+        }
+        if (job.status === 'failed' || job.status === 'cancelled') {
+            showAlert('导入失败: ' + (job.error || job.status), 'danger');
+            break;
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+    
+    progress.style.display = 'none';
+    loadTokens();
+}
+
 async function loadTokens() {
     try {
         const response = await fetch(`/api/tokens?page=${currentPage}&per_page=${perPage}`);
@@ -0,0 +1,78 @@
+import asyncio
+from typing import AsyncGenerator
+from models import KimiStreamEvent
+
+async def coalesce_events(
+    stream: AsyncGenerator[KimiStreamEvent, None],
+    max_chars: int,
+    max_delay: float
+) -> AsyncGenerator[KimiStreamEvent, None]:
+    """
+    合并相邻的cmpl增量
+    缓冲文本达到max_chars或距离第一个未发送增量超过max_delay（秒）时输出，
+    其它事件会先输出已缓冲的文本再原样透传；max_delay<=0时不做合并
+    """
+    if max_delay <= 0:
+        try:
+            async for event in stream:
+                yield event
+        finally:
+            await stream.aclose()
+        return
+    
+    loop = asyncio.get_running_loop()
+    iterator = stream.__aiter__()
+    pending = None
+    parts = []
+    size = 0
+    deadline = 0.0
+    
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            
+            timeout = max(deadline - loop.time(), 0) if parts else None
+            done, _ = await asyncio.wait((pending,), timeout=timeout)
+            if not done:
+                # 超过最大延迟，先发送已缓冲的内容，上游读取继续进行
+                yield KimiStreamEvent(event="cmpl", text=''.join(parts))
+                parts = []
+                size = 0
+                continue
+            
+            task, pending = pending, None
+            try:
+                event = task.result()
+            except StopAsyncIteration:
+                break
+            
+            if event.event == 'cmpl' and event.text:
+                if not parts:
+                    deadline = loop.time() + max_delay
+                parts.append(event.text)
+                size += len(event.text)
+                if size >= max_chars:
+                    yield KimiStreamEvent(event="cmpl", text=''.join(parts))
+                    parts = []
+                    size = 0
+                continue
+            
+            if parts:
+                yield KimiStreamEvent(event="cmpl", text=''.join(parts))
+                parts = []
+                size = 0
+            yield event
+        
+        if parts:
+            yield KimiStreamEvent(event="cmpl", text=''.join(parts))
+    finally:
+        # 下游提前结束时取消正在进行的上游读取并关闭上游流
+        if pending is not None:
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, Exception):
+                pass
+        if hasattr(iterator, 'aclose'):
+            await iterator.aclose()
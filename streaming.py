@@ -0,0 +1,51 @@
+import asyncio
+from typing import Awaitable, Callable, Optional
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+from metrics import CLIENT_DISCONNECTS
+
+class DisconnectAwareStreamingResponse(StreamingResponse):
+    """
+    客户端断开时立即取消响应生成器的StreamingResponse
+    写出与ASGI receive通道上的http.disconnect监听并行，断开时取消写出任务并关闭生成器，
+    生成器的finally随即执行（关闭上游流、释放token、删除会话），不依赖下一次写入失败，
+    也不依赖Starlette版本是否自带断开监听；生成器未开始迭代就被关闭时finally不会执行，
+    on_close在响应结束时总会被调用
+    """
+    
+    disconnected = False
+    
+    def __init__(self, content, *args, on_close: Optional[Callable[[], Awaitable[None]]] = None, **kwargs):
+        super().__init__(content, *args, **kwargs)
+        self.on_close = on_close
+    
+    async def _wait_disconnect(self, receive: Receive):
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        stream_task = asyncio.ensure_future(self.stream_response(send))
+        disconnect_task = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            await asyncio.wait((stream_task, disconnect_task), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not stream_task.done():
+                if disconnect_task.done():
+                    self.disconnected = True
+                    CLIENT_DISCONNECTS.inc()
+                stream_task.cancel()
+            disconnect_task.cancel()
+            await asyncio.gather(stream_task, disconnect_task, return_exceptions=True)
+            # 在send处被取消时生成器停在yield上，需要显式关闭才会执行清理
+            aclose = getattr(self.body_iterator, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+            if self.on_close is not None:
+                await self.on_close()
+        
+        if not self.disconnected and not stream_task.cancelled() and stream_task.exception() is not None:
+            raise stream_task.exception()
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,84 @@
+import gzip
+import json
+import random
+
+import pytest
+
+from connect_codec import (
+    ConnectEnvelopeDecoder,
+    FLAG_COMPRESSED,
+    FLAG_END_STREAM,
+    encode_envelope,
+)
+
+def _frames(seed: int):
+    """生成包含普通、压缩、空payload和end-stream标志的帧序列"""
+    rng = random.Random(seed)
+    frames = []
+    for index in range(6):
+        payload = json.dumps({"index": index, "text": "片段" * rng.randint(0, 5) + '"\\\n'}).encode('utf-8')
+        flags = rng.choice((0, FLAG_COMPRESSED))
+        frames.append((flags, payload))
+    frames.append((0, b''))
+    frames.append((FLAG_END_STREAM, b'{}'))
+    frames.append((FLAG_END_STREAM | FLAG_COMPRESSED, b'{"error":null}'))
+    return frames
+
+def _encode(frames) -> bytes:
+    data = b''
+    for flags, payload in frames:
+        body = gzip.compress(payload) if flags & FLAG_COMPRESSED else payload
+        data += encode_envelope(body, flags)
+    return data
+
+def _decode_in_chunks(data: bytes, cuts):
+    decoder = ConnectEnvelopeDecoder()
+    decoded = []
+    start = 0
+    for cut in list(cuts) + [len(data)]:
+        decoded.extend(decoder.feed(data[start:cut]))
+        start = cut
+    return decoded, decoder
+
+@pytest.mark.parametrize("seed", range(3))
+def test_single_split_at_every_byte_boundary(seed):
+    frames = _frames(seed)
+    data = _encode(frames)
+    for cut in range(len(data) + 1):
+        decoded, decoder = _decode_in_chunks(data, [cut])
+        assert decoded == frames, f"split at byte {cut}"
+        assert decoder.skipped_bytes == 0
+
+def test_byte_by_byte_feed():
+    frames = _frames(7)
+    data = _encode(frames)
+    decoded, _ = _decode_in_chunks(data, range(1, len(data)))
+    assert decoded == frames
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_multi_splits(seed):
+    frames = _frames(seed)
+    data = _encode(frames)
+    rng = random.Random(seed)
+    cuts = sorted(rng.sample(range(1, len(data)), rng.randint(1, 12)))
+    decoded, _ = _decode_in_chunks(data, cuts)
+    assert decoded == frames
+
+def test_large_payload_has_no_length_truncation():
+    payload = b'{"text":"' + b'x' * 100_000 + b'"}'
+    decoded, _ = _decode_in_chunks(encode_envelope(payload), [3, 255, 256, 70_000])
+    assert decoded == [(0, payload)]
+
+@pytest.mark.parametrize("corrupt", [
+    lambda body: body[:-4],             # 被截断的gzip（EOFError）
+    lambda body: body[:10] + b'\xff' * (len(body) - 10),  # 损坏的deflate数据（zlib.error）
+    lambda body: b'not gzip at all',    # 非gzip数据（OSError）
+])
+def test_corrupt_compressed_frame_is_dropped(corrupt):
+    good = encode_envelope(b'{"ok":1}')
+    bad = encode_envelope(corrupt(gzip.compress(b'{"bad":true}' * 20)), FLAG_COMPRESSED)
+    decoder = ConnectEnvelopeDecoder()
+    assert decoder.feed(bad + good) == [(0, b'{"ok":1}')]
+    assert decoder.skipped_bytes == len(bad)
+    # 解码器不会卡在损坏的帧上
+    assert decoder.feed(good) == [(0, b'{"ok":1}')]
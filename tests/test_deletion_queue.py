@@ -0,0 +1,37 @@
+import json
+import os
+
+from deletion_queue import ConversationDeletionQueue
+
+def _queue(path) -> ConversationDeletionQueue:
+    return ConversationDeletionQueue(None, str(path))
+
+def test_save_writes_per_process_file(tmp_path):
+    queue = _queue(tmp_path / 'pending_deletions.json')
+    queue._save({'conv-1': 'token'})
+    worker_file = tmp_path / f'pending_deletions.{os.getpid()}.json'
+    assert json.loads(worker_file.read_text()) == {'conv-1': 'token'}
+    assert sorted(os.listdir(tmp_path)) == [worker_file.name]
+    
+    queue._save({})
+    assert os.listdir(tmp_path) == []
+
+def test_load_claims_legacy_and_other_worker_files(tmp_path):
+    (tmp_path / 'pending_deletions.json').write_text(json.dumps({'conv-1': 'a'}))
+    (tmp_path / 'pending_deletions.11.json').write_text(json.dumps({'conv-2': 'b'}))
+    (tmp_path / 'pending_deletions.22.json').write_text(json.dumps({'conv-3': 'c'}))
+    (tmp_path / 'pending_deletions.json.tmp').write_text('{}')
+    
+    queue = _queue(tmp_path / 'pending_deletions.json')
+    assert queue._load() == {'conv-1': 'a', 'conv-2': 'b', 'conv-3': 'c'}
+    # 接管的文件合并写入本进程的文件后删除
+    worker_file = tmp_path / f'pending_deletions.{os.getpid()}.json'
+    assert sorted(os.listdir(tmp_path)) == sorted([worker_file.name, 'pending_deletions.json.tmp'])
+    assert json.loads(worker_file.read_text()) == {'conv-1': 'a', 'conv-2': 'b', 'conv-3': 'c'}
+
+def test_load_ignores_unrelated_files(tmp_path):
+    (tmp_path / 'pending_deletions.json').write_text(json.dumps({'conv-1': 'a'}))
+    (tmp_path / 'pending_deletions.backup.json').write_text(json.dumps({'conv-2': 'b'}))
+    assert _queue(tmp_path / 'other.json')._load() == {}
+    assert _queue(tmp_path / 'pending_deletions.json')._load() == {'conv-1': 'a'}
+    assert (tmp_path / 'pending_deletions.backup.json').exists()
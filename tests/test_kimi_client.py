@@ -0,0 +1,47 @@
+import asyncio
+import time
+
+import httpx
+
+from kimi_client import KimiClient
+from state_backend import SQLiteStateBackend
+
+def _client(backend, refreshes: list) -> KimiClient:
+    """使用共享后端的KimiClient，每次刷新返回新的access token"""
+    def handler(request):
+        refreshes.append(request.url.path)
+        return httpx.Response(200, json={'access_token': f'access-{len(refreshes)}', 'expires_in': 3600})
+    
+    client = KimiClient()
+    client.state_backend = backend
+    client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+def test_renew_adopts_token_renewed_by_another_worker(tmp_path):
+    async def main():
+        backend = SQLiteStateBackend(str(tmp_path / 'state.db'))
+        refreshes = []
+        worker_a, worker_b = _client(backend, refreshes), _client(backend, refreshes)
+        try:
+            await worker_a.refresh_access_token('refresh')
+            info = await worker_b.refresh_access_token('refresh')
+            assert info['access_token'] == 'access-1' and len(refreshes) == 1
+            
+            # worker_a先到续期时间并刷新，worker_b续期时直接采用共享的新token
+            await worker_a._renew_access_token('refresh')
+            last_used = worker_b.access_token_map['refresh']['last_used'] = time.time() - 1000
+            await worker_b._renew_access_token('refresh')
+            assert len(refreshes) == 2
+            assert worker_b.access_token_map['refresh']['access_token'] == 'access-2'
+            # 采用共享token不算一次使用，长期未使用的token仍会停止续期
+            assert worker_b.access_token_map['refresh']['last_used'] == last_used
+            
+            # 共享的token没有被其它worker续期时才向上游刷新
+            await worker_b._renew_access_token('refresh')
+            assert len(refreshes) == 3
+            assert worker_b.access_token_map['refresh']['access_token'] == 'access-3'
+        finally:
+            await worker_a.close()
+            await worker_b.close()
+            await backend.close()
+    asyncio.run(main())
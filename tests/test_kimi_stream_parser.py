@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from connect_codec import FLAG_END_STREAM, encode_envelope, error_status
+from kimi_client import KimiAPIError, KimiClient
+from kimi_stream_parser import KimiStreamParser
+from models import Message
+
+def _text(content: str) -> bytes:
+    message = {"op": "append", "mask": "block.text.content", "block": {"text": {"content": content}}}
+    return encode_envelope(json.dumps(message).encode('utf-8'))
+
+def _end_stream(body: dict) -> bytes:
+    return encode_envelope(json.dumps(body).encode('utf-8'), FLAG_END_STREAM)
+
+RATE_LIMITED = {"error": {"code": "resource_exhausted", "message": "too many requests"}}
+
+def test_clean_end_stream_is_complete():
+    parser = KimiStreamParser()
+    messages = list(parser.parse_stream_data(_text("你好") + _end_stream({})))
+    assert parser.extract_content_from_message(messages[0]) == "你好"
+    assert parser.get_stream_error(messages[1]) is None
+    assert parser.is_stream_complete(messages[1])
+
+def test_end_stream_error_is_not_complete():
+    parser = KimiStreamParser()
+    [message] = parser.parse_stream_data(_end_stream(RATE_LIMITED))
+    assert parser.get_stream_error(message) == RATE_LIMITED["error"]
+    assert not parser.is_stream_complete(message)
+
+@pytest.mark.parametrize("code, status", [
+    ("resource_exhausted", 429),
+    ("unauthenticated", 401),
+    ("permission_denied", 403),
+    ("internal", 502),
+    (None, 502),
+])
+def test_error_status(code, status):
+    assert error_status(code) == status
+
+def _collect(body: bytes):
+    """用给定的上游响应体运行chat_completion_stream，返回事件和抛出的异常"""
+    async def main():
+        client = KimiClient()
+        client.client = httpx.AsyncClient(
+            transport=httpx.MockTransport(lambda request: httpx.Response(200, content=body))
+        )
+        events = []
+        try:
+            async for event in client.chat_completion_stream("access", "conv", [Message(role="user", content="hi")]):
+                events.append(event)
+        except KimiAPIError as e:
+            return events, e
+        finally:
+            await client.close()
+        return events, None
+    return asyncio.run(main())
+
+def test_stream_error_midway_raises_instead_of_all_done():
+    events, error = _collect(_text("部分") + _end_stream(RATE_LIMITED))
+    assert [event.event for event in events] == ["req", "cmpl"]
+    assert error is not None and error.status_code == 429
+
+def test_clean_stream_yields_all_done():
+    events, error = _collect(_text("完整") + _end_stream({}))
+    assert error is None
+    assert [event.event for event in events] == ["req", "cmpl", "all_done"]
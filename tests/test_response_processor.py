@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from models import ChatCompletionStreamResponse, StreamChoice
+from response_processor import StreamChunkSerializer
+
+CHUNK_ID = "chatcmpl-19283746"
+CREATED = 1700000000
+MODEL = "Kimi-K2"
+
+EDGE_CASES = [
+    '',
+    ' ',
+    '你好，世界',
+    '"quoted"',
+    "'single'",
+    'back\\slash\\"',
+    '\n\r\t\b\f',
+    ''.join(chr(code) for code in range(0x20)),
+    '\x7f\x80\x9f',
+    '  ',
+    '😀𝄞',
+    '\U0010ffff',
+    '</script><!--',
+    '﻿�',
+]
+
+LONE_SURROGATES = ['\ud800', '\udfff', 'a\ud83db', '😀\ude00']
+
+def pydantic_chunk(delta, finish_reason=None) -> bytes:
+    chunk = ChatCompletionStreamResponse(
+        id=CHUNK_ID,
+        object="chat.completion.chunk",
+        created=CREATED,
+        model=MODEL,
+        choices=[StreamChoice(index=0, delta=delta, finish_reason=finish_reason)]
+    )
+    return f"data: {chunk.model_dump_json()}\n\n".encode('utf-8')
+
+def replace_surrogates(text: str) -> str:
+    """pydantic无法序列化孤立代理项，序列化器按utf-8的replace规则替换为'?'"""
+    return text.encode('utf-8', errors='replace').decode('utf-8')
+
+@pytest.fixture
+def serializer():
+    return StreamChunkSerializer(CHUNK_ID, CREATED, MODEL)
+
+@pytest.mark.parametrize("text", EDGE_CASES)
+def test_content_matches_pydantic(serializer, text):
+    assert serializer.content(text) == pydantic_chunk({"content": text})
+
+@pytest.mark.parametrize("text", EDGE_CASES)
+def test_chunk_matches_pydantic(serializer, text):
+    delta = {"role": "assistant", "content": text}
+    assert serializer.chunk(delta) == pydantic_chunk(delta)
+
+@pytest.mark.parametrize("finish_reason", [None, "stop", "length"])
+def test_finish_chunk_matches_pydantic(serializer, finish_reason):
+    assert serializer.chunk({}, finish_reason) == pydantic_chunk({}, finish_reason)
+
+@pytest.mark.parametrize("text", LONE_SURROGATES)
+def test_lone_surrogates_are_replaced(serializer, text):
+    expected = pydantic_chunk({"content": replace_surrogates(text)})
+    assert serializer.content(text) == expected
+    assert serializer.chunk({"content": text}) == expected
+
+def test_output_is_parseable_json(serializer):
+    for text in EDGE_CASES + LONE_SURROGATES:
+        body = serializer.content(text)
+        assert body.startswith(b'data: ') and body.endswith(b'\n\n')
+        payload = json.loads(body[len(b'data: '):].decode('utf-8'))
+        assert payload["choices"][0]["delta"]["content"] == replace_surrogates(text)
@@ -0,0 +1,314 @@
+import asyncio
+import time
+
+import pytest
+
+from state_backend import RedisError, RedisStateBackend, SQLiteStateBackend
+from api_keys import ApiKeyRegistry, ApiKeyRegistrySync
+from token_registry import TokenRegistry, TokenRegistrySync
+
+class FakeRedis:
+    """
+    进程内的精简RESP服务，实现RedisStateBackend用到的命令
+    delay非空时GET在回复前等待，用于模拟被取消的命令
+    """
+    
+    def __init__(self, password=None):
+        self.password = password
+        self.values = {}  # key -> (value, expires_at)
+        self.hashes = {}
+        self.connections = 0
+        self.commands = []
+        self.delay = None
+        self._server = None
+        self._writers = set()
+        self.port = None
+    
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+    
+    async def stop(self):
+        self.drop_connections()
+        self._server.close()
+        await self._server.wait_closed()
+    
+    def drop_connections(self):
+        """断开所有客户端连接（模拟Redis重启或网络中断）"""
+        for writer in list(self._writers):
+            writer.close()
+        self._writers.clear()
+    
+    @staticmethod
+    async def _read_command(reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        assert line[:1] == b'*'
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2].decode('utf-8'))
+        return args
+    
+    @staticmethod
+    def _encode(value) -> bytes:
+        if value is None:
+            return b'$-1\r\n'
+        if isinstance(value, bool):
+            return b'+OK\r\n'
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, list):
+            return b'*%d\r\n' % len(value) + b''.join(FakeRedis._encode(item) for item in value)
+        data = value.encode('utf-8')
+        return b'$%d\r\n%s\r\n' % (len(data), data)
+    
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self._writers.add(writer)
+        authenticated = self.password is None
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                name = args[0].upper()
+                self.commands.append(name)
+                if name == 'AUTH':
+                    authenticated = args[1] == self.password
+                    reply = b'+OK\r\n' if authenticated else b'-WRONGPASS invalid password\r\n'
+                elif not authenticated:
+                    reply = b'-NOAUTH Authentication required\r\n'
+                else:
+                    if name == 'GET' and self.delay:
+                        await asyncio.sleep(self.delay)
+                    try:
+                        reply = self._encode(self._execute(name, args[1:]))
+                    except ValueError as e:
+                        reply = b'-ERR %s\r\n' % str(e).encode('utf-8')
+                writer.write(reply)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+    
+    def _get(self, key):
+        item = self.values.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.time():
+            del self.values[key]
+            return None
+        return value
+    
+    def _execute(self, name, args):
+        if name == 'SELECT':
+            return True
+        if name == 'GET':
+            return self._get(args[0])
+        if name == 'SET':
+            expires_at = None
+            if len(args) == 4 and args[2].upper() == 'PX':
+                expires_at = time.time() + int(args[3]) / 1000
+            self.values[args[0]] = (args[1], expires_at)
+            return True
+        if name == 'DEL':
+            return int(self.values.pop(args[0], None) is not None)
+        if name == 'INCRBY':
+            current = self._get(args[0]) or '0'
+            if not current.lstrip('-').isdigit():
+                raise ValueError("value is not an integer or out of range")
+            value = int(current) + int(args[1])
+            self.values[args[0]] = (str(value), self.values.get(args[0], (None, None))[1])
+            return value
+        if name == 'HSET':
+            values = self.hashes.setdefault(args[0], {})
+            added = 0
+            for field, value in zip(args[1::2], args[2::2]):
+                added += field not in values
+                values[field] = value
+            return added
+        if name == 'HDEL':
+            values = self.hashes.get(args[0], {})
+            return sum(values.pop(field, None) is not None for field in args[1:])
+        if name == 'HGETALL':
+            return [item for pair in self.hashes.get(args[0], {}).items() for item in pair]
+        raise ValueError(f"unknown command '{name}'")
+
+def run_redis(test, password=None):
+    """启动FakeRedis并以对应的RedisStateBackend运行测试协程"""
+    async def main():
+        server = FakeRedis(password)
+        await server.start()
+        auth = f':{password}@' if password else ''
+        backend = RedisStateBackend(f'redis://{auth}127.0.0.1:{server.port}/1')
+        try:
+            await test(server, backend)
+        finally:
+            await backend.close()
+            await server.stop()
+    asyncio.run(main())
+
+def test_redis_get_set_with_px():
+    async def test(server, backend):
+        assert await backend.get('missing') is None
+        await backend.set('plain', 'value')
+        await backend.set('short', '值', ttl=0.05)
+        assert await backend.get('plain') == 'value'
+        assert await backend.get('short') == '值'
+        assert server.values['short'][1] is not None
+        await asyncio.sleep(0.1)
+        assert await backend.get('short') is None
+        assert await backend.get('plain') == 'value'
+        await backend.delete('plain')
+        assert await backend.get('plain') is None
+    run_redis(test)
+
+def test_redis_incrby():
+    async def test(server, backend):
+        assert await backend.incr('cursor') == 1
+        assert await backend.incr('cursor', 5) == 6
+        assert await backend.incr('cursor', -2) == 4
+        await backend.set('text', 'abc')
+        with pytest.raises(RedisError):
+            await backend.incr('text')
+        assert await backend.incr('cursor') == 5
+    run_redis(test)
+
+def test_redis_hash_commands():
+    async def test(server, backend):
+        await backend.hset('tokens', {})
+        assert 'HSET' not in server.commands
+        await backend.hset('tokens', {'1': '{"token": "a"}', '2': '{"token": "b"}'})
+        await backend.hset('tokens', {'2': '{"token": "c"}'})
+        assert await backend.hgetall('tokens') == {'1': '{"token": "a"}', '2': '{"token": "c"}'}
+        await backend.hdel('tokens', '1', 'missing')
+        assert await backend.hgetall('tokens') == {'2': '{"token": "c"}'}
+        assert await backend.hgetall('empty') == {}
+    run_redis(test)
+
+def test_redis_auth_and_select_on_connect():
+    async def test(server, backend):
+        await backend.set('key', 'value')
+        assert server.commands[:3] == ['AUTH', 'SELECT', 'SET']
+    run_redis(test, password='p@ss')
+
+def test_redis_reconnects_after_connection_drop():
+    async def test(server, backend):
+        await backend.set('key', 'value')
+        assert server.connections == 1
+        server.drop_connections()
+        await asyncio.sleep(0.01)
+        assert await backend.get('key') == 'value'
+        assert server.connections == 2
+    run_redis(test)
+
+def test_redis_cancelled_command_does_not_desync_connection():
+    async def test(server, backend):
+        await backend.set('a', '1')
+        await backend.set('b', '2')
+        server.delay = 0.05
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(backend.get('a'), 0.01)
+        server.delay = None
+        # 被取消命令的回复不能被下一个命令读到
+        assert await backend.get('b') == '2'
+        assert server.connections == 2
+    run_redis(test)
+
+def test_sqlite_backend(tmp_path):
+    async def main():
+        backend = SQLiteStateBackend(str(tmp_path / 'state.db'))
+        try:
+            await backend.set('key', 'value')
+            await backend.set('short', 'value', ttl=0.05)
+            assert await backend.get('key') == 'value'
+            assert await backend.get('short') == 'value'
+            await asyncio.sleep(0.1)
+            assert await backend.get('short') is None
+            assert await backend.incr('cursor') == 1
+            assert await backend.incr('cursor', 5) == 6
+            await backend.hset('tokens', {'1': 'a', '2': 'b'})
+            await backend.hdel('tokens', '1')
+            assert await backend.hgetall('tokens') == {'2': 'b'}
+        finally:
+            await backend.close()
+    asyncio.run(main())
+
+def test_token_registry_sync_between_two_workers(tmp_path):
+    async def main():
+        backend = SQLiteStateBackend(str(tmp_path / 'state.db'))
+        workers = [TokenRegistrySync(TokenRegistry(), backend) for _ in range(2)]
+        
+        async def add(sync, token):
+            token_info = {'id': await sync.allocate_id(), 'token': token,
+                          'exp_time': time.time() + 30 * 24 * 3600, 'is_expired': False}
+            sync.registry.add(token_info)
+            await sync.publish([token_info], [])
+        
+        async def pull_all():
+            for sync in workers:
+                await sync.pull()
+        
+        try:
+            worker_a, worker_b = workers
+            await add(worker_a, 't1')
+            await pull_all()
+            await add(worker_b, 't2')
+            # worker_a发布时版本号已被worker_b递增过，不能跳过worker_b的修改
+            await add(worker_a, 't3')
+            await pull_all()
+            assert sorted(worker_a.registry.active_tokens()) == ['t1', 't2', 't3']
+            assert sorted(worker_b.registry.active_tokens()) == ['t1', 't2', 't3']
+            
+            removed = worker_b.registry.remove(worker_b.registry.get('t1')['id'])
+            await worker_b.publish([], [removed])
+            await pull_all()
+            assert sorted(worker_a.registry.active_tokens()) == ['t2', 't3']
+        finally:
+            await backend.close()
+    asyncio.run(main())
+
+def test_api_key_sync_between_two_workers(tmp_path):
+    async def main():
+        backend = SQLiteStateBackend(str(tmp_path / 'state.db'))
+        workers = [
+            ApiKeyRegistrySync(ApiKeyRegistry(str(tmp_path / f'api_keys_{index}.json')), backend)
+            for index in range(2)
+        ]
+        
+        async def pull_all():
+            for sync in workers:
+                await sync.pull()
+        
+        try:
+            worker_a, worker_b = workers
+            for sync in workers:
+                await sync.start()
+            api_key, raw_key = worker_a.registry.create({'name': 'team', 'rps': 5})
+            await worker_a.publish([worker_a.registry.record(api_key)], [])
+            await pull_all()
+            shared = worker_b.registry.authenticate(raw_key)
+            assert shared is not None and shared.rps == 5
+            
+            # 配额修改原地更新，保留worker_b上的并发占用
+            shared.active = 2
+            worker_a.registry.update(api_key.id, {'rps': None, 'max_concurrency': 3})
+            await worker_a.publish([worker_a.registry.record(api_key)], [])
+            await pull_all()
+            assert worker_b.registry.authenticate(raw_key) is shared
+            assert (shared.rps, shared.max_concurrency, shared.active) == (0.0, 3, 2)
+            
+            worker_b.registry.remove(api_key.id)
+            await worker_b.publish([], [api_key.id])
+            await pull_all()
+            assert worker_a.registry.authenticate(raw_key) is None
+        finally:
+            for sync in workers:
+                await sync.close()
+            await backend.close()
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+import time
+import uuid
+import asyncio
+from typing import Dict, Any, List, Optional, Awaitable
+
+class TokenImportJob:
+    """一次token导入的进度"""
+    
+    def __init__(self, total: int):
+        self.id = uuid.uuid4().hex[:12]
+        self.status = 'pending'  # pending | running | done | failed | cancelled
+        self.total = total
+        self.processed = 0
+        self.added = 0
+        self.skipped = 0  # 空行、重复或已存在的token
+        self.invalid = 0  # 无法解析的JWT
+        self.refresh_failed = 0  # 已添加但获取access token失败
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+    
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.finished_at or time.time()
+        return {
+            'id': self.id,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'added': self.added,
+            'skipped': self.skipped,
+            'invalid': self.invalid,
+            'refresh_failed': self.refresh_failed,
+            'progress': round(self.processed / self.total, 4) if self.total else 1.0,
+            'error': self.error,
+            'elapsed': round(end - self.created_at, 2)
+        }
+
+class TokenImportJobs:
+    """
+    后台token导入任务管理
+    大批量导入在后台执行，接口立即返回任务id，前端轮询进度；只保留最近完成的任务记录
+    """
+    
+    MAX_FINISHED = 20
+    
+    def __init__(self):
+        self._jobs: Dict[str, TokenImportJob] = {}
+        self._tasks: set = set()
+    
+    def create(self, total: int) -> TokenImportJob:
+        job = TokenImportJob(total)
+        self._jobs[job.id] = job
+        self._prune()
+        return job
+    
+    def run(self, job: TokenImportJob, coro: Awaitable):
+        """在后台执行导入"""
+        task = asyncio.create_task(self._run(job, coro))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _run(self, job: TokenImportJob, coro: Awaitable):
+        job.status = 'running'
+        try:
+            await coro
+            job.status = 'done'
+        except asyncio.CancelledError:
+            job.status = 'cancelled'
+            raise
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+    
+    def get(self, job_id: str) -> Optional[TokenImportJob]:
+        return self._jobs.get(job_id)
+    
+    def list(self) -> List[Dict[str, Any]]:
+        return [job.to_dict() for job in sorted(self._jobs.values(), key=lambda j: -j.created_at)]
+    
+    async def close(self):
+        """取消未完成的导入，已导入的token不受影响"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    def _prune(self):
+        finished = sorted((job for job in self._jobs.values() if job.finished), key=lambda j: j.created_at)
+        for job in finished[:max(len(finished) - self.MAX_FINISHED, 0)]:
+            del self._jobs[job.id]
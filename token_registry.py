@@ -0,0 +1,220 @@
+import json
+import time
+import heapq
+import asyncio
+import threading
+from itertools import islice
+from typing import Dict, Any, List, Optional
+
+class TokenRegistry:
+    """
+    Refresh token注册表
+    按token建立哈希索引，id单调递增不复用，用最小堆按过期时间清理（O(log n)），
+    有效token列表缓存为快照，只有集合变化或快照中有token到达过期阈值时才重建
+    """
+    
+    def __init__(self, expiry_threshold: int = 24 * 3600):
+        self.expiry_threshold = expiry_threshold
+        self._by_id: Dict[int, Dict[str, Any]] = {}
+        self._by_token: Dict[str, Dict[str, Any]] = {}
+        self._expiry_heap: List[tuple] = []  # (过期阈值时间, id)，删除的token延迟出堆
+        self._next_id = 1
+        self._active_snapshot: Optional[List[str]] = None
+        self._snapshot_expires = 0.0  # 快照中最早到达过期阈值的时间
+        self._lock = threading.RLock()
+    
+    def __len__(self) -> int:
+        return len(self._by_id)
+    
+    def __contains__(self, token: str) -> bool:
+        return token in self._by_token
+    
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        return self._by_token.get(token)
+    
+    def add(self, token_info: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """添加token，未指定id时分配新id，已存在时返回None"""
+        with self._lock:
+            token = token_info['token']
+            if token in self._by_token:
+                return None
+            if token_info.get('id') is None:
+                token_info['id'] = self._next_id
+            self._next_id = max(self._next_id, token_info['id'] + 1)
+            self._by_id[token_info['id']] = token_info
+            self._by_token[token] = token_info
+            heapq.heappush(self._expiry_heap, (token_info['exp_time'] - self.expiry_threshold, token_info['id']))
+            self._active_snapshot = None
+            return token_info
+    
+    @property
+    def next_id(self) -> int:
+        return self._next_id
+    
+    def load(self, tokens: List[Dict[str, Any]], next_id: int = 1, replace: bool = False):
+        """加载token并保留原有id，replace为True时替换现有全部token"""
+        with self._lock:
+            if replace:
+                self._by_id = {}
+                self._by_token = {}
+                self._expiry_heap = []
+            for token_info in tokens:
+                if token_info['token'] in self._by_token:
+                    continue
+                self._by_id[token_info['id']] = token_info
+                self._by_token[token_info['token']] = token_info
+                self._expiry_heap.append((token_info['exp_time'] - self.expiry_threshold, token_info['id']))
+                self._next_id = max(self._next_id, token_info['id'] + 1)
+            heapq.heapify(self._expiry_heap)
+            self._next_id = max(self._next_id, next_id)
+            self._active_snapshot = None
+    
+    def remove(self, token_id: int) -> Optional[Dict[str, Any]]:
+        """按id删除token，堆中的记录在出堆时跳过"""
+        with self._lock:
+            token_info = self._by_id.pop(token_id, None)
+            if token_info is None:
+                return None
+            self._by_token.pop(token_info['token'], None)
+            self._compact_heap()
+            self._active_snapshot = None
+            return token_info
+    
+    def cleanup_expired(self, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """移除即将过期（阈值内）的token，返回被移除的token"""
+        now = time.time() if now is None else now
+        removed = []
+        with self._lock:
+            heap = self._expiry_heap
+            while heap and heap[0][0] <= now:
+                _, token_id = heapq.heappop(heap)
+                token_info = self._by_id.pop(token_id, None)
+                if token_info is None:
+                    continue
+                self._by_token.pop(token_info['token'], None)
+                removed.append(token_info)
+            
+            self._compact_heap()
+            if removed:
+                self._active_snapshot = None
+        return removed
+    
+    def _compact_heap(self):
+        """已删除的记录过多时重建堆，避免堆无限增长"""
+        if len(self._expiry_heap) > 2 * len(self._by_id) + 64:
+            self._expiry_heap = [item for item in self._expiry_heap if item[1] in self._by_id]
+            heapq.heapify(self._expiry_heap)
+    
+    def active_tokens(self) -> List[str]:
+        """
+        获取有效token列表（缓存快照，调用方不应修改）
+        只过滤已到达过期阈值的token，不从注册表中移除（由cleanup_expired负责）
+        """
+        snapshot = self._active_snapshot
+        if snapshot is not None and time.time() < self._snapshot_expires:
+            return snapshot
+        
+        with self._lock:
+            now = time.time()
+            if self._active_snapshot is None or now >= self._snapshot_expires:
+                tokens = []
+                expires = float('inf')
+                for token_info in self._by_id.values():
+                    deadline = token_info['exp_time'] - self.expiry_threshold
+                    if token_info.get('is_expired', False) or deadline <= now:
+                        continue
+                    tokens.append(token_info['token'])
+                    expires = min(expires, deadline)
+                self._snapshot_expires = expires
+                self._active_snapshot = tokens
+            return self._active_snapshot
+    
+    def all(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._by_id.values())
+    
+    def page(self, page: int, per_page: int) -> List[Dict[str, Any]]:
+        """按添加顺序分页"""
+        start = max(page - 1, 0) * per_page
+        with self._lock:
+            return list(islice(self._by_id.values(), start, start + per_page))
+
+class TokenRegistrySync:
+    """
+    通过共享状态后端在多个worker之间同步token注册表
+    token id由后端原子分配；任一worker修改后递增版本号，其它worker定期检查版本并整体重新加载
+    """
+    
+    TOKENS_KEY = 'kimi2api:tokens'
+    VERSION_KEY = 'kimi2api:tokens:version'
+    ID_KEY = 'kimi2api:tokens:next_id'
+    
+    def __init__(self, registry: TokenRegistry, backend, interval: float = 1.0):
+        self.registry = registry
+        self.backend = backend
+        self.interval = interval
+        self._version = None
+        self._task: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        """启动时以后端为准；后端为空时把本地token发布出去"""
+        if not self.backend.shared:
+            return
+        if not await self.pull():
+            await self.publish(self.registry.all(), [])
+            current = await self.backend.incr(self.ID_KEY, 0)
+            if current < self.registry.next_id - 1:
+                await self.backend.incr(self.ID_KEY, self.registry.next_id - 1 - current)
+        self._task = asyncio.create_task(self._sync_loop())
+    
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+    
+    async def allocate_id(self) -> Optional[int]:
+        """分配全局唯一的token id，本地后端返回None由注册表自行分配"""
+        if not self.backend.shared:
+            return None
+        return await self.backend.incr(self.ID_KEY)
+    
+    async def publish(self, added: List[Dict[str, Any]], removed: List[Dict[str, Any]]):
+        """发布本worker的修改"""
+        if not self.backend.shared or not (added or removed):
+            return
+        if added:
+            await self.backend.hset(self.TOKENS_KEY, {
+                str(token_info['id']): json.dumps(token_info, ensure_ascii=False) for token_info in added
+            })
+        if removed:
+            await self.backend.hdel(self.TOKENS_KEY, *[str(token_info['id']) for token_info in removed])
+        previous = self._version
+        version = await self.backend.incr(self.VERSION_KEY)
+        if previous is not None and version == previous + 1:
+            self._version = version
+        else:
+            # 期间有其它worker发布过修改，下次同步时整体重新加载，不能直接采用新版本号
+            self._version = None
+    
+    async def pull(self) -> bool:
+        """版本变化时从后端重新加载全部token，后端没有数据时返回False"""
+        version = await self.backend.get(self.VERSION_KEY)
+        if version is None:
+            return False
+        version = int(version)
+        if version != self._version:
+            values = await self.backend.hgetall(self.TOKENS_KEY)
+            tokens = sorted((json.loads(value) for value in values.values()), key=lambda t: t['id'])
+            self.registry.load(tokens, replace=True)
+            self._version = version
+        return True
+    
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.pull()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass
@@ -0,0 +1,186 @@
+import time
+import random
+import threading
+from typing import Dict, Any, List, Optional
+from config import Config
+
+class _TokenState:
+    """单个refresh token的负载与健康状态"""
+    __slots__ = ('in_flight', 'error_rate', 'latency', 'failures', 'cooldown_until',
+                 'requests', 'errors', 'rate_limited', 'unauthorized')
+    
+    def __init__(self):
+        self.in_flight = 0
+        self.error_rate = 0.0  # 错误率的指数滑动平均
+        self.latency = 0.0  # 首字延迟的指数滑动平均（秒），0表示尚无样本
+        self.failures = 0  # 连续失败次数，决定冷却时长
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.unauthorized = 0
+
+class TokenScheduler:
+    """
+    负载与健康感知的refresh token调度器
+    在随机采样的候选中选择负载最低的健康token（power of d choices，token数量很大时也是O(1)），
+    失败的token按指数退避进入冷却，可限制单个token的并发流数
+    """
+    
+    EWMA_ALPHA = 0.2
+    LATENCY_SCALE = 10.0
+    
+    def __init__(self):
+        self._states: Dict[str, _TokenState] = {}
+        self._lock = threading.Lock()
+        self._cursor = 0
+    
+    def _state(self, token: str) -> _TokenState:
+        state = self._states.get(token)
+        if state is None:
+            state = self._states[token] = _TokenState()
+        return state
+    
+    def _is_available(self, token: str, now: float) -> bool:
+        state = self._states.get(token)
+        if state is None:
+            return True
+        if state.cooldown_until > now:
+            return False
+        return not (Config.MAX_STREAMS_PER_TOKEN and state.in_flight >= Config.MAX_STREAMS_PER_TOKEN)
+    
+    def is_cooling_down(self, token: str) -> bool:
+        """token是否处于失败冷却期"""
+        state = self._states.get(token)
+        return state is not None and state.cooldown_until > time.time()
+    
+    def _score(self, token: str) -> float:
+        """
+        负载评分，越小越优先
+        以并发流数为主，错误率和首字延迟作为惩罚系数；取两位小数，
+        使负载相近的token得分相同，按轮询顺序分摊请求
+        """
+        state = self._states.get(token)
+        if state is None:
+            return 1.0
+        score = (state.in_flight + 1) * (1 + 4 * state.error_rate) * (1 + state.latency / self.LATENCY_SCALE)
+        return round(score, 2)
+    
+    def _candidates(self, tokens: List[str], cursor: int) -> List[str]:
+        """token较少时全部参与比较，否则从轮询位置附近随机采样"""
+        sample_size = Config.TOKEN_SCHEDULER_SAMPLE
+        if len(tokens) <= sample_size * 4:
+            start = cursor % len(tokens)
+            return tokens[start:] + tokens[:start]
+        return [tokens[index] for index in random.sample(range(len(tokens)), sample_size)]
+    
+    def acquire(self, tokens: List[str], cursor: Optional[int] = None) -> Optional[str]:
+        """
+        选择一个token并登记一个进行中的流，无可用token时返回None
+        多worker部署时可传入共享的轮询位置，使各worker的轮询顺序互相错开
+        """
+        if not tokens:
+            return None
+        
+        now = time.time()
+        with self._lock:
+            self._cursor += 1
+            best = None
+            best_score = 0.0
+            for token in self._candidates(tokens, self._cursor if cursor is None else cursor):
+                if not self._is_available(token, now):
+                    continue
+                score = self._score(token)
+                if best is None or score < best_score:
+                    best, best_score = token, score
+            
+            if best is None:
+                # 采样未命中时完整扫描一次，仍没有则所有token都不可用
+                best = next((token for token in tokens if self._is_available(token, now)), None)
+                if best is None:
+                    return None
+            
+            state = self._state(best)
+            state.in_flight += 1
+            state.requests += 1
+            return best
+    
+    def record_latency(self, token: str, latency: float):
+        """记录首字延迟"""
+        with self._lock:
+            state = self._states.get(token)
+            if state is None:
+                return
+            if state.latency:
+                state.latency += self.EWMA_ALPHA * (latency - state.latency)
+            else:
+                state.latency = latency
+    
+    def release(self, token: str, error: Optional[Exception] = None):
+        """流结束时释放token，并根据结果更新健康状态"""
+        status_code = getattr(error, 'status_code', None)
+        with self._lock:
+            state = self._states.get(token)
+            if state is None:
+                return
+            state.in_flight = max(state.in_flight - 1, 0)
+            
+            if error is None:
+                state.error_rate -= self.EWMA_ALPHA * state.error_rate
+                state.failures = 0
+                return
+            
+            state.errors += 1
+            state.error_rate += self.EWMA_ALPHA * (1 - state.error_rate)
+            state.failures += 1
+            if status_code == 429:
+                state.rate_limited += 1
+            elif status_code == 401:
+                state.unauthorized += 1
+            
+            # 限流、鉴权失败或连续失败时进入指数退避冷却
+            if status_code in (401, 429) or state.failures >= Config.TOKEN_FAILURE_THRESHOLD:
+                cooldown = min(
+                    Config.TOKEN_COOLDOWN_BASE * 2 ** (state.failures - 1),
+                    Config.TOKEN_COOLDOWN_MAX
+                )
+                state.cooldown_until = time.time() + cooldown
+    
+    def discard(self, token: str):
+        """移除token的调度状态（token被删除时调用）"""
+        with self._lock:
+            self._states.pop(token, None)
+    
+    def get_counters(self) -> List[tuple]:
+        """获取各token的(token, 请求数, 错误数, 限流数, 进行中的流数)快照，供指标导出"""
+        with self._lock:
+            return [
+                (token, state.requests, state.errors, state.rate_limited, state.in_flight)
+                for token, state in self._states.items()
+            ]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取调度器统计信息"""
+        now = time.time()
+        with self._lock:
+            tokens = []
+            for token, state in self._states.items():
+                tokens.append({
+                    'refresh_token': token[:15] + '...',
+                    'in_flight': state.in_flight,
+                    'error_rate': round(state.error_rate, 3),
+                    'latency': round(state.latency, 3),
+                    'cooldown_remaining': max(round(state.cooldown_until - now, 1), 0),
+                    'requests': state.requests,
+                    'errors': state.errors,
+                    'rate_limited': state.rate_limited,
+                    'unauthorized': state.unauthorized
+                })
+        tokens.sort(key=lambda t: (-t['cooldown_remaining'], -t['in_flight']))
+        return {
+            'tracked_tokens': len(tokens),
+            'in_flight': sum(t['in_flight'] for t in tokens),
+            'cooling_down': sum(1 for t in tokens if t['cooldown_remaining'] > 0),
+            'max_streams_per_token': Config.MAX_STREAMS_PER_TOKEN,
+            'tokens': tokens[:100]
+        }
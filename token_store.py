@@ -0,0 +1,119 @@
+import json
+import time
+import sqlite3
+import threading
+from typing import Dict, Any, List, Optional, Iterable
+
+class TokenStore:
+    """
+    基于SQLite（WAL模式）的token持久化存储
+    保存refresh token及其元数据和仍然有效的access token，
+    重启后直接加载，无需重新导入，也不会对所有token同时发起刷新
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS refresh_tokens (
+                id INTEGER PRIMARY KEY,
+                token TEXT NOT NULL UNIQUE,
+                exp_time INTEGER NOT NULL,
+                info TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS access_tokens (
+                refresh_token TEXT PRIMARY KEY,
+                access_token TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+    
+    def load_tokens(self) -> List[Dict[str, Any]]:
+        """按id顺序加载所有refresh token"""
+        with self._lock:
+            rows = self._conn.execute("SELECT info FROM refresh_tokens ORDER BY id").fetchall()
+        return [json.loads(row[0]) for row in rows]
+    
+    def get_next_id(self) -> int:
+        """获取持久化的下一个token id，保证重启后id仍不复用"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'next_token_id'").fetchone()
+        return int(row[0]) if row else 1
+    
+    def save_tokens(self, tokens: Iterable[Dict[str, Any]], next_id: int):
+        """在一个事务中批量写入refresh token"""
+        rows = [(t['id'], t['token'], t['exp_time'], json.dumps(t, ensure_ascii=False)) for t in tokens]
+        with self._lock:
+            with self._transaction():
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO refresh_tokens (id, token, exp_time, info) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('next_token_id', ?)",
+                    (str(next_id),)
+                )
+    
+    def remove_tokens(self, tokens: Iterable[str]):
+        """删除refresh token及其access token"""
+        rows = [(token,) for token in tokens]
+        if not rows:
+            return
+        with self._lock:
+            with self._transaction():
+                self._conn.executemany("DELETE FROM refresh_tokens WHERE token = ?", rows)
+                self._conn.executemany("DELETE FROM access_tokens WHERE refresh_token = ?", rows)
+    
+    def get_access_token(self, refresh_token: str) -> Optional[Dict[str, Any]]:
+        """获取仍未过期的access token"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT access_token, expires_at FROM access_tokens WHERE refresh_token = ? AND expires_at > ?",
+                (refresh_token, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        return {'access_token': row[0], 'expires_at': row[1]}
+    
+    def save_access_token(self, refresh_token: str, access_token: str, expires_at: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO access_tokens (refresh_token, access_token, expires_at) VALUES (?, ?, ?)",
+                (refresh_token, access_token, expires_at)
+            )
+    
+    def remove_access_token(self, refresh_token: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM access_tokens WHERE refresh_token = ?", (refresh_token,))
+    
+    def purge_expired_access_tokens(self) -> int:
+        """清理已过期的access token"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM access_tokens WHERE expires_at <= ?", (time.time(),))
+        return cursor.rowcount
+    
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+class _Transaction:
+    """autocommit连接上的显式事务"""
+    
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+    
+    def __enter__(self):
+        self.conn.execute("BEGIN")
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")